@@ -0,0 +1,358 @@
+"""
+End-to-end benchmark: MQTT request -> fetcher -> completion -> puller.
+
+Everything runs locally: the in-process MQTT broker, a synthetic HTTP/HLS
+origin with configurable latency and bandwidth, and two fake aria2
+servers (one for the fetcher, one for the puller). fetcher and puller run
+as real subprocesses. HTTP requests go through aria2 (fake, completing
+after --complete-after seconds), m3u8 requests through the native HLS
+engine against the origin.
+
+Reports messages per second, request-to-completion latency (p50/p99) of
+the fetcher and of the whole pipeline up to the puller's download, and
+peak RSS and CPU time of both processes (Linux /proc). Prints one JSON
+object, also written to --output, so runs can be compared across versions.
+
+    python benchmarks/bench_e2e.py --requests 2000 --m3u8-ratio 0.1
+"""
+import argparse
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import paho.mqtt.client as mqtt
+
+from fake_aria2 import make_server
+from mqtt_broker import Broker
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, 'src')
+REQUEST_TOPIC = 'bench/request'
+COMPLETE_TOPIC = 'bench/complete'
+NAME = re.compile(r'bench-(\d+)')
+
+
+class Origin(ThreadingHTTPServer):
+    """
+    Synthetic origin. /hls/<id>.m3u8 is a media playlist of ``segments``
+    segments at /seg/<id>_<n>.ts; /file/<name> is a ``file_size`` byte
+    file. Every response waits ``latency`` seconds and is sent at
+    ``bandwidth`` bytes/s (0 for unlimited).
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency=0.0, bandwidth=0, segments=4, segment_size=32 * 1024, file_size=1 << 20):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.segments = segments
+        self.segment_size = segment_size
+        self.file_size = file_size
+        self.requests = 0
+        super().__init__(('127.0.0.1', 0), OriginHandler)
+
+    def body(self, path):
+        if path.startswith('/hls/') and path.endswith('.m3u8'):
+            stream = path[len('/hls/'):-len('.m3u8')]
+            lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:4']
+            for n in range(self.segments):
+                lines += ['#EXTINF:4,', f"/seg/{stream}_{n}.ts"]
+            lines.append('#EXT-X-ENDLIST')
+            return ('\n'.join(lines) + '\n').encode(), 'application/vnd.apple.mpegurl'
+        if path.startswith('/seg/'):
+            return b'\x47' * self.segment_size, 'video/mp2t'
+        if path.startswith('/file/'):
+            return b'\0' * self.file_size, 'application/octet-stream'
+        return None, None
+
+
+class OriginHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        origin = self.server
+        origin.requests += 1
+        if origin.latency:
+            time.sleep(origin.latency)
+        body, content_type = origin.body(self.path.split('?')[0])
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        chunk = 16 * 1024
+        for offset in range(0, len(body), chunk):
+            self.wfile.write(body[offset:offset + chunk])
+            if origin.bandwidth:
+                time.sleep(chunk / origin.bandwidth)
+
+
+class ProcessSampler:
+    """Peak RSS and CPU seconds of a process, read from /proc."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.peak_rss = 0
+        self._cpu_start = self.cpu_seconds()
+
+    def rss(self):
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    def cpu_seconds(self):
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        except OSError:
+            return 0.0
+
+    def sample(self):
+        self.peak_rss = max(self.peak_rss, self.rss())
+
+    def reset_cpu(self):
+        self._cpu_start = self.cpu_seconds()
+
+    def result(self):
+        return {
+            'rss_peak_mb': round(self.peak_rss / 2 ** 20, 1),
+            'cpu_seconds': round(self.cpu_seconds() - self._cpu_start, 2),
+        }
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def latency_summary(values):
+    return {
+        'p50_ms': round(percentile(values, 0.5) * 1000, 1) if values else None,
+        'p99_ms': round(percentile(values, 0.99) * 1000, 1) if values else None,
+        'max_ms': round(max(values) * 1000, 1) if values else None,
+    }
+
+
+def start_fake_aria2(complete_after):
+    server, fake = make_server(secret='bench', complete_after=complete_after)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake
+
+
+def start_process(script, work_dir, args, log_name):
+    os.makedirs(work_dir, exist_ok=True)
+    log = open(os.path.join(work_dir, log_name), 'w')
+    # Own directory: no config.toml is picked up, logs and job store stay there
+    return subprocess.Popen([sys.executable, os.path.join(SRC, script), *args], cwd=work_dir, stdout=log, stderr=log)
+
+
+def git_version():
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], cwd=ROOT, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end benchmark of fetcher and puller')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--m3u8-ratio', type=float, default=0.1, help='Share of m3u8 requests, the rest are HTTP')
+    parser.add_argument('--batch', type=int, default=1, help='Requests per MQTT message (JSONL bulk payloads)')
+    parser.add_argument('--origin-latency', type=float, default=0.0, help='Seconds before every origin response')
+    parser.add_argument('--origin-bandwidth', type=int, default=0, help='Origin bytes/s per response (0 for unlimited)')
+    parser.add_argument('--segments', type=int, default=4, help='Segments per HLS stream')
+    parser.add_argument('--segment-size', type=int, default=32 * 1024)
+    parser.add_argument('--complete-after', type=float, default=0.05, help='Seconds until fake aria2 downloads complete')
+    parser.add_argument('--http-workers', type=int, default=16)
+    parser.add_argument('--m3u8-workers', type=int, default=4)
+    parser.add_argument('--pull-workers', type=int, default=8)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--output', help='Also write the JSON result to this file')
+    parser.add_argument('--keep', action='store_true', help='Keep the work directory (logs, job stores)')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bench_e2e_')
+    broker = Broker(port=0).start()
+    origin = Origin(args.origin_latency, args.origin_bandwidth, args.segments, args.segment_size)
+    threading.Thread(target=origin.serve_forever, daemon=True).start()
+    origin_url = f"http://127.0.0.1:{origin.server_address[1]}"
+    fetch_aria2, _ = start_fake_aria2(args.complete_after)
+    pull_aria2, pull_fake = start_fake_aria2(args.complete_after)
+
+    common = [
+        '--broker', '127.0.0.1', '--port', str(broker.port), '--qos', '1',
+        '--topic-subscribe', REQUEST_TOPIC, '--topic-publish', COMPLETE_TOPIC,
+        '--job-store-dir', 'data', '--aria2-rpc-host', 'http://127.0.0.1', '--aria2-rpc-token', 'bench',
+    ]
+    fetcher = start_process('fetcher.py', os.path.join(work_dir, 'fetcher'), [
+        *common, '--aria2-rpc-port', str(fetch_aria2.server_address[1]),
+        '--topic-cancel', '', '--topic-bandwidth', '', '--progress-interval', '0', '--cache-enable', '0',
+        '--download-dir', 'downloads', '--download-prefix-url', f"{origin_url}/file/",
+        '--http-workers', str(args.http_workers), '--m3u8-workers', str(args.m3u8_workers),
+        '--hls-backend', 'native',
+    ], 'fetcher.out')
+    puller = start_process('puller.py', os.path.join(work_dir, 'puller'), [
+        *common, '--aria2-rpc-enable', '1', '--aria2-rpc-port', str(pull_aria2.server_address[1]),
+        '--aria2-download-dir', 'pulled', '--pull-workers', str(args.pull_workers),
+    ], 'puller.out')
+    samplers = {'fetcher': ProcessSampler(fetcher.pid), 'puller': ProcessSampler(puller.pid)}
+
+    sent = {}
+    completed = {}
+    errors = 0
+    all_done = threading.Event()
+    lock = threading.Lock()
+
+    def on_message(client, userdata, msg):
+        nonlocal errors
+        now = time.time()
+        data = json.loads(msg.payload)
+        match = NAME.search(data.get('name') or '')
+        if not match:
+            return
+        with lock:
+            completed[int(match.group(1))] = now
+            if data.get('status') != 'success':
+                errors += 1
+            if len(completed) >= args.requests:
+                all_done.set()
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, protocol=mqtt.MQTTv5)
+    client.max_inflight_messages_set(1000)
+    client.max_queued_messages_set(0)
+    client.on_message = on_message
+    client.connect('127.0.0.1', broker.port)
+    client.subscribe(COMPLETE_TOPIC, qos=1)
+    client.loop_start()
+
+    stop_sampling = threading.Event()
+
+    def sample():
+        while not stop_sampling.wait(0.2):
+            for sampler in samplers.values():
+                sampler.sample()
+
+    try:
+        # Wait for fetcher and puller to subscribe
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            filters = [f for session in list(broker.subscriptions.values()) for f in session]
+            if REQUEST_TOPIC in filters and filters.count(COMPLETE_TOPIC) >= 2:
+                break
+            time.sleep(0.1)
+        else:
+            raise RuntimeError(f"fetcher/puller did not subscribe, see logs in {work_dir}")
+
+        for sampler in samplers.values():
+            sampler.reset_cpu()
+        threading.Thread(target=sample, daemon=True).start()
+
+        m3u8_every = round(1 / args.m3u8_ratio) if args.m3u8_ratio > 0 else 0
+        start = time.time()
+        batch = []
+        for i in range(args.requests):
+            if m3u8_every and i % m3u8_every == 0:
+                request = {'url': f"{origin_url}/hls/{i}.m3u8", 'name': f"bench-{i}"}
+            else:
+                request = {'url': f"{origin_url}/file/bench-{i}.bin", 'name': f"bench-{i}"}
+            batch.append(json.dumps(request))
+            if len(batch) >= args.batch or i == args.requests - 1:
+                now = time.time()
+                for line in batch:
+                    sent[int(NAME.search(line).group(1))] = now
+                client.publish(REQUEST_TOPIC, '\n'.join(batch), qos=1)
+                batch = []
+        publish_seconds = time.time() - start
+
+        all_done.wait(args.timeout)
+        fetch_seconds = (max(completed.values()) if completed else time.time()) - start
+
+        # The puller has the file once its aria2 download completes
+        successes = len(completed) - errors
+        deadline = time.time() + min(args.timeout, 60)
+        while len(pull_fake.downloads) < successes and time.time() < deadline:
+            time.sleep(0.1)
+        time.sleep(args.complete_after + 0.5)
+        pulled = {}
+        for download in list(pull_fake.downloads.values()):
+            match = NAME.search(download['uris'][0])
+            if match:
+                pulled[int(match.group(1))] = download['added'] + args.complete_after
+        pull_seconds = (max(pulled.values()) if pulled else time.time()) - start
+
+        stop_sampling.set()
+        fetch_latency = [completed[i] - sent[i] for i in completed if i in sent]
+        pipeline_latency = [pulled[i] - sent[i] for i in pulled if i in sent]
+        result = {
+            'version': git_version(),
+            'timestamp': int(time.time()),
+            'params': {k: v for k, v in vars(args).items() if k not in ('output', 'keep')},
+            'publish': {
+                'seconds': round(publish_seconds, 3),
+                'msgs_per_s': round(args.requests / max(publish_seconds, 1e-6), 1),
+            },
+            'fetcher': {
+                'completed': len(completed),
+                'errors': errors,
+                'seconds': round(fetch_seconds, 3),
+                'msgs_per_s': round(len(completed) / max(fetch_seconds, 1e-6), 1),
+                'latency': latency_summary(fetch_latency),
+                **samplers['fetcher'].result(),
+            },
+            'puller': {
+                'completed': len(pulled),
+                'seconds': round(pull_seconds, 3),
+                'msgs_per_s': round(len(pulled) / max(pull_seconds, 1e-6), 1),
+                'latency': latency_summary(pipeline_latency),
+                **samplers['puller'].result(),
+            },
+            'origin_requests': origin.requests,
+        }
+        output = json.dumps(result, indent=2)
+        print(output)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(output + '\n')
+        return 0 if len(completed) == args.requests and not errors and len(pulled) == successes else 1
+    finally:
+        stop_sampling.set()
+        client.loop_stop()
+        for process in (fetcher, puller):
+            process.send_signal(signal.SIGINT)
+        for process in (fetcher, puller):
+            try:
+                process.wait(15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        origin.shutdown()
+        fetch_aria2.shutdown()
+        pull_aria2.shutdown()
+        broker.stop()
+        if args.keep:
+            print(f"Work directory: {work_dir}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
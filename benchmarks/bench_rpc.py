@@ -0,0 +1,65 @@
+"""
+Benchmark aria2 RPC throughput against the fake aria2 server.
+
+Compares the old per-call path (getVersion + addUri + tellStatus through
+aria2p) with the batching Aria2RPC client. Prints one JSON object.
+
+    python benchmarks/bench_rpc.py --calls 2000 --threads 16 --latency 0.001
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import aria2p  # noqa: E402
+from fake_aria2 import make_server  # noqa: E402
+from rpc import Aria2RPC  # noqa: E402
+
+
+def run(fn, calls, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda i: fn(i), range(calls)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.001, help='Server-side seconds per HTTP request')
+    args = parser.parse_args()
+
+    server, fake = make_server(latency=args.latency, secret='bench')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = 'http://127.0.0.1', server.server_address[1]
+    results = {'calls': args.calls, 'threads': args.threads, 'latency': args.latency}
+
+    # Old path: a liveness check and a fresh API object per download
+    client = aria2p.Client(host=host, port=port, secret='bench', timeout=5)
+
+    def legacy_add(i):
+        client.get_version()
+        aria2p.API(client).add_uris([f"http://origin/{i}"], options={'out': f"f{i}"})
+
+    fake.requests = 0
+    elapsed = run(legacy_add, args.calls, args.threads)
+    results['legacy'] = {'seconds': round(elapsed, 3), 'rps': round(args.calls / elapsed, 1), 'http_requests': fake.requests}
+
+    rpc = Aria2RPC(host=host, port=port, secret='bench', check_interval=3600)
+    fake.requests = 0
+    elapsed = run(lambda i: rpc.add_uri([f"http://origin/{i}"], {'out': f"f{i}"}), args.calls, args.threads)
+    results['batched'] = {'seconds': round(elapsed, 3), 'rps': round(args.calls / elapsed, 1), 'http_requests': fake.requests}
+    rpc.close()
+
+    server.shutdown()
+    print(json.dumps(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Run two fetcher nodes in cluster mode against a local broker.
+
+Starts the in-process MQTT broker and a small HLS origin, launches two
+fetcher processes in one CLUSTER_GROUP, submits requests and checks that
+every request was downloaded exactly once, on the node named in its
+completion message. Needs the ``hls`` extra (native HLS engine).
+
+    python benchmarks/cluster_demo.py --jobs 20
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import paho.mqtt.client as mqtt
+
+from mqtt_broker import Broker
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FETCHER = os.path.join(ROOT, 'src', 'fetcher.py')
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def make_origin(directory, streams, segments=5, segment_size=64 * 1024):
+    """Write HLS streams (plain MPEG-TS segments) and serve them over HTTP."""
+    for stream in range(streams):
+        lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:2']
+        for segment in range(segments):
+            name = f"v{stream}_{segment}.ts"
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.write(os.urandom(segment_size))
+            lines += ['#EXTINF:2,', name]
+        lines.append('#EXT-X-ENDLIST')
+        with open(os.path.join(directory, f"v{stream}.m3u8"), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_node(node_id, work_dir, broker_port, group, aria2_port):
+    node_dir = os.path.join(work_dir, node_id)
+    os.makedirs(node_dir)
+    command = [
+        sys.executable, FETCHER,
+        '--broker', '127.0.0.1', '--port', str(broker_port), '--qos', '1',
+        '--mqtt-version', '5', '--cluster-group', group, '--node-id', node_id,
+        '--topic-subscribe', 'demo/request', '--topic-publish', 'demo/complete',
+        '--topic-cancel', '', '--progress-interval', '0', '--cache-enable', '0',
+        '--download-dir', 'downloads', '--download-prefix-url', f"http://{node_id}.local/",
+        '--job-store-dir', 'data', '--aria2-rpc-port', str(aria2_port),
+    ]
+    # Run in its own directory so no config.toml is picked up
+    return subprocess.Popen(command, cwd=node_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Two fetcher nodes sharing one request topic')
+    parser.add_argument('--jobs', type=int, default=20)
+    parser.add_argument('--timeout', type=float, default=60)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='cluster_demo_')
+    broker = Broker(port=0).start()
+    origin = make_origin(_mkdir(work_dir, 'origin'), args.jobs)
+    nodes = {
+        node_id: start_node(node_id, work_dir, broker.port, 'demo', 16800 + i)
+        for i, node_id in enumerate(('node-a', 'node-b'))
+    }
+
+    results = []
+    done = threading.Event()
+
+    def on_message(client, userdata, msg):
+        results.append(json.loads(msg.payload))
+        if len(results) >= args.jobs:
+            done.set()
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, protocol=mqtt.MQTTv5)
+    client.on_message = on_message
+    client.connect('127.0.0.1', broker.port)
+    client.subscribe('demo/complete', qos=1)
+    client.loop_start()
+    try:
+        # Wait until both nodes joined the shared subscription
+        deadline = time.time() + 30
+        while sum(len(m) for m in broker.shared.values()) < len(nodes) and time.time() < deadline:
+            time.sleep(0.1)
+
+        origin_url = f"http://127.0.0.1:{origin.server_address[1]}"
+        start = time.time()
+        for i in range(args.jobs):
+            client.publish('demo/request', json.dumps({'url': f"{origin_url}/v{i}.m3u8", 'name': f"v{i}"}), qos=1)
+        done.wait(args.timeout)
+        elapsed = time.time() - start
+
+        per_node = Counter(r.get('node') for r in results)
+        files_ok = all(
+            r['status'] == 'success'
+            and r['download_url'] == f"http://{r['node']}.local/{r['file_path']}"
+            and os.path.exists(os.path.join(work_dir, r['node'], 'downloads', r['file_path']))
+            for r in results
+        )
+        summary = {
+            'jobs': args.jobs,
+            'completed': len(results),
+            'unique_urls': len({r['url'] for r in results}),
+            'per_node': dict(per_node),
+            'files_on_reported_node': files_ok,
+            'elapsed_s': round(elapsed, 2),
+        }
+        print(json.dumps(summary, indent=2))
+        return 0 if len(results) == args.jobs and summary['unique_urls'] == args.jobs and files_ok else 1
+    finally:
+        client.loop_stop()
+        for process in nodes.values():
+            process.send_signal(signal.SIGINT)
+        for process in nodes.values():
+            try:
+                process.wait(15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        origin.shutdown()
+        broker.stop()
+
+
+def _mkdir(parent, name):
+    path = os.path.join(parent, name)
+    os.makedirs(path)
+    return path
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,243 @@
+"""
+Fake aria2 JSON-RPC server for benchmarks.
+
+Implements the handful of methods the downloader uses, plus
+system.multicall. Downloads "complete" after a fixed delay and are then
+announced as aria2.onDownloadComplete on WebSocket connections to
+/jsonrpc, like the real server does.
+"""
+import argparse
+import base64
+import hashlib
+import heapq
+import itertools
+import json
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class FakeAria2:
+    def __init__(self, secret="", complete_after=0.0):
+        self.secret = secret
+        self.complete_after = complete_after
+        self.downloads = {}
+        self.calls = 0
+        self.requests = 0
+        self.listeners = set()
+        self._gids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._due = []
+        self._due_changed = threading.Condition(self._lock)
+        threading.Thread(target=self._notify_loop, name="fake-aria2-notify", daemon=True).start()
+
+    def _notify_loop(self):
+        """Announce downloads on the WebSocket connections once they complete."""
+        while True:
+            with self._due_changed:
+                while not self._due or self._due[0][0] > time.time():
+                    self._due_changed.wait(self._due[0][0] - time.time() if self._due else None)
+                _, gid = heapq.heappop(self._due)
+                if self.downloads[gid]['removed']:
+                    continue
+                listeners = list(self.listeners)
+            message = json.dumps({'jsonrpc': '2.0', 'method': 'aria2.onDownloadComplete', 'params': [{'gid': gid}]})
+            for listener in listeners:
+                listener.send(message)
+
+    def _status(self, gid):
+        download = self.downloads[gid]
+        done = time.time() - download['added'] >= self.complete_after
+        if download['removed']:
+            status = 'removed'
+        else:
+            status = 'complete' if done else 'active'
+        total = download['length']
+        return {
+            'gid': gid,
+            'status': status,
+            'totalLength': str(total),
+            'completedLength': str(total if done else total // 2),
+            'downloadSpeed': '0' if done else '1048576',
+            'connections': '0' if done else '4',
+            'dir': download['dir'],
+            'files': [{'path': f"{download['dir']}/{download['out']}", 'length': str(total)}],
+        }
+
+    def call(self, method, params):
+        with self._lock:
+            self.calls += 1
+        if method.startswith('aria2.') and self.secret:
+            if not params or params[0] != f"token:{self.secret}":
+                raise ValueError("Unauthorized")
+            params = params[1:]
+        elif method.startswith('aria2.') and params and str(params[0]).startswith('token:'):
+            params = params[1:]
+
+        if method == 'aria2.getVersion':
+            return {'version': '1.37.0', 'enabledFeatures': []}
+        if method == 'aria2.addUri':
+            options = params[1] if len(params) > 1 else {}
+            gid = f"{next(self._gids):016x}"
+            with self._lock:
+                self.downloads[gid] = {
+                    'uris': params[0],
+                    'dir': options.get('dir', '/downloads'),
+                    'out': options.get('out', 'file'),
+                    'options': options,
+                    'length': 1 << 20,
+                    'added': time.time(),
+                    'removed': False,
+                }
+                heapq.heappush(self._due, (time.time() + self.complete_after, gid))
+                self._due_changed.notify()
+            return gid
+        if method == 'aria2.tellStatus':
+            status = self._status(params[0])
+            if len(params) > 1 and params[1]:
+                status = {key: status[key] for key in params[1] if key in status}
+            return status
+        if method == 'aria2.tellActive':
+            with self._lock:
+                gids = list(self.downloads)
+            return [s for s in (self._status(gid) for gid in gids) if s['status'] == 'active']
+        if method in ('aria2.tellWaiting', 'aria2.tellStopped'):
+            return []
+        if method in ('aria2.remove', 'aria2.forceRemove'):
+            self.downloads[params[0]]['removed'] = True
+            return params[0]
+        if method in ('aria2.changeOption', 'aria2.changeGlobalOption'):
+            return 'OK'
+        if method == 'aria2.getGlobalStat':
+            with self._lock:
+                active = len(self._due)
+            return {'numActive': str(active), 'numWaiting': '0', 'downloadSpeed': '0', 'uploadSpeed': '0'}
+        if method == 'aria2.shutdown':
+            return 'OK'
+        if method == 'system.multicall':
+            results = []
+            for call in params[0]:
+                try:
+                    results.append([self.call(call['methodName'], call.get('params', []))])
+                except Exception as e:
+                    results.append({'code': 1, 'message': str(e)})
+            return results
+        raise ValueError(f"Method not found: {method}")
+
+
+class WebSocket:
+    """Server side of a WebSocket connection; only sends text frames."""
+
+    GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+    def __init__(self, handler):
+        self.handler = handler
+        self._lock = threading.Lock()
+
+    @classmethod
+    def accept_key(cls, key):
+        return base64.b64encode(hashlib.sha1((key + cls.GUID).encode()).digest()).decode()
+
+    def send(self, text):
+        data = text.encode('utf-8')
+        if len(data) < 126:
+            header = struct.pack('!BB', 0x81, len(data))
+        elif len(data) < 65536:
+            header = struct.pack('!BBH', 0x81, 126, len(data))
+        else:
+            header = struct.pack('!BBQ', 0x81, 127, len(data))
+        try:
+            with self._lock:
+                self.handler.wfile.write(header + data)
+                self.handler.wfile.flush()
+        except OSError:
+            pass
+
+    def wait_closed(self):
+        """Read (and drop) client frames until the connection closes."""
+        rfile = self.handler.rfile
+        while True:
+            head = rfile.read(2)
+            if len(head) < 2:
+                return
+            opcode, length = head[0] & 0x0F, head[1] & 0x7F
+            if length == 126:
+                length = struct.unpack('!H', rfile.read(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', rfile.read(8))[0]
+            rfile.read((4 if head[1] & 0x80 else 0) + length)
+            if opcode == 0x8:
+                return
+
+
+def make_server(host='127.0.0.1', port=0, secret="", latency=0.0, complete_after=0.0):
+    """Create (server, fake) bound to host:port; port 0 picks a free port."""
+    fake = FakeAria2(secret=secret, complete_after=complete_after)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.headers.get('Upgrade', '').lower() != 'websocket':
+                self.send_error(404)
+                return
+            self.send_response(101, 'Switching Protocols')
+            self.send_header('Upgrade', 'websocket')
+            self.send_header('Connection', 'Upgrade')
+            self.send_header('Sec-WebSocket-Accept', WebSocket.accept_key(self.headers['Sec-WebSocket-Key']))
+            self.end_headers()
+            self.wfile.flush()
+            ws = WebSocket(self)
+            with fake._lock:
+                fake.listeners.add(ws)
+            try:
+                ws.wait_closed()
+            finally:
+                with fake._lock:
+                    fake.listeners.discard(ws)
+            self.close_connection = True
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            fake.requests += 1
+            if latency:
+                time.sleep(latency)
+            try:
+                response = {'jsonrpc': '2.0', 'id': body.get('id'), 'result': fake.call(body['method'], body.get('params', []))}
+            except Exception as e:
+                response = {'jsonrpc': '2.0', 'id': body.get('id'), 'error': {'code': 1, 'message': str(e)}}
+            data = json.dumps(response).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = Server((host, port), Handler)
+    return server, fake
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake aria2 JSON-RPC server')
+    parser.add_argument('--port', type=int, default=6800)
+    parser.add_argument('--secret', default='')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every HTTP request')
+    parser.add_argument('--complete-after', type=float, default=0.0, help='Seconds until downloads complete')
+    args = parser.parse_args()
+    server, _ = make_server(port=args.port, secret=args.secret, latency=args.latency, complete_after=args.complete_after)
+    print(f"Fake aria2 listening on http://127.0.0.1:{server.server_address[1]}/jsonrpc")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
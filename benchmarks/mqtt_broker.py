@@ -0,0 +1,324 @@
+"""
+Minimal in-process MQTT broker for benchmarks.
+
+Speaks MQTT 3.1.1 and 5.0 over TCP with QoS 0/1, retained messages,
+wildcards, shared subscriptions ($share/<group>/<filter>) and the v5
+Receive Maximum of each client. No persistence, no QoS 2, no auth.
+"""
+import argparse
+import asyncio
+import itertools
+import struct
+import threading
+from collections import deque
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+# v5 property id -> value type
+PROPERTY_TYPES = {
+    0x01: 'byte', 0x17: 'byte', 0x19: 'byte', 0x24: 'byte', 0x25: 'byte', 0x28: 'byte', 0x29: 'byte', 0x2A: 'byte',
+    0x13: 'short', 0x21: 'short', 0x22: 'short', 0x23: 'short',
+    0x02: 'int', 0x11: 'int', 0x18: 'int', 0x27: 'int',
+    0x0B: 'varint',
+    0x03: 'str', 0x08: 'str', 0x12: 'str', 0x15: 'str', 0x1A: 'str', 0x1C: 'str', 0x1F: 'str',
+    0x09: 'bin', 0x16: 'bin',
+    0x26: 'pair',
+}
+RECEIVE_MAXIMUM = 0x21
+
+
+def encode_varint(value):
+    out = bytearray()
+    while True:
+        byte, value = value % 128, value // 128
+        out.append(byte | (0x80 if value else 0))
+        if not value:
+            return bytes(out)
+
+
+def encode_str(text):
+    data = text.encode('utf-8') if isinstance(text, str) else text
+    return struct.pack('!H', len(data)) + data
+
+
+def packet(ptype, flags, body):
+    return bytes([(ptype << 4) | flags]) + encode_varint(len(body)) + body
+
+
+class Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def byte(self):
+        self.pos += 1
+        return self.data[self.pos - 1]
+
+    def short(self):
+        self.pos += 2
+        return struct.unpack_from('!H', self.data, self.pos - 2)[0]
+
+    def int(self):
+        self.pos += 4
+        return struct.unpack_from('!I', self.data, self.pos - 4)[0]
+
+    def varint(self):
+        value, shift = 0, 0
+        while True:
+            byte = self.byte()
+            value |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return value
+            shift += 7
+
+    def bin(self):
+        length = self.short()
+        self.pos += length
+        return self.data[self.pos - length:self.pos]
+
+    def str(self):
+        return self.bin().decode('utf-8')
+
+    def pair(self):
+        return self.str(), self.str()
+
+    def properties(self):
+        end = self.varint() + self.pos
+        props = {}
+        while self.pos < end:
+            prop = self.varint()
+            props[prop] = getattr(self, PROPERTY_TYPES[prop])()
+        return props
+
+    def rest(self):
+        return self.data[self.pos:]
+
+
+def topic_matches(topic_filter, topic):
+    filter_parts = topic_filter.split('/')
+    topic_parts = topic.split('/')
+    for i, part in enumerate(filter_parts):
+        if part == '#':
+            return True
+        if i >= len(topic_parts) or (part != '+' and part != topic_parts[i]):
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+
+class Session:
+    def __init__(self, broker, writer, version, receive_maximum):
+        self.broker = broker
+        self.writer = writer
+        self.version = version
+        self.receive_maximum = receive_maximum
+        self.inflight = {}
+        self.pending = deque()
+        self._ids = itertools.cycle(range(1, 65536))
+
+    def deliver(self, topic, payload, qos, retain=False):
+        if qos == 0:
+            self._send(topic, payload, 0, retain, None)
+        elif len(self.inflight) < self.receive_maximum:
+            mid = next(self._ids)
+            self.inflight[mid] = True
+            self._send(topic, payload, 1, retain, mid)
+        else:
+            self.pending.append((topic, payload, retain))
+
+    def acked(self, mid):
+        if self.inflight.pop(mid, None) and self.pending:
+            topic, payload, retain = self.pending.popleft()
+            self.deliver(topic, payload, 1, retain)
+
+    def _send(self, topic, payload, qos, retain, mid):
+        body = encode_str(topic)
+        if mid is not None:
+            body += struct.pack('!H', mid)
+        if self.version == 5:
+            body += b'\x00'
+        self.writer.write(packet(PUBLISH, (qos << 1) | int(retain), body + payload))
+
+
+class Broker:
+    def __init__(self, host='127.0.0.1', port=1883):
+        self.host = host
+        self.port = port
+        self.subscriptions = {}  # session -> {filter: qos}
+        self.shared = {}  # (group, filter) -> [(session, qos)]
+        self.retained = {}
+        self.published = 0
+        self._rr = {}
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    # --- running in a background thread ---
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="mqtt-broker", daemon=True)
+        self._thread.start()
+        self._ready.wait(10)
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join(10)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self.handle, self.host, self.port, backlog=1024)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.close()
+
+    # --- protocol ---
+    async def read_packet(self, reader):
+        header = await reader.readexactly(1)
+        length, shift = 0, 0
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+            shift += 7
+        return header[0] >> 4, header[0] & 0x0F, await reader.readexactly(length)
+
+    async def handle(self, reader, writer):
+        session = None
+        try:
+            ptype, _, body = await self.read_packet(reader)
+            if ptype != CONNECT:
+                return
+            r = Reader(body)
+            r.str()
+            version = r.byte()
+            r.byte()
+            r.short()
+            props = r.properties() if version == 5 else {}
+            session = Session(self, writer, version, props.get(RECEIVE_MAXIMUM, 65535))
+            self.subscriptions[session] = {}
+            writer.write(packet(CONNACK, 0, b'\x00\x00' + (b'\x00' if version == 5 else b'')))
+
+            while True:
+                ptype, flags, body = await self.read_packet(reader)
+                if ptype == PUBLISH:
+                    self.on_publish(session, flags, body)
+                elif ptype == PUBACK:
+                    session.acked(struct.unpack_from('!H', body)[0])
+                elif ptype == SUBSCRIBE:
+                    self.on_subscribe(session, body)
+                elif ptype == UNSUBSCRIBE:
+                    r = Reader(body)
+                    mid = r.short()
+                    if version == 5:
+                        r.properties()
+                    count = 0
+                    while r.pos < len(body):
+                        self.unsubscribe(session, r.str())
+                        count += 1
+                    extra = (b'\x00' + b'\x00' * count) if version == 5 else b''
+                    writer.write(packet(UNSUBACK, 0, struct.pack('!H', mid) + extra))
+                elif ptype == PINGREQ:
+                    writer.write(packet(PINGRESP, 0, b''))
+                elif ptype == DISCONNECT:
+                    return
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            if session is not None:
+                for topic_filter in list(self.subscriptions.get(session, {})):
+                    self.unsubscribe(session, topic_filter)
+                self.subscriptions.pop(session, None)
+            writer.close()
+
+    def on_publish(self, session, flags, body):
+        qos = (flags >> 1) & 0x03
+        retain = bool(flags & 0x01)
+        r = Reader(body)
+        topic = r.str()
+        mid = r.short() if qos else None
+        if session.version == 5:
+            r.properties()
+        payload = r.rest()
+        if qos:
+            session.writer.write(packet(PUBACK, 0, struct.pack('!H', mid)))
+        self.published += 1
+        if retain:
+            if payload:
+                self.retained[topic] = (payload, qos)
+            else:
+                self.retained.pop(topic, None)
+        self.route(topic, payload, qos)
+
+    def route(self, topic, payload, qos):
+        for subscriber, filters in list(self.subscriptions.items()):
+            granted = [q for f, q in filters.items() if not f.startswith('$share/') and topic_matches(f, topic)]
+            if granted:
+                subscriber.deliver(topic, payload, min(qos, max(granted)))
+        for (group, topic_filter), members in self.shared.items():
+            if members and topic_matches(topic_filter, topic):
+                index = self._rr.get((group, topic_filter), 0) % len(members)
+                self._rr[(group, topic_filter)] = index + 1
+                subscriber, granted = members[index]
+                subscriber.deliver(topic, payload, min(qos, granted))
+
+    def on_subscribe(self, session, body):
+        r = Reader(body)
+        mid = r.short()
+        if session.version == 5:
+            r.properties()
+        codes = bytearray()
+        while r.pos < len(body):
+            topic_filter = r.str()
+            qos = min(r.byte() & 0x03, 1)
+            self.subscriptions[session][topic_filter] = qos
+            codes.append(qos)
+            if topic_filter.startswith('$share/'):
+                _, group, shared_filter = topic_filter.split('/', 2)
+                self.shared.setdefault((group, shared_filter), []).append((session, qos))
+            else:
+                for topic, (payload, retained_qos) in self.retained.items():
+                    if topic_matches(topic_filter, topic):
+                        session.deliver(topic, payload, min(qos, retained_qos), retain=True)
+        props = b'\x00' if session.version == 5 else b''
+        session.writer.write(packet(SUBACK, 0, struct.pack('!H', mid) + props + bytes(codes)))
+
+    def unsubscribe(self, session, topic_filter):
+        self.subscriptions.get(session, {}).pop(topic_filter, None)
+        if topic_filter.startswith('$share/'):
+            _, group, shared_filter = topic_filter.split('/', 2)
+            members = self.shared.get((group, shared_filter), [])
+            members[:] = [m for m in members if m[0] is not session]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Minimal MQTT broker')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1883)
+    args = parser.parse_args()
+    broker = Broker(args.host, args.port).start()
+    print(f"MQTT broker listening on {broker.host}:{broker.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        broker.stop()
+
+
+if __name__ == '__main__':
+    main()
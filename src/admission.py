@@ -0,0 +1,80 @@
+import logging
+import threading
+from collections import deque
+
+
+class AdmissionControl:
+    """
+    Backpressure between MQTT intake and the job backlog.
+
+    The client runs with manual acks: a QoS 1/2 message is acknowledged
+    only after accept(msg) has stored it durably. Once the backlog reaches
+    ``high_water``, new QoS 1/2 messages are held unacknowledged, so the
+    broker stops sending after Receive Maximum (MQTT 5) or its in-flight
+    limit and keeps the excess itself. Held messages are admitted again
+    once the backlog falls to ``low_water``. QoS 0 messages cannot be
+    held back and are always admitted. Held messages are dropped on a
+    disconnect: they were never acknowledged, so the broker redelivers them.
+    """
+
+    def __init__(self, client, accept, backlog, high_water=1000, low_water=None):
+        self.client = client
+        self.accept = accept
+        self.backlog = backlog
+        self.high_water = high_water
+        self.low_water = high_water // 2 if low_water is None else low_water
+        self._held = deque()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def on_message(self, client, userdata, msg):
+        """MQTT message callback: admit the message now or hold its ack."""
+        with self._lock:
+            if msg.qos > 0 and (self._held or self.backlog() >= self.high_water):
+                if not self._held:
+                    logging.warning(f"Backlog reached {self.high_water} jobs, pausing intake")
+                self._held.append((self._generation, msg))
+                return
+        self._admit(self._generation, msg)
+
+    def on_disconnect(self, *args, **kwargs):
+        """
+        Held messages can no longer be acknowledged on a new connection;
+        drop them, the broker sends them again after the reconnect.
+        """
+        with self._lock:
+            self._generation += 1
+            if self._held:
+                logging.info(f"Dropping {len(self._held)} held messages, the broker redelivers them")
+                self._held.clear()
+
+    def resume(self):
+        """Admit held messages while there is room; call this as the backlog drains."""
+        with self._lock:
+            if not self._held or self.backlog() > self.low_water:
+                return
+            admitted = []
+            while self._held and self.backlog() + len(admitted) < self.high_water:
+                admitted.append(self._held.popleft())
+            if not self._held:
+                logging.info("Backlog drained, resuming intake")
+        for generation, msg in admitted:
+            self._admit(generation, msg)
+
+    def held(self):
+        """Number of messages waiting for admission."""
+        with self._lock:
+            return len(self._held)
+
+    def _admit(self, generation, msg):
+        if msg.qos > 0 and generation != self._generation:
+            # Held across a disconnect, the broker redelivers it
+            return
+        try:
+            self.accept(msg)
+        except Exception as e:
+            # Not acknowledged: the broker redelivers it after a reconnect
+            logging.error(f"Failed to accept message: {str(e)}")
+            return
+        if msg.qos > 0 and generation == self._generation:
+            self.client.ack(msg.mid, msg.qos)
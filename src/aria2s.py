@@ -1,7 +1,9 @@
 import logging
 import os
 import subprocess
+import time
 import aria2p
+from rpc import Aria2RPC
 
 
 class Aria2cServer:
@@ -13,6 +15,7 @@ class Aria2cServer:
         self.save_dir = self._real_save_dir(save_dir)
         self.process = None
         self._client = None
+        self._rpc = None
 
     def _real_save_dir(self, save_dir: str):
         """Get the real save directory."""
@@ -36,16 +39,20 @@ class Aria2cServer:
             )
         return self._client
 
+    def rpc(self):
+        """Get or create the shared, batching JSON-RPC connection."""
+        if self._rpc is None:
+            self._rpc = Aria2RPC(
+                host=self.host,
+                port=self.port,
+                secret=self.secret,
+            )
+        return self._rpc
+
     def is_running(self):
         """Check if aria2c server is running."""
-        try:
-            # 尝试连接到 RPC 服务
-            client = self.client()
-            # 调用一个简单的 RPC 方法来测试连接
-            client.get_version()
-            return True
-        except (aria2p.client.ClientException, ConnectionError, Exception):
-            return False
+        # 调用一个简单的 RPC 方法来测试连接
+        return self.rpc().check()
 
     def start(self):
         """Start aria2c server."""
@@ -90,6 +97,52 @@ class Aria2cServer:
             logging.error(f"Error starting aria2c server: {str(e)}")
             return False
 
+    def close(self):
+        """Close the RPC connection, leaving the aria2c server running."""
+        if self._rpc is not None:
+            self._rpc.close()
+            self._rpc = None
+
+    def spawn(self, options=None):
+        """
+        Start aria2c as a child process, listening on localhost only.
+
+        Unlike start(), the process is not daemonized and is stopped
+        together with this process.
+        """
+        if self.is_running():
+            logging.info("aria2c server is already running")
+            return True
+
+        command = [
+            'aria2c',
+            '--enable-rpc',
+            f'--rpc-listen-port={self.port}',
+            f'--rpc-secret={self.secret}',
+            f'--dir={self.save_dir}',
+            '--continue=true',
+            *(options or []),
+        ]
+        logging.info(f"Executing command: {' '.join(command)}")
+        try:
+            self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        except Exception as e:
+            logging.error(f"Error starting aria2c: {str(e)}")
+            return False
+
+        # Wait for the RPC interface to come up
+        for _ in range(50):
+            if self.process.poll() is not None:
+                logging.error(f"aria2c exited early. Error: {self.process.stderr.read()}")
+                self.process = None
+                return False
+            if self.is_running():
+                logging.info("aria2c started successfully")
+                return True
+            time.sleep(0.2)
+        logging.error("aria2c did not answer RPC calls in time")
+        return False
+
     def stop(self):
         """Stop the aria2c server using aria2p."""
         
@@ -98,6 +151,9 @@ class Aria2cServer:
             if result:
                 logging.info("aria2c server shutdown request sent successfully")
                 self._client = None
+                if self._rpc is not None:
+                    self._rpc.close()
+                    self._rpc = None
                 return True
             else:
                 logging.error("Failed to send shutdown request")
@@ -109,27 +165,50 @@ class Aria2cServer:
         except Exception as e:
             logging.error(f"Error stopping aria2c server: {str(e)}")
             return False
+        finally:
+            if self.process is not None:
+                try:
+                    self.process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+                self.process = None
+
+    def _download_options(self, save_dir="", filename=""):
+        """Build aria2 options for a new download."""
+        options = {}
+        if save_dir:
+            options['dir'] = self._real_save_dir(save_dir)
+        if filename:
+            options['out'] = filename
+        return options
+
+    def add_download(self, download_url, save_dir="", filename="", options=None):
+        """
+        Add a download through aria2 RPC and return its GID without waiting.
+        download_url may be a list of mirrors of the same file.
+        """
+        logging.info(f"Adding download: {download_url}")
+        uris = download_url if isinstance(download_url, list) else [download_url]
 
-    def download(self, download_url, save_dir="", filename=""):
-        """使用 aria2 RPC 下载文件"""
-        logging.info(f"Starting download: {download_url}")
-        
         try:
-            self.is_running()
-
-            aria2 = aria2p.API(self._client)
-            
-            options = {}
-            if save_dir:
-                options['dir'] = self._real_save_dir(save_dir)
-            if filename:
-                options['out'] = filename
-                
-            download = aria2.add_uris([download_url], options=options)
-            logging.info(f"Download added successfully: {download_url}")
-            return download.name
-            
+            gid = self.rpc().add_uri(uris, {**(options or {}), **self._download_options(save_dir, filename)})
+            logging.info(f"Download added successfully: {download_url} (gid={gid})")
+            return gid
+
         except Exception as e:
             error_msg = f"Error adding download to aria2 RPC: {str(e)}"
             logging.error(error_msg)
             raise ValueError(error_msg)
+
+    def download(self, download_url, save_dir="", filename=""):
+        """使用 aria2 RPC 下载文件，返回 GID"""
+        return self.add_download(download_url, save_dir, filename)
+
+    def resumable(self, gid):
+        """Whether a download added before a restart is still known to aria2."""
+        try:
+            status = self.rpc().tell_status(gid, ['status'])
+        except Exception as e:
+            logging.info(f"aria2 download {gid} not resumable: {str(e)}")
+            return False
+        return status.get('status') not in ('error', 'removed')
@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import threading
+import time
+
+# Budget of a side (aria2 or HLS) with no running jobs, bytes per second
+IDLE_BUDGET = 1024
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket in bytes per second (0 for unlimited).
+
+    reserve() takes the tokens up front and returns how long the caller
+    has to wait for them, so buckets can be shared by downloads running on
+    different event loops and threads.
+    """
+
+    def __init__(self, rate=0, burst=None):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self.rate = rate
+
+    def reserve(self, amount):
+        """Take amount tokens, returning the seconds to wait before using them."""
+        with self._lock:
+            if self.rate <= 0:
+                return 0.0
+            self._refill()
+            self._tokens -= amount
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    async def consume(self, amount):
+        delay = self.reserve(amount)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate > 0:
+            # Up to one second of burst by default
+            burst = self.burst or self.rate
+            self._tokens = min(burst, self._tokens + (now - self._last) * self.rate)
+        else:
+            self._tokens = 0.0
+        self._last = now
+
+
+class BandwidthManager:
+    """
+    Download bandwidth budget of the fetcher, in bytes per second.
+
+    ``limit`` is the total budget (0 for unlimited). While files are being
+    served to pullers (or always, without the built-in file server)
+    ``reserve`` is held back from it. The rest is split between aria2
+    (max-overall-download-limit via changeGlobalOption) and the HLS engine
+    (a shared token bucket) by their number of running jobs; a side with
+    no jobs gets IDLE_BUDGET, and the split is redone as soon as a job
+    starts or finishes. ``job_limit``
+    caps every job: aria2 downloads get max-download-limit, HLS jobs a
+    bucket of their own. All three and single jobs (set_job_limit) can be
+    changed at runtime; the budget is recomputed every ``interval``
+    seconds and on every change. aria2's global limit is left alone until
+    a budget is set. RPCs are sent after the lock is released, the limits
+    of several downloads in one batch.
+    """
+
+    def __init__(self, aria2server, limit=0, reserve=0, job_limit=0, file_server=None, interval=5):
+        self.aria2server = aria2server
+        self.limit = limit
+        self.reserve = reserve
+        self.job_limit = job_limit
+        self.file_server = file_server
+        self.interval = interval
+        self.hls_bucket = TokenBucket()
+        self._jobs = {}  # job id -> {'gid': ..., 'bucket': ..., 'limit': ...}
+        self._applied = {}
+        self._lock = threading.Lock()
+        self._apply_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._apply()
+        self._thread = threading.Thread(target=self._run, name="bandwidth", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+
+    def set_budget(self, limit=None, reserve=None, job_limit=None):
+        """Change the budget at runtime; None keeps a value."""
+        with self._lock:
+            if limit is not None:
+                self.limit = max(0, int(limit))
+            if reserve is not None:
+                self.reserve = max(0, int(reserve))
+            changes = []
+            if job_limit is not None:
+                self.job_limit = max(0, int(job_limit))
+                for job in self._jobs.values():
+                    if not job['custom']:
+                        changes += self._set_job(job, self.job_limit)
+        self._send_limits(changes)
+        logging.info(f"Bandwidth budget: limit {self.limit}, reserve {self.reserve}, per job {self.job_limit}")
+        self._apply()
+
+    def set_job_limit(self, job_id, limit):
+        """Cap one running job (0 for no cap); returns False if it is not running."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            job['custom'] = True
+            changes = self._set_job(job, max(0, int(limit)))
+        self._send_limits(changes)
+        logging.info(f"Bandwidth limit of job {job_id}: {limit}")
+        return True
+
+    def aria2_options(self):
+        """Options for a new aria2 download."""
+        return {'max-download-limit': str(self.job_limit)} if self.job_limit else {}
+
+    def attach_aria2(self, job_id, gid):
+        with self._lock:
+            self._jobs[job_id] = {'gid': gid, 'bucket': None, 'limit': self.job_limit, 'custom': False}
+        self._apply()
+
+    def attach_hls(self, job_id):
+        """Register an HLS job, returning the buckets its segment reads go through."""
+        bucket = TokenBucket(self.job_limit)
+        with self._lock:
+            self._jobs[job_id] = {'gid': None, 'bucket': bucket, 'limit': self.job_limit, 'custom': False}
+        self._apply()
+        return [self.hls_bucket, bucket]
+
+    def finish(self, job_id):
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None:
+            self._apply()
+
+    def _set_job(self, job, limit):
+        """Set a job's limit, returning the [(gid, limit)] to send to aria2 with _send_limits()."""
+        # 需持有锁
+        job['limit'] = limit
+        if job['bucket'] is not None:
+            job['bucket'].set_rate(limit)
+        elif job['gid']:
+            return [(job['gid'], limit)]
+        return []
+
+    def _send_limits(self, changes):
+        """Send max-download-limit changes to aria2 in one batch; not under the lock."""
+        if not changes:
+            return
+        rpc = self.aria2server.rpc()
+        # A magnet's GID only fetched the metadata, the torrent downloads under the GID that follows it
+        statuses = [(gid, limit, rpc.submit('aria2.tellStatus', [gid, ['followedBy']])) for gid, limit in changes]
+        targets = []
+        for gid, limit, future in statuses:
+            try:
+                followed = future.result(timeout=rpc.timeout * 2).get('followedBy') or []
+            except Exception:
+                followed = []
+            if followed:
+                with self._lock:
+                    for job in self._jobs.values():
+                        if job['gid'] == gid:
+                            job['gid'] = followed[0]
+            targets += [(target, limit) for target in followed or [gid]]
+        futures = [
+            (gid, rpc.submit('aria2.changeOption', [gid, {'max-download-limit': str(limit)}]))
+            for gid, limit in targets
+        ]
+        for gid, future in futures:
+            try:
+                future.result(timeout=rpc.timeout * 2)
+            except Exception as e:
+                logging.error(f"Failed to change bandwidth limit of {gid}: {str(e)}")
+
+    def budgets(self):
+        """Current (aria2, HLS) download budgets, 0 for unlimited."""
+        with self._lock:
+            if not self.limit:
+                return 0, 0
+            serving = self.file_server is None or self.file_server.transfers() > 0
+            budget = max(1024, self.limit - (self.reserve if serving else 0))
+            hls = sum(1 for job in self._jobs.values() if job['bucket'] is not None)
+            aria2 = len(self._jobs) - hls
+        # The two sides never add up to more than the budget. With nothing
+        # running, aria2 keeps the rest: its downloads start before they are
+        # attached, HLS jobs are attached before their first read.
+        rest = max(IDLE_BUDGET, budget - IDLE_BUDGET)
+        if not hls:
+            return rest, IDLE_BUDGET
+        if not aria2:
+            return IDLE_BUDGET, rest
+        hls_budget = max(IDLE_BUDGET, budget * hls // (hls + aria2))
+        return max(IDLE_BUDGET, budget - hls_budget), hls_budget
+
+    def _apply(self):
+        with self._apply_lock:
+            aria2_budget, hls_budget = self.budgets()
+            self.hls_bucket.set_rate(hls_budget)
+            # Unlimited until a budget was set, aria2's own setting stands
+            if self._applied.get('aria2', 0) != aria2_budget:
+                try:
+                    self.aria2server.rpc().change_global_option({'max-overall-download-limit': str(aria2_budget)})
+                    self._applied['aria2'] = aria2_budget
+                except Exception as e:
+                    logging.error(f"Failed to change aria2 bandwidth limit: {str(e)}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._apply()
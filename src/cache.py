@@ -0,0 +1,147 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from utils import is_valid_magnet_url
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url):
+    """Normalize a URL so equivalent spellings map to the same cache key."""
+    url = url.strip()
+    if is_valid_magnet_url(url):
+        return url
+    try:
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or '').lower()
+        netloc = host
+        if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+            netloc = f"{host}:{parts.port}"
+        if parts.username:
+            netloc = f"{parts.username}@{netloc}"
+        query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+        # The fragment is never sent to the server
+        return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+    except ValueError:
+        return url
+
+
+class ArtifactCache:
+    """
+    Index of finished artifacts in DOWNLOAD_DIR keyed by normalized URL.
+
+    Repeat requests are answered from the index, and concurrent requests
+    for the same key attach to the one in-flight download as waiters.
+    Entries expire after ``ttl`` seconds and the least recently used ones
+    are dropped beyond ``max_entries`` or ``max_bytes``. Eviction only
+    forgets the entry; the file itself stays on disk.
+    """
+
+    def __init__(self, download_dir, ttl=86400, max_entries=10000, max_bytes=0, key_name=False):
+        self.download_dir = download_dir
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.key_name = key_name
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def key(self, url, name=None):
+        """Cache key of a request."""
+        key = normalize_url(url)
+        if self.key_name and name:
+            key = f"{key}#{name}"
+        return key
+
+    def lookup(self, key):
+        """Return the file path cached for key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            file_path, size, stored_at = entry
+            if time.time() - stored_at > self.ttl or not os.path.exists(os.path.join(self.download_dir, file_path)):
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return file_path
+
+    def put(self, key, file_path, stored_at=None):
+        """Add a finished artifact to the index."""
+        try:
+            size = os.path.getsize(os.path.join(self.download_dir, file_path))
+        except OSError:
+            size = 0
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (file_path, size, stored_at or time.time())
+            self._total_bytes += size
+            self._evict()
+
+    def join(self, key, waiter):
+        """
+        Register interest in key.
+
+        Returns True if the caller should start the download, or False if
+        it was attached to a download already in flight.
+        """
+        with self._lock:
+            if key in self._inflight:
+                self._inflight[key].append(waiter)
+                return False
+            self._inflight[key] = []
+            return True
+
+    def finish(self, key, file_path):
+        """Index a finished download and return the waiters attached to it."""
+        self.put(key, file_path)
+        with self._lock:
+            return self._inflight.pop(key, [])
+
+    def promote(self, key):
+        """
+        Hand an in-flight download over to its first waiter, e.g. when the
+        job running it was cancelled. Returns that waiter, which has to
+        start the download (the others stay attached), or None.
+        """
+        with self._lock:
+            waiters = self._inflight.get(key)
+            if not waiters:
+                self._inflight.pop(key, None)
+                return None
+            return waiters.pop(0)
+
+    def fail(self, key):
+        """Drop an in-flight download and return the waiters attached to it."""
+        with self._lock:
+            return self._inflight.pop(key, [])
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'inflight': len(self._inflight),
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry[1]
+
+    def _evict(self):
+        # Expired entries are dropped lazily by lookup(); here enforce the size caps
+        while self._entries and (
+            (self.max_entries and len(self._entries) > self.max_entries)
+            or (self.max_bytes and self._total_bytes > self.max_bytes)
+        ):
+            key, (_, size, _) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            logging.debug(f"Evicted cache entry: {key}")
@@ -2,6 +2,31 @@ import os
 import toml
 import argparse
 
+# 需要转换为整数的配置项
+INT_KEYS = (
+    'PORT', 'QOS', 'KEEPALIVE',
+    'ARIA2_RPC_PORT', 'ARIA2_SERVER_ENABLE', 'ARIA2_RPC_ENABLE',
+    'M3U8_WORKERS', 'HTTP_WORKERS', 'MAGNET_WORKERS',
+    'JOB_RETENTION',
+    'CACHE_ENABLE', 'CACHE_TTL', 'CACHE_MAX_ENTRIES', 'CACHE_MAX_BYTES', 'CACHE_KEY_NAME',
+    'HLS_CONCURRENCY', 'HLS_MAX_BANDWIDTH', 'HLS_CACHE_ENABLE', 'HLS_CACHE_MAX_BYTES',
+    'PULL_WORKERS', 'ARIA2_CLI_PORT',
+    'FILE_SERVER_ENABLE', 'FILE_SERVER_PORT',
+    'PROGRESS_INTERVAL', 'PROGRESS_BATCH',
+    'JOB_TIMEOUT', 'STALL_SPEED', 'STALL_TIME', 'STALL_RETRIES',
+    'RETRY_MAX', 'RETRY_DELAY', 'RETRY_MAX_DELAY',
+    'MQTT_VERSION', 'RECEIVE_MAXIMUM', 'QUEUE_HIGH_WATER',
+    'QUEUE_STATS_INTERVAL', 'POSTPROCESS_WORKERS', 'TUNING_ENABLE', 'TUNING_EXPLORE', 'HOST_MAX_JOBS',
+    'BANDWIDTH_LIMIT', 'BANDWIDTH_RESERVE', 'JOB_BANDWIDTH_LIMIT',
+    'METRICS_ENABLE', 'METRICS_PORT',
+    'MANIFEST_ENABLE', 'SYNC_INTERVAL', 'PULL_VERIFY',
+    'STORAGE_ENABLE', 'STORAGE_QUOTA', 'STORAGE_HIGH_WATERMARK', 'STORAGE_LOW_WATERMARK', 'STORAGE_DEFER_DELAY',
+    'LOG_MAX_BYTES', 'LOG_BACKUP_COUNT', 'LOG_PAYLOAD_MAX', 'LOG_SAMPLE_RATE',
+)
+
+# 配置文件中的分节
+CONFIG_SECTIONS = ('mqtt', 'aria2', 'worker', 'job', 'cache', 'hls', 'server', 'log')
+
 def load_config():
     """加载配置，优先级：命令行参数 > 配置文件 > 环境变量 > 默认值"""
     # 默认配置
@@ -10,9 +35,18 @@ def load_config():
         'PORT': 1883,
         'QOS': 0,
         'KEEPALIVE': 60,
+        'MQTT_VERSION': 3,
+        'RECEIVE_MAXIMUM': 100,
         'TOPIC_SUBSCRIBE': 'video/download/request',
         'TOPIC_PUBLISH': 'video/download/complete',
+        'TOPIC_PROGRESS': 'video/download/progress',
+        'TOPIC_CANCEL': 'video/download/cancel',
+        'TOPIC_BANDWIDTH': 'video/download/bandwidth',
+        'PROGRESS_INTERVAL': 2,
+        'PROGRESS_BATCH': 100,
         'CLIENT_ID': 'video_downloader_client',
+        'NODE_ID': '',
+        'CLUSTER_GROUP': '',
         'DOWNLOAD_DIR': 'downloads',
         'DOWNLOAD_PREFIX_URL': '',
         'USERNAME': None,
@@ -24,6 +58,72 @@ def load_config():
         'ARIA2_RPC_PORT': 6800,
         'ARIA2_RPC_TOKEN': '',
         'ARIA2_DOWNLOAD_DIR': 'aria2_downloads',
+        'ARIA2_CLI_PORT': 6801,
+
+        'M3U8_WORKERS': 4,
+        'HTTP_WORKERS': 16,
+        'MAGNET_WORKERS': 16,
+        'PULL_WORKERS': 8,
+        'POSTPROCESS_WORKERS': 0,
+        'QUEUE_HIGH_WATER': 1000,
+        'QUEUE_STATS_INTERVAL': 60,
+        'TENANT_WEIGHTS': {},
+        'BANDWIDTH_LIMIT': 0,
+        'BANDWIDTH_RESERVE': 0,
+        'JOB_BANDWIDTH_LIMIT': 0,
+        'TUNING_ENABLE': 0,
+        'TUNING_CONNECTIONS': '1,2,4,8,16',
+        'TUNING_EXPLORE': 10,
+        'HOST_MAX_JOBS': 0,
+
+        'JOB_STORE_DIR': 'data',
+        'JOB_RETENTION': 7 * 24 * 3600,
+        'JOB_TIMEOUT': 0,
+        'STALL_SPEED': 1024,
+        'STALL_TIME': 600,
+        'STALL_RETRIES': 1,
+        'RETRY_MAX': 3,
+        'RETRY_DELAY': 5,
+        'RETRY_MAX_DELAY': 300,
+
+        'CACHE_ENABLE': 1,
+        'CACHE_TTL': 24 * 3600,
+        'CACHE_MAX_ENTRIES': 10000,
+        'CACHE_MAX_BYTES': 0,
+        'CACHE_KEY_NAME': 0,
+
+        'HLS_BACKEND': 'native',
+        'HLS_CONCURRENCY': 8,
+        'HLS_MAX_BANDWIDTH': 0,
+        'HLS_CACHE_ENABLE': 0,
+        'HLS_CACHE_DIR': 'hls_cache',
+        'HLS_CACHE_MAX_BYTES': 2 * 1024 ** 3,
+
+        'FILE_SERVER_ENABLE': 0,
+        'FILE_SERVER_HOST': '0.0.0.0',
+        'FILE_SERVER_PORT': 8080,
+
+        'STORAGE_ENABLE': 0,
+        'STORAGE_QUOTA': 0,
+        'STORAGE_HIGH_WATERMARK': 90,
+        'STORAGE_LOW_WATERMARK': 80,
+        'STORAGE_DEFER_DELAY': 60,
+
+        'MANIFEST_ENABLE': 0,
+        'SYNC_URL': '',
+        'SYNC_INTERVAL': 300,
+        'PULL_VERIFY': 1,
+
+        'METRICS_ENABLE': 0,
+        'METRICS_HOST': '0.0.0.0',
+        'METRICS_PORT': 9464,
+
+        'LOG_FORMAT': 'text',
+        'LOG_MAX_BYTES': 50 * 1024 * 1024,
+        'LOG_ROTATE_WHEN': '',
+        'LOG_BACKUP_COUNT': 5,
+        'LOG_PAYLOAD_MAX': 200,
+        'LOG_SAMPLE_RATE': 0,
     }
 
     # 初始化配置
@@ -34,7 +134,7 @@ def load_config():
         env_value = os.getenv(key)
         if env_value is not None:
             try:
-                if key in ('PORT', 'QOS', 'KEEPALIVE', 'ARIA2_RPC_PORT', 'ARIA2_SERVER_ENABLE', 'ARIA2_RPC_ENABLE'):
+                if key in INT_KEYS:
                     config[key] = int(env_value)  # 类型转换
                 else:
                     config[key] = env_value
@@ -48,29 +148,18 @@ def load_config():
         try:
             with open(config_file, 'r', encoding='utf-8') as f:
                 file_config = toml.load(f)
-            mqtt_section = file_config.get('mqtt', {})
-            for key in default_config:
-                if key in mqtt_section:
-                    try:
-                        if key in ('PORT', 'QOS', 'KEEPALIVE'):
-                            config[key] = int(mqtt_section[key])  # 类型转换
-                        else:
-                            config[key] = mqtt_section[key]
-                        print(f"Loaded {key} from config file: {mqtt_section[key]}")
-                    except ValueError as e:
-                        print(f"Invalid value for {key} in {config_file}: {mqtt_section[key]}, error: {e}")
-
-            aria2_rpc_section = file_config.get('aria2', {})
-            for key in default_config:
-                if key in aria2_rpc_section:
-                    try:
-                        if key in ('ARIA2_RPC_PORT', 'ARIA2_SERVER_ENABLE', 'ARIA2_RPC_ENABLE'):
-                            config[key] = int(aria2_rpc_section[key])  # 类型转换
-                        else:
-                            config[key] = aria2_rpc_section[key]
-                        print(f"Loaded {key} from config file: {aria2_rpc_section[key]}")
-                    except ValueError as e:
-                        print(f"Invalid value for {key} in {config_file}: {aria2_rpc_section[key]}, error: {e}")
+            for section_name in CONFIG_SECTIONS:
+                section = file_config.get(section_name, {})
+                for key in default_config:
+                    if key in section:
+                        try:
+                            if key in INT_KEYS:
+                                config[key] = int(section[key])  # 类型转换
+                            else:
+                                config[key] = section[key]
+                            print(f"Loaded {key} from config file: {section[key]}")
+                        except ValueError as e:
+                            print(f"Invalid value for {key} in {config_file}: {section[key]}, error: {e}")
 
         except Exception as e:
             print(f"Failed to load config file {config_file}: {e}")
@@ -83,9 +172,18 @@ def load_config():
     parser.add_argument('--port', type=int, help='MQTT Broker port')
     parser.add_argument('--qos', type=int, help='QoS level (0, 1, or 2)')
     parser.add_argument('--keepalive', type=int, help='MQTT Keepalive interval')
+    parser.add_argument('--mqtt-version', type=int, choices=[3, 5], help='MQTT protocol version (3 for 3.1.1, the default, or 5)')
+    parser.add_argument('--receive-maximum', type=int, help='Max unacknowledged messages the broker may send (MQTT 5)')
     parser.add_argument('--topic-subscribe', help='MQTT subscribe topic')
     parser.add_argument('--topic-publish', help='MQTT publish topic')
+    parser.add_argument('--topic-cancel', help='MQTT cancel topic (empty to disable)')
+    parser.add_argument('--topic-progress', help='MQTT progress topic')
+    parser.add_argument('--topic-bandwidth', help='MQTT topic for runtime bandwidth changes (empty to disable)')
+    parser.add_argument('--progress-interval', type=int, help='Seconds between progress reports (0 to disable)')
+    parser.add_argument('--progress-batch', type=int, help='Max jobs per progress message')
     parser.add_argument('--client-id', help='MQTT client ID')
+    parser.add_argument('--node-id', help='Node ID reported in completion messages (default: hostname)')
+    parser.add_argument('--cluster-group', help='Shared subscription group; fetchers in one group split the requests')
     parser.add_argument('--download-dir', help='Download directory')
     parser.add_argument('--download-prefix-url', help='Download prefix URL')
     parser.add_argument('--username', help='MQTT username for authentication')
@@ -96,6 +194,63 @@ def load_config():
     parser.add_argument('--aria2-rpc-port', type=int, help='aria2 RPC port')
     parser.add_argument('--aria2-rpc-token', help='aria2 RPC token')
     parser.add_argument('--aria2-download-dir', help='aria2 RPC download directory')
+    parser.add_argument('--aria2-cli-port', type=int, help='RPC port of the local aria2c started in CLI mode')
+    parser.add_argument('--m3u8-workers', type=int, help='Max concurrent m3u8 jobs')
+    parser.add_argument('--http-workers', type=int, help='Max concurrent HTTP jobs')
+    parser.add_argument('--magnet-workers', type=int, help='Max concurrent magnet jobs')
+    parser.add_argument('--pull-workers', type=int, help='Max concurrent puller downloads')
+    parser.add_argument('--postprocess-workers', type=int, help='Processes for remuxing and hashing (0 for one per CPU core)')
+    parser.add_argument('--queue-high-water', type=int, help='Backlog of jobs at which intake pauses')
+    parser.add_argument('--queue-stats-interval', type=int, help='Seconds between queue wait reports (0 to disable)')
+    parser.add_argument('--bandwidth-limit', type=int, help='Total download bandwidth in bytes/s (0 for no limit)')
+    parser.add_argument('--bandwidth-reserve', type=int, help='Bytes/s of BANDWIDTH_LIMIT kept free while files are served')
+    parser.add_argument('--job-bandwidth-limit', type=int, help='Download bandwidth per job in bytes/s (0 for no limit)')
+    parser.add_argument('--tenant-weights', help="Fair share weights per client, e.g. 'alice=2,bob=1'")
+    parser.add_argument('--tuning-enable', type=int, help='Learn connections per host from past throughput (0 or 1)')
+    parser.add_argument('--tuning-connections', help="Connection counts tuning chooses from, e.g. '1,2,4,8,16'")
+    parser.add_argument('--tuning-explore', type=int, help='Percent of jobs that try a neighbouring connection count')
+    parser.add_argument('--host-max-jobs', type=int, help='Max concurrent jobs per host (0 for no limit)')
+    parser.add_argument('--job-store-dir', help='Directory of the persistent job store')
+    parser.add_argument('--job-retention', type=int, help='Seconds to keep finished jobs in the job store')
+    parser.add_argument('--job-timeout', type=int, help='Max seconds a job may run (0 for no limit)')
+    parser.add_argument('--stall-speed', type=int, help='Bytes/s below which a job counts as stalled (0 to disable)')
+    parser.add_argument('--stall-time', type=int, help='Seconds below STALL_SPEED before a job is stopped')
+    parser.add_argument('--stall-retries', type=int, help='Times a stalled job is retried before it fails')
+    parser.add_argument('--retry-max', type=int, help='Times a failed job is retried (0 to disable)')
+    parser.add_argument('--retry-delay', type=int, help='Seconds before the first retry, doubled on each attempt')
+    parser.add_argument('--retry-max-delay', type=int, help='Max seconds between retries')
+    parser.add_argument('--cache-enable', type=int, help='Reuse finished downloads of the same URL (0 or 1)')
+    parser.add_argument('--cache-ttl', type=int, help='Seconds a finished download stays reusable')
+    parser.add_argument('--cache-max-entries', type=int, help='Max entries in the artifact cache')
+    parser.add_argument('--cache-max-bytes', type=int, help='Max total size of cached artifacts (0 for no limit)')
+    parser.add_argument('--cache-key-name', type=int, help='Include name in the cache key (0 or 1)')
+    parser.add_argument('--hls-backend', choices=['native', 'binary'], help='m3u8 download backend')
+    parser.add_argument('--hls-concurrency', type=int, help='Concurrent segment downloads per m3u8 job')
+    parser.add_argument('--hls-max-bandwidth', type=int, help='Highest variant bandwidth to pick (0 for best)')
+    parser.add_argument('--hls-cache-enable', type=int, help='Keep HLS segments on disk for retries and repeated streams (0 or 1)')
+    parser.add_argument('--hls-cache-dir', help='Directory of the HLS segment cache')
+    parser.add_argument('--hls-cache-max-bytes', type=int, help='Max bytes of the HLS segment cache')
+    parser.add_argument('--file-server-enable', type=int, help='Serve DOWNLOAD_DIR over HTTP (0 or 1)')
+    parser.add_argument('--file-server-host', help='File server listen address')
+    parser.add_argument('--file-server-port', type=int, help='File server listen port')
+    parser.add_argument('--storage-enable', type=int, help='Enforce a disk quota on DOWNLOAD_DIR, evicting least recently used files (0 or 1)')
+    parser.add_argument('--storage-quota', type=int, help='Max bytes of DOWNLOAD_DIR (0 for the whole filesystem)')
+    parser.add_argument('--storage-high-watermark', type=int, help='Percent of the quota at which eviction starts')
+    parser.add_argument('--storage-low-watermark', type=int, help='Percent of the quota eviction brings usage down to')
+    parser.add_argument('--storage-defer-delay', type=int, help='Seconds before a job that did not fit is tried again')
+    parser.add_argument('--manifest-enable', type=int, help='Keep a manifest of finished files and serve it on /_manifest (0 or 1)')
+    parser.add_argument('--sync-url', help='Manifest URL(s) of fetchers for puller sync mode, comma separated (empty to disable)')
+    parser.add_argument('--sync-interval', type=int, help='Seconds between incremental syncs (0 for reconnects only)')
+    parser.add_argument('--pull-verify', type=int, help='Verify pulled files against the published SHA-256 (0 or 1)')
+    parser.add_argument('--metrics-enable', type=int, help='Serve Prometheus metrics on /metrics (0 or 1)')
+    parser.add_argument('--metrics-host', help='Metrics listen address')
+    parser.add_argument('--metrics-port', type=int, help='Metrics listen port')
+    parser.add_argument('--log-format', choices=['text', 'json'], help='Log file format')
+    parser.add_argument('--log-max-bytes', type=int, help='Rotate the log file at this size (0 to disable)')
+    parser.add_argument('--log-rotate-when', help="Rotate the log file by time instead, e.g. 'midnight' or 'H'")
+    parser.add_argument('--log-backup-count', type=int, help='Rotated log files to keep')
+    parser.add_argument('--log-payload-max', type=int, help='Max logged characters of a message payload (0 for no limit)')
+    parser.add_argument('--log-sample-rate', type=int, help='Max per-message log lines per second (0 for no limit)')
 
     args = parser.parse_args()
 
@@ -114,9 +269,20 @@ def load_config():
     config['ARIA2_RPC_ENABLE'] = bool(config['ARIA2_RPC_ENABLE'])
 
     # 验证配置
+    if config['CLUSTER_GROUP'] and config['MQTT_VERSION'] != 5:
+        print("CLUSTER_GROUP uses shared subscriptions, which need MQTT_VERSION = 5 on most brokers")
     if config['QOS'] not in (0, 1, 2):
         print(f"Invalid QOS: {config['QOS']}, defaulting to 0")
         config['QOS'] = 0
+    if config['MQTT_VERSION'] not in (3, 5):
+        print(f"Invalid MQTT_VERSION: {config['MQTT_VERSION']}, defaulting to 3")
+        config['MQTT_VERSION'] = 3
+    if not 1 <= config['RECEIVE_MAXIMUM'] <= 65535:
+        print(f"Invalid RECEIVE_MAXIMUM: {config['RECEIVE_MAXIMUM']}, defaulting to 100")
+        config['RECEIVE_MAXIMUM'] = 100
+    if config['BANDWIDTH_LIMIT'] and config['BANDWIDTH_RESERVE'] >= config['BANDWIDTH_LIMIT']:
+        print(f"BANDWIDTH_RESERVE {config['BANDWIDTH_RESERVE']} leaves no budget for downloads, ignoring it")
+        config['BANDWIDTH_RESERVE'] = 0
     if config['PORT'] <= 0 or config['PORT'] > 65535:
         print(f"Invalid PORT: {config['PORT']}, defaulting to 1883")
         config['PORT'] = 1883
@@ -126,6 +292,24 @@ def load_config():
     if not config['DOWNLOAD_DIR']:
         print("Invalid DOWNLOAD_DIR, defaulting to 'downloads'")
         config['DOWNLOAD_DIR'] = 'downloads'
+    if config['HLS_BACKEND'] not in ('native', 'binary'):
+        print(f"Invalid HLS_BACKEND: {config['HLS_BACKEND']}, defaulting to 'native'")
+        config['HLS_BACKEND'] = 'native'
+    if not 0 < config['STORAGE_LOW_WATERMARK'] < config['STORAGE_HIGH_WATERMARK'] <= 100:
+        print(f"Invalid STORAGE watermarks: {config['STORAGE_LOW_WATERMARK']}/{config['STORAGE_HIGH_WATERMARK']}, defaulting to 80/90")
+        config['STORAGE_LOW_WATERMARK'], config['STORAGE_HIGH_WATERMARK'] = 80, 90
+    if not 0 <= config['TUNING_EXPLORE'] <= 100:
+        print(f"Invalid TUNING_EXPLORE: {config['TUNING_EXPLORE']}, defaulting to 10")
+        config['TUNING_EXPLORE'] = 10
+    if config['LOG_FORMAT'] not in ('text', 'json'):
+        print(f"Invalid LOG_FORMAT: {config['LOG_FORMAT']}, defaulting to 'text'")
+        config['LOG_FORMAT'] = 'text'
+    for key in ('M3U8_WORKERS', 'HTTP_WORKERS', 'MAGNET_WORKERS', 'PULL_WORKERS', 'HLS_CONCURRENCY',
+                'PROGRESS_BATCH', 'STALL_TIME', 'RETRY_DELAY', 'RETRY_MAX_DELAY', 'QUEUE_HIGH_WATER',
+                'STORAGE_DEFER_DELAY'):
+        if config[key] < 1:
+            print(f"Invalid {key}: {config[key]}, defaulting to {default_config[key]}")
+            config[key] = default_config[key]
 
     print()
     return config
\ No newline at end of file
@@ -1,191 +1,792 @@
 import aria2p
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 import json
 import subprocess
 import os
+import signal
+import socket
 import time
 import logging
 import queue
 import threading
+from urllib.parse import urlsplit
+from admission import AdmissionControl
 from aria2s import Aria2cServer
-from logger import setup_logging
+from bandwidth import BandwidthManager
+from cache import ArtifactCache
+from fileserver import FileServer
+from hoststats import HostTuner, url_host
+from hls import HLS_AVAILABLE, HLSDownloader
+from jobstore import JobStore, QUEUED, RUNNING, DONE, FAILED
+from logger import clip, setup_logging
+from manifest import Manifest
+from pipeline import Pipeline, postprocess
+from metrics import (
+    ACTIVE_WORKERS, ARIA2_DOWNLOADS, JOBS, QUEUED_JOBS, MetricsServer, aria2_downloads, observe_download,
+)
+from progress import ProgressReporter
+from retry import RetryScheduler, backoff_delay
+from segcache import SegmentCache
+from scheduler import DEFAULT_TENANT, parse_priority, parse_weights
+from storage import StorageManager, content_length
+from supervisor import JobSupervisor, REASON_MESSAGES, CANCELLED, STALLED
+from tracker import Aria2Tracker, status_error_message, status_file_path
 from config import load_config
-from utils import extract_url_from_text, get_file_suffix, is_valid_m3u8_url, is_valid_magnet_url
+from utils import extract_url_from_text, get_file_suffix, get_file_type, is_valid_magnet_url
+from workers import WorkerPool
 
 """
-Download files to a cloud server with sequential MQTT message processing.
+Download files to a cloud server with concurrent MQTT message processing.
 （此版本为 AI 优化，支持队列）
 """
 
+# Connections per aria2 download on a host without tuning history
+ARIA2_CONNECTIONS = 4
+
 def on_connect(client, userdata, flags, rc, *args, **kwargs):
     """MQTT connection callback, compatible with MQTT 3.1/3.1.1 and 5.0."""
     logging.info(f"Connected to MQTT broker with result code {rc}")
     if rc == 0:
         config = userdata['config']
-        client.subscribe(config['TOPIC_SUBSCRIBE'], qos=config['QOS'])
-        logging.info(f"Subscribed to topic: {config['TOPIC_SUBSCRIBE']} with QoS {config['QOS']}")
+        topic = request_topic(config)
+        client.subscribe(topic, qos=config['QOS'])
+        logging.info(f"Subscribed to topic: {topic} with QoS {config['QOS']}")
+        # Every node hears cancel requests, the job may run on any of them
+        if config['TOPIC_CANCEL']:
+            client.subscribe(config['TOPIC_CANCEL'], qos=config['QOS'])
+            logging.info(f"Subscribed to topic: {config['TOPIC_CANCEL']} with QoS {config['QOS']}")
+        if config['TOPIC_BANDWIDTH']:
+            client.subscribe(config['TOPIC_BANDWIDTH'], qos=config['QOS'])
+            logging.info(f"Subscribed to topic: {config['TOPIC_BANDWIDTH']} with QoS {config['QOS']}")
     else:
         logging.error(f"Failed to connect to MQTT broker: {rc}")
 
-def on_message(client, userdata, msg):
-    """MQTT message callback: Add messages to the queue for sequential processing."""
-    logging.info(f"Received message on topic {msg.topic}: {msg.payload.decode()}")
+def request_topic(config):
+    """
+    Topic filter for download requests. In cluster mode it is a shared
+    subscription, so the broker hands each request to one node of the group.
+    """
+    if config['CLUSTER_GROUP']:
+        return f"$share/{config['CLUSTER_GROUP']}/{config['TOPIC_SUBSCRIBE']}"
+    return config['TOPIC_SUBSCRIBE']
+
+def split_payload(payload):
+    """
+    Split a request payload into single-job payloads.
+    A JSON array or newline-delimited JSON carries many jobs in one message.
+    """
+    text = payload.strip()
     try:
-        # Add message to the queue
-        userdata['message_queue'].put((msg, time.time()))
-        logging.info(f"Message queued for processing: {msg.payload.decode()}")
-    except Exception as e:
-        logging.error(f"Error queuing message: {str(e)}")
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        lines = [line.strip() for line in text.splitlines() if line.strip()]
+        if len(lines) > 1 and all(line.startswith('{') for line in lines):
+            return lines
+        return [payload]
+    if isinstance(data, list):
+        return [item if isinstance(item, str) else json.dumps(item, ensure_ascii=False) for item in data]
+    return [payload]
 
+def accept_message(userdata, msg):
+    """
+    Persist a request message, then queue its jobs for processing.
+    Called through AdmissionControl; the message is acknowledged only if
+    this returns, so store errors are raised.
+    """
+    try:
+        payload = msg.payload.decode('utf-8')
+    except UnicodeDecodeError as e:
+        logging.error(f"Dropping undecodable message on topic {msg.topic}: {str(e)}")
+        return
+    payloads = split_payload(payload)
 
-def download_file(ftype, url, output, save_dir, aria2server):
-    """Download file using m3u8-downloader."""
-    if ftype == "m3u8":
-        return download_file_m3u8(url, output.replace(".mp4", ""), save_dir)
+    job_store = userdata['job_store']
+    # Retained messages are redelivered on every reconnect
+    if msg.retain:
+        payloads = [item for item in payloads if not job_store.seen(item)]
+        if not payloads:
+            logging.info(f"Skipping retained message already handled: {clip(payload)}")
+            return
+    receive_time = time.time()
+    job_ids = job_store.add_many(payloads, receive_time)
+    # Add messages to the queue
+    for job_id, job_payload in zip(job_ids, payloads):
+        userdata['message_queue'].put({'id': job_id, 'payload': job_payload, 'receive_time': receive_time, 'gid': None})
+    if len(job_ids) == 1:
+        logging.info(
+            f"Received message on topic {msg.topic} as job {job_ids[0]}: {clip(payloads[0])}",
+            extra={'job_id': job_ids[0], 'sample': True},
+        )
     else:
-        # 如果不是磁力链接，则判断 output 后缀是否与 url 的后缀相同，若不同，则以 url 的文件后缀为准
-        if not is_valid_magnet_url(url):
-            url_suffix = get_file_suffix(url)
-            file_suffix = get_file_suffix(output)
-            if url_suffix != file_suffix:
-                output += url_suffix
-        return download_file_aria2(url, output, save_dir, aria2server)
-    
-def download_file_aria2(url, output, save_dir, aria2server: Aria2cServer):
+        logging.info(f"Received bulk message on topic {msg.topic}, queued jobs {job_ids[0]}..{job_ids[-1]}")
+
+
+def aria2_output_name(url, output):
+    """Output file name for an aria2 job."""
+    # 如果不是磁力链接，则判断 output 后缀是否与 url 的后缀相同，若不同，则以 url 的文件后缀为准
+    if not is_valid_magnet_url(url):
+        url_suffix = get_file_suffix(url)
+        file_suffix = get_file_suffix(output)
+        if url_suffix != file_suffix:
+            output += url_suffix
+    return output
+
+def download_file_aria2(urls, output, save_dir, aria2server: Aria2cServer, options=None):
     """
-    使用 aria2 RPC 下载文件
+    使用 aria2 RPC 添加下载任务，返回 GID
+    多个 URL 作为同一个文件的多个下载源
     依赖 aria2c --enable-rpc
     """
-    logging.info(f"Downloading file using aria2 RPC: {url}")
+    logging.info(f"Downloading file using aria2 RPC: {', '.join(urls)}")
     try:
-        return aria2server.download(url, save_dir, output)  
+        return aria2server.add_download(urls, save_dir, output, options)
     except Exception as e:
-        logging.error(f"Error downloading file: {str(e)}")    
+        logging.error(f"Error downloading file: {str(e)}")
+
+def download_file_m3u8(url, output, save_dir, config, on_progress=None, on_start=None, limiters=None, concurrency=None,
+                       cache=None, on_digest=None):
+    """
+    Download an m3u8 stream with the configured backend.
+    on_start(cancel) receives a callable that stops the download.
+    limiters are token buckets, concurrency the segment downloads (HLS_CONCURRENCY
+    by default) and cache the SegmentCache of the native engine, which also passes
+    the SHA-256 and piece hashes of the output to on_digest; m3u8-downloader is not
+    shaped or cached.
+    """
+    if config['HLS_BACKEND'] == 'native':
+        if HLS_AVAILABLE:
+            return download_file_m3u8_native(
+                url, output, save_dir, config, on_progress, on_start, limiters, concurrency, cache, on_digest
+            )
+        logging.warning("Native HLS backend needs aiohttp and cryptography, falling back to m3u8-downloader")
+    return download_file_m3u8_cmd(url, output, save_dir, on_start)
 
-def download_file_m3u8(url, output, save_dir = ""):
+def download_file_m3u8_native(url, output, save_dir, config, on_progress=None, on_start=None, limiters=None, concurrency=None,
+                              cache=None, on_digest=None):
+    """
+    Download an m3u8 stream with the in-process HLS engine.
+    on_progress(done, total, bytes) is called after each written segment.
+    """
+    logging.info(f"Downloading file using native HLS engine: {url}")
+    try:
+        downloader = HLSDownloader(
+            concurrency=concurrency or config['HLS_CONCURRENCY'],
+            max_bandwidth=config['HLS_MAX_BANDWIDTH'],
+            on_progress=on_progress,
+            limiters=limiters,
+            cache=cache,
+        )
+        if on_start:
+            on_start(downloader.cancel)
+        # MPEG-TS output is remuxed to MP4 in the post-processing stage
+        output_path = downloader.download(url, os.path.join(save_dir, output))
+        if on_digest:
+            on_digest(downloader.sha256, downloader.pieces)
+        logging.info(f"file downloaded successfully to {output_path}")
+        return os.path.relpath(output_path, save_dir)
+    except Exception as e:
+        logging.error(f"Error downloading file: {str(e)}")
+        return None
+
+def download_file_m3u8_cmd(url, output, save_dir = "", on_start=None):
     """Download file using m3u8-downloader."""
     try:
         command = ['m3u8-downloader', '-u', url, '-o', output]
         if save_dir:
             command.extend(['-sp', save_dir])
         logging.info(f"Executing command: {' '.join(command)}")
-        result = subprocess.run(
+        process = subprocess.Popen(
             command,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             encoding="utf-8",
             # errors="ignore",
-            text=True
+            text=True,
+            # Own process group, so a cancel also stops its children (ffmpeg)
+            start_new_session=True
         )
-        if result.returncode == 0:
+        if on_start:
+            on_start(lambda: os.killpg(process.pid, signal.SIGKILL))
+        _, stderr = process.communicate()
+        if process.returncode == 0:
             logging.info(f"file downloaded successfully to {output}")
             return output + ".mp4"
         else:
-            logging.error(f"Failed to download file. Error: {result.stderr}")
+            logging.error(f"Failed to download file. Error: {stderr}")
             return None
     except Exception as e:
         logging.error(f"Error downloading file: {str(e)}")
         return None
 
-def process_message(client, config, aria2server, msg, receive_time):
-    """Process a single MQTT message."""
+def parse_message(payload):
+    """Parse a request payload, returning a request dict or None."""
+    # Parse message content
     try:
-        payload = msg.payload.decode('utf-8')
-        logging.info(f"Processing message: {payload}")
-        
-        # Parse message content
-        try:
-            data = json.loads(payload)
-            url = data.get('url')
-            name = data.get('name')
-        except json.JSONDecodeError:
-            url = extract_url_from_text(payload)
-            name = None
-        
-        if not url:
-            logging.warning("No valid URL found in the message")
-            return
-        
-        file_type = None
-        if is_valid_m3u8_url(url):
-            file_type = "m3u8"
-        elif is_valid_magnet_url(url):
-            file_type = "magnet"
-        elif extract_url_from_text(url):
-            file_type = "http"
-        else:
-            logging.warning(f"Invalid protocol for URL: {url}")
-            return
+        data = json.loads(payload)
+    except json.JSONDecodeError:
+        data = None
+    if isinstance(data, dict):
+        url = data.get('url')
+        name = data.get('name')
+        mirrors = data.get('urls') or []
+        priority = parse_priority(data.get('priority'))
+        tenant = data.get('client') or data.get('tenant') or DEFAULT_TENANT
+    else:
+        url = extract_url_from_text(payload)
+        name = None
+        mirrors = []
+        priority = 0
+        tenant = DEFAULT_TENANT
 
-        logging.info(f"Extracted URL: {url}, Name: {name}")
-        
-        filename = name or f"file_{int(time.time())}"
-        file_path = download_file(file_type, url, filename, config['DOWNLOAD_DIR'], aria2server)
-        if file_path:
-            download_http_url = ""
-            if not is_valid_magnet_url(url) and config.get('DOWNLOAD_PREFIX_URL'):
-                download_http_url = f"{config['DOWNLOAD_PREFIX_URL']}{file_path}"
-
-            # Publish success message
-            complete_msg = {
-                "status": "success",
-                "url": url,
-                "name": name if name else '',
-                "file_path": file_path,
-                "download_url": ''.join(download_http_url),
-                "timestamp": int(time.time()),
-                "receive_time": receive_time
-            }
-            # print(complete_msg)
-            result = client.publish(
-                config['TOPIC_PUBLISH'],
-                json.dumps(complete_msg, ensure_ascii=False),
-                qos=config['QOS']
+    # "urls" lists alternate sources of the same file
+    urls = []
+    for candidate in [url, *mirrors]:
+        if isinstance(candidate, str) and candidate and candidate not in urls:
+            urls.append(candidate)
+    if not urls:
+        logging.warning("No valid URL found in the message")
+        return None
+    url = urls[0]
+
+    file_type = get_file_type(url)
+    if file_type is None:
+        logging.warning(f"Invalid protocol for URL: {url}")
+        return None
+    # Mirrors must be of the same kind; a magnet link has no mirrors
+    urls = [u for u in urls if get_file_type(u) == file_type]
+    if file_type == "magnet":
+        urls = urls[:1]
+
+    logging.info(f"Extracted URL: {clip(url)}, Name: {name}, Mirrors: {len(urls) - 1}", extra={'sample': True})
+    return {
+        'url': url,
+        'urls': urls,
+        'name': name,
+        'file_type': file_type,
+        'priority': priority,
+        'tenant': str(tenant),
+    }
+
+def publish_message(client, config, message):
+    """Publish a status message to TOPIC_PUBLISH."""
+    result = client.publish(
+        config['TOPIC_PUBLISH'],
+        json.dumps(message, ensure_ascii=False),
+        qos=config['QOS']
+    )
+    if result.rc == mqtt.MQTT_ERR_SUCCESS:
+        logging.info(f"Published {message['status']} message for {message['url']}")
+    else:
+        logging.error(f"Failed to publish {message['status']} message: {result.rc}")
+
+def publish_complete(client, config, request, file_path, receive_time, size=None, sha256=None):
+    """Publish the success message for a finished download, with its size and SHA-256 if known."""
+    url = request['url']
+    download_http_url = ""
+    if not is_valid_magnet_url(url) and config.get('DOWNLOAD_PREFIX_URL'):
+        download_http_url = f"{config['DOWNLOAD_PREFIX_URL']}{file_path}"
+
+    complete_msg = {
+        "status": "success",
+        "url": url,
+        "name": request['name'] if request['name'] else '',
+        "file_path": file_path,
+        "download_url": ''.join(download_http_url),
+        "node": config['NODE_ID'],
+        "download_prefix_url": config['DOWNLOAD_PREFIX_URL'],
+        "timestamp": int(time.time()),
+        "receive_time": receive_time
+    }
+    if sha256:
+        complete_msg.update(size=size, sha256=sha256)
+    publish_message(client, config, complete_msg)
+
+def publish_error(client, config, request, filename, receive_time, message="Failed to download file"):
+    """Publish the error message for a failed download."""
+    error_msg = {
+        "status": "error",
+        "url": request['url'],
+        "name": filename,
+        "message": message,
+        "node": config['NODE_ID'],
+        "timestamp": int(time.time()),
+        "receive_time": receive_time
+    }
+    publish_message(client, config, error_msg)
+
+def job_filename(job, request):
+    """Output name of a job, generated from the job id if none was given."""
+    return request['name'] or f"file_{int(job['receive_time'])}_{job['id']}"
+
+def finish_download(client, userdata, job, request, file_path):
+    """
+    End the fetch stage of a job whose download is written, and hand it
+    to post-processing (remux, hashing) and then complete_job(). Files
+    hashed while they were written skip the process pool.
+    """
+    config = userdata['config']
+    userdata['supervisor'].finish(job['id'])
+    if userdata['progress']:
+        userdata['progress'].finish(job['id'])
+    if userdata['bandwidth']:
+        userdata['bandwidth'].finish(job['id'])
+
+    full_path = os.path.join(config['DOWNLOAD_DIR'], file_path)
+    size = os.path.getsize(full_path) if os.path.isfile(full_path) else None
+    if job.get('started'):
+        observe_download(request['file_type'], time.time() - job['started'], size)
+        finish_tuning(userdata, job, ok=True, size=size)
+
+    sha256 = job.pop('sha256', None)
+    pieces = job.pop('pieces', None)
+    # Only MPEG-TS written by the native HLS engine is remuxed, never a .ts file that was asked for
+    remux = request['file_type'] == 'm3u8' and config['HLS_BACKEND'] == 'native' and file_path.endswith('.ts')
+    if size is None or (sha256 and not remux):
+        userdata['pipeline'].publish(complete_job, client, userdata, job, request, file_path, size, sha256, pieces)
+        return
+
+    def on_done(result):
+        path, size, sha256, pieces = result
+        complete_job(client, userdata, job, request, os.path.relpath(path, config['DOWNLOAD_DIR']), size, sha256, pieces)
+
+    def on_error(error):
+        logging.error(f"Post-processing of job {job['id']} failed: {str(error)}", extra={'job_id': job['id']})
+        fail_job(client, userdata, job, request, f"Post-processing failed: {str(error)}")
+
+    userdata['pipeline'].submit(postprocess, (full_path, remux, sha256, pieces), on_done, on_error)
+
+def complete_job(client, userdata, job, request, file_path, size=None, sha256=None, pieces=None):
+    """Mark a job done, publish it, and resolve requests coalesced onto it."""
+    config = userdata['config']
+    job_store = userdata['job_store']
+    cache = userdata['cache']
+
+    if userdata['storage']:
+        userdata['storage'].release(job['id'])
+        userdata['storage'].add(file_path)
+    JOBS.inc(request['file_type'], 'success')
+
+    # Servable only from now on, before anyone is told about it
+    if userdata['file_server']:
+        userdata['file_server'].add(file_path)
+    if userdata['manifest']:
+        userdata['manifest'].update_later(file_path, sha256, pieces)
+
+    waiters = cache.finish(request['cache_key'], file_path) if cache else []
+    for waiter_job, waiter_request in [(job, request), *waiters]:
+        job_store.update(waiter_job['id'], DONE, file_path=file_path)
+        publish_complete(client, config, waiter_request, file_path, waiter_job['receive_time'], size, sha256)
+
+def fail_job(client, userdata, job, request, message="Failed to download file", outcome="failed"):
+    """
+    Mark a job failed, publish it, and fail requests coalesced onto it.
+    A cancelled job fails alone: the first request coalesced onto it
+    takes over the download.
+    """
+    config = userdata['config']
+    job_store = userdata['job_store']
+    cache = userdata['cache']
+
+    userdata['supervisor'].finish(job['id'])
+    if userdata['progress']:
+        userdata['progress'].finish(job['id'])
+    if userdata['bandwidth']:
+        userdata['bandwidth'].finish(job['id'])
+    if userdata['storage']:
+        userdata['storage'].release(job['id'])
+    finish_tuning(userdata, job)
+    JOBS.inc(request['file_type'], outcome)
+
+    waiters = []
+    if cache and outcome == CANCELLED:
+        successor = cache.promote(request['cache_key'])
+        if successor:
+            successor_job, successor_request = successor
+            logging.info(
+                f"Job {successor_job['id']} takes over the download of cancelled job {job['id']}",
+                extra={'job_id': successor_job['id']}
             )
-            if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                logging.info(f"Published completion message for {url}")
-            else:
-                logging.error(f"Failed to publish completion message: {result.rc}")
-        else:
-            # Publish error message
-            error_msg = {
-                "status": "error",
-                "url": url,
-                "name": filename,
-                "message": "Failed to download file",
-                "timestamp": int(time.time()),
-                "receive_time": receive_time
-            }
-            result = client.publish(
-                config['TOPIC_PUBLISH'],
-                json.dumps(error_msg, ensure_ascii=False),
-                qos=config['QOS']
+            submit_job(client, userdata, successor_job, successor_request)
+    elif cache:
+        waiters = cache.fail(request['cache_key'])
+    for waiter_job, waiter_request in [(job, request), *waiters]:
+        job_store.update(waiter_job['id'], FAILED, error=message)
+        publish_error(
+            client, config, waiter_request, job_filename(waiter_job, waiter_request),
+            waiter_job['receive_time'], message
+        )
+
+def retry_or_fail_job(client, userdata, job, request, message="Failed to download file"):
+    """
+    Schedule another attempt of a failed job, or fail it for good.
+
+    Retries wait with exponential backoff and jitter on the retry
+    scheduler, not on a worker. Cancelled and timed out jobs are not
+    retried; stalled jobs get STALL_RETRIES attempts, others RETRY_MAX.
+    """
+    config = userdata['config']
+    reason = userdata['supervisor'].finish(job['id'])
+    # Cancelled and timed out jobs say nothing about the host
+    finish_tuning(userdata, job, ok=False if reason in (None, STALLED) else None)
+    attempts = job.get('attempts', 0)
+    limit = config['STALL_RETRIES'] if reason == STALLED else config['RETRY_MAX']
+    if reason in (None, STALLED) and attempts < limit:
+        job['attempts'] = attempts + 1
+        job['gid'] = None
+        if userdata['progress']:
+            userdata['progress'].finish(job['id'])
+        if userdata['bandwidth']:
+            userdata['bandwidth'].finish(job['id'])
+        if userdata['storage']:
+            userdata['storage'].release(job['id'])
+        message = REASON_MESSAGES.get(reason, message)
+        JOBS.inc(request['file_type'], 'retried')
+        delay = backoff_delay(attempts, config['RETRY_DELAY'], config['RETRY_MAX_DELAY'])
+        logging.info(
+            f"Retrying job {job['id']} in {delay:.1f}s (attempt {job['attempts']}): {message}", extra={'job_id': job['id']}
+        )
+        userdata['job_store'].update(job['id'], QUEUED, error=message)
+        userdata['retry_scheduler'].schedule(delay, submit_job, client, userdata, job, request)
+        return
+    fail_job(client, userdata, job, request, REASON_MESSAGES.get(reason, message), reason or 'failed')
+
+def start_tuning(client, userdata, job, request):
+    """
+    Take a job slot on the job's host. Returns False if the host already
+    runs HOST_MAX_JOBS jobs; the job is then tried again after RETRY_DELAY.
+    """
+    host = url_host(job_sources(job, request)[0])
+    if not userdata['tuner'].acquire(host):
+        logging.info(f"Deferring job {job['id']}: too many jobs running on {host}", extra={'job_id': job['id'], 'sample': True})
+        userdata['retry_scheduler'].schedule(userdata['config']['RETRY_DELAY'], submit_job, client, userdata, job, request)
+        return False
+    job['tuning'] = {'host': host, 'kind': None, 'connections': None}
+    return True
+
+def choose_connections(userdata, job, kind, default):
+    """Connections (aria2) or concurrent segments (hls) for this attempt, learned per host."""
+    tuning = job.get('tuning')
+    if not tuning:
+        return default
+    tuning['kind'] = kind
+    tuning['connections'] = userdata['tuner'].choose(tuning['host'], kind, default)
+    return tuning['connections']
+
+def finish_tuning(userdata, job, ok=None, size=None):
+    """Free the job's host slot and record how the attempt went (ok=None records nothing)."""
+    tuning = job.pop('tuning', None)
+    if not tuning:
+        return
+    tuner = userdata['tuner']
+    tuner.release(tuning['host'])
+    if ok is not None and tuning['connections']:
+        duration = time.time() - job['started'] if job.get('started') else None
+        tuner.record(tuning['host'], tuning['kind'], tuning['connections'], size, duration, ok)
+
+def admit_job(client, userdata, job, request):
+    """
+    Reserve disk space for a starting job. Returns False if the job was
+    deferred (there is not enough space yet) or failed (it can never fit).
+    """
+    storage = userdata['storage']
+    # Only plain HTTP downloads announce their size up front
+    size = content_length(job_sources(job, request)[0]) if request['file_type'] == 'http' else None
+    if storage.too_large(size):
+        logging.error(f"Job {job['id']} needs {size} bytes, more than the disk quota allows", extra={'job_id': job['id']})
+        fail_job(client, userdata, job, request, "File too large for the disk quota")
+        return False
+    if storage.admit(job['id'], size):
+        return True
+    delay = userdata['config']['STORAGE_DEFER_DELAY']
+    logging.info(
+        f"Deferring job {job['id']} for {delay}s: not enough disk space for {size or 'unknown'} bytes",
+        extra={'job_id': job['id']}
+    )
+    userdata['retry_scheduler'].schedule(delay, submit_job, client, userdata, job, request)
+    return False
+
+def job_sources(job, request):
+    """Source URLs of a job, rotated by attempt so each retry leads with the next mirror."""
+    urls = request.get('urls') or [request['url']]
+    shift = job.get('attempts', 0) % len(urls)
+    return urls[shift:] + urls[:shift]
+
+def process_message(client, userdata, job, request):
+    """
+    Download a single parsed request.
+
+    m3u8 jobs are published once the download returns. aria2 jobs only
+    start the download here; the tracker publishes the result when aria2
+    reports the GID as finished, so the worker is released right away.
+    Either way the supervisor can stop the job while it runs.
+    """
+    config = userdata['config']
+    aria2server = userdata['aria2server']
+    tracker = userdata['tracker']
+    job_store = userdata['job_store']
+    progress = userdata['progress']
+    supervisor = userdata['supervisor']
+    bandwidth = userdata['bandwidth']
+    storage = userdata['storage']
+    job_id = job['id']
+
+    if userdata['tuner'] and not start_tuning(client, userdata, job, request):
+        return
+    if storage and not admit_job(client, userdata, job, request):
+        finish_tuning(userdata, job)
+        return
+    if not supervisor.begin(job, request):
+        logging.info(f"Job {job_id} was cancelled before it started", extra={'job_id': job_id})
+        fail_job(client, userdata, job, request, REASON_MESSAGES[CANCELLED], CANCELLED)
+        return
+
+    job['started'] = time.time()
+    try:
+        urls = job_sources(job, request)
+        url = urls[0]
+        filename = job_filename(job, request)
+
+        if request['file_type'] == "m3u8":
+            job_store.update(job_id, RUNNING)
+            concurrency = choose_connections(userdata, job, 'hls', config['HLS_CONCURRENCY'])
+
+            def on_progress(done, total, size):
+                supervisor.report(job_id, size)
+                if storage:
+                    # The final size is estimated from the average segment size
+                    storage.report(job_id, size, int(size / done * total) if done else None)
+                if progress:
+                    progress.update_hls(job, request, done, total, size, concurrency)
+
+            file_path = download_file_m3u8(
+                url, filename.replace(".mp4", ""), config['DOWNLOAD_DIR'], config,
+                on_progress, lambda cancel: supervisor.attach(job_id, cancel=cancel),
+                bandwidth.attach_hls(job_id) if bandwidth else None, concurrency, userdata['segment_cache'],
+                lambda sha256, pieces: job.update(sha256=sha256, pieces=pieces)
             )
-            if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                logging.info(f"Published error message for {url}")
+            if file_path:
+                finish_download(client, userdata, job, request, file_path)
             else:
-                logging.error(f"Failed to publish error message: {result.rc}")
-                
+                retry_or_fail_job(client, userdata, job, request)
+            return
+
+        output = aria2_output_name(url, filename)
+        gid = job.get('gid')
+        resumed = bool(gid) and aria2server.resumable(gid)
+        if resumed:
+            logging.info(f"Resuming job {job_id} with aria2 download {gid}", extra={'job_id': job_id})
+        else:
+            # A retry, or a job restored after aria2 lost its download, picks up the partial file
+            partial = job.get('attempts') or gid or os.path.exists(os.path.join(config['DOWNLOAD_DIR'], output))
+            options = {'continue': 'true'} if partial else {}
+            if job.get('tuning'):
+                connections = str(choose_connections(userdata, job, 'aria2', ARIA2_CONNECTIONS))
+                options.update({'split': connections, 'max-connection-per-server': connections, 'min-split-size': '1M'})
+            if bandwidth:
+                options.update(bandwidth.aria2_options())
+            gid = download_file_aria2(urls, output, config['DOWNLOAD_DIR'], aria2server, options)
+            if gid is None:
+                retry_or_fail_job(client, userdata, job, request)
+                return
+            job_store.update(job_id, RUNNING, gid=gid)
+
+        def on_complete(status):
+            file_path = status_file_path(status) or output
+            logging.info(f"aria2 download {status['gid']} complete: {file_path}")
+            finish_download(client, userdata, job, request, file_path)
+
+        def on_error(status):
+            message = status_error_message(status)
+            logging.error(f"aria2 download {status['gid']} failed: {message}")
+            retry_or_fail_job(client, userdata, job, request, message)
+
+        if progress:
+            progress.watch_aria2(job, request, gid)
+        supervisor.attach(job_id, gid=gid)
+        if bandwidth:
+            bandwidth.attach_aria2(job_id, gid)
+        if storage:
+            storage.attach_aria2(job_id, gid)
+        tracker.track(gid, on_complete, on_error, check=resumed)
+
     except Exception as e:
         logging.error(f"Error processing message: {str(e)}")
+        fail_job(client, userdata, job, request, str(e))
+
+def parse_cancel(payload):
+    """
+    Parse a cancel request: {"id": ...}, {"url": ...} or a bare URL.
+    Returns (job id, url, node); job ids are only unique within a node.
+    """
+    try:
+        data = json.loads(payload)
+    except json.JSONDecodeError:
+        data = {'url': extract_url_from_text(payload)}
+    if not isinstance(data, dict):
+        return None, None, None
+    job_id = data.get('id')
+    try:
+        job_id = int(job_id) if job_id is not None else None
+    except (TypeError, ValueError):
+        job_id = None
+    return job_id, data.get('url'), data.get('node')
+
+def on_cancel(client, userdata, msg):
+    """MQTT cancel topic callback: stop a job by id or URL."""
+    try:
+        payload = msg.payload.decode('utf-8')
+        job_id, url, node = parse_cancel(payload)
+        if job_id is None and not url:
+            logging.warning(f"Invalid cancel request: {clip(payload)}")
+            return
+        if node and node != userdata['config']['NODE_ID']:
+            return
+        stopped = userdata['supervisor'].cancel(job_id=job_id, url=url)
+        logging.info(f"Cancel request {clip(payload)}: stopped {stopped} running jobs")
+    except Exception as e:
+        logging.error(f"Error handling cancel request: {str(e)}")
+    finally:
+        # The client runs with manual acks
+        if msg.qos > 0:
+            client.ack(msg.mid, msg.qos)
+
+def on_bandwidth(client, userdata, msg):
+    """
+    MQTT bandwidth topic callback: {"limit": ..., "reserve": ..., "job_limit": ...}
+    changes the budget, {"id": ..., "limit": ...} caps one running job (bytes/s).
+    """
+    try:
+        payload = msg.payload.decode('utf-8')
+        data = json.loads(payload)
+        if not isinstance(data, dict):
+            logging.warning(f"Invalid bandwidth request: {clip(payload)}")
+            return
+        if data.get('node') and data['node'] != userdata['config']['NODE_ID']:
+            return
+        bandwidth = userdata['bandwidth']
+        if data.get('id') is not None:
+            if not bandwidth.set_job_limit(int(data['id']), data.get('limit', 0)):
+                logging.info(f"Bandwidth request for job {data['id']} that is not running")
+            return
+        bandwidth.set_budget(data.get('limit'), data.get('reserve'), data.get('job_limit'))
+    except Exception as e:
+        logging.error(f"Error handling bandwidth request: {str(e)}")
+    finally:
+        if msg.qos > 0:
+            client.ack(msg.mid, msg.qos)
+
+def dispatch_job(client, userdata, job, request):
+    """Answer a job from the cache, attach it to an identical download, or start it."""
+    cache = userdata['cache']
+    if cache:
+        key = request['cache_key'] = cache.key(request['url'], request['name'])
+        file_path = cache.lookup(key)
+        if file_path:
+            logging.info(f"Cache hit for job {job['id']}: {file_path}", extra={'job_id': job['id']})
+            if userdata['storage']:
+                userdata['storage'].touch(file_path)
+            JOBS.inc(request['file_type'], 'cached')
+            userdata['job_store'].update(job['id'], DONE, file_path=file_path)
+            # Size and hash are known once the manifest has indexed the file
+            entry = userdata['manifest'].get(file_path) if userdata['manifest'] else None
+            if entry and not entry['deleted']:
+                publish_complete(
+                    client, userdata['config'], request, file_path, job['receive_time'], entry['size'], entry['sha256']
+                )
+            else:
+                publish_complete(client, userdata['config'], request, file_path, job['receive_time'])
+            return
+        if not cache.join(key, (job, request)):
+            logging.info(f"Job {job['id']} attached to in-flight download of {request['url']}", extra={'job_id': job['id']})
+            return
+    submit_job(client, userdata, job, request)
+
+def submit_job(client, userdata, job, request):
+    """Queue a job on its worker pool by priority and tenant; only first attempts count towards queue wait."""
+    userdata['worker_pool'].submit(
+        request['file_type'], process_message, client, userdata, job, request,
+        priority=request['priority'], tenant=request['tenant'],
+        since=None if job.get('attempts') else job['receive_time'],
+    )
 
 def message_processor(client, userdata, stop_event):
-    """Worker thread to process messages from the queue sequentially."""
+    """Dispatcher thread: hand queued jobs to the per-type worker pools."""
     message_queue = userdata['message_queue']
-    config = userdata['config']
-    aria2c_server = userdata['aria2server']
-    
+    job_store = userdata['job_store']
+    admission = userdata['admission']
+    stats_interval = userdata['config']['QUEUE_STATS_INTERVAL']
+    last_stats = time.time()
+
     while not stop_event.is_set():
+        # Take in held messages once the backlog has drained
+        admission.resume()
+        if stats_interval > 0 and time.time() - last_stats >= stats_interval:
+            last_stats = time.time()
+            userdata['worker_pool'].wait_stats.log()
         try:
-            # Get message from queue (block until a message is available or timeout)
-            msg, receive_time = message_queue.get(timeout=1.0)
-            logging.info("Dequeued message for processing")
-            process_message(client, config, aria2c_server, msg, receive_time)
-            message_queue.task_done()
+            # Get job from queue (block until a job is available or timeout)
+            job = message_queue.get(timeout=1.0)
         except queue.Empty:
             continue
+        try:
+            logging.info(f"Processing job {job['id']}", extra={'job_id': job['id'], 'sample': True})
+            request = parse_message(job['payload'])
+            if request:
+                dispatch_job(client, userdata, job, request)
+            else:
+                JOBS.inc('unknown', 'invalid')
+                job_store.update(job['id'], FAILED, error="Invalid message")
         except Exception as e:
             logging.error(f"Error in message processor: {str(e)}")
+        finally:
+            message_queue.task_done()
+
+def load_cache(cache, job_store):
+    """Seed the artifact cache from jobs finished within the cache TTL."""
+    for row in job_store.done_since(time.time() - cache.ttl):
+        request = parse_message(row['payload'])
+        if request:
+            cache.put(cache.key(request['url'], request['name']), row['file_path'], row['updated_at'])
+
+def load_manifest(manifest, job_store):
+    """Check the manifest against the disk and add finished jobs it is missing, in the background."""
+    manifest.rescan_later()
+    for row in job_store.done_since(0):
+        if manifest.get(row['file_path']) is None:
+            manifest.update_later(row['file_path'])
+
+def load_storage(storage, job_store):
+    """Index finished artifacts the storage manager does not know yet, e.g. on first start."""
+    for row in job_store.done_since(0):
+        if row['file_path'] not in storage and os.path.exists(os.path.join(storage.download_dir, row['file_path'])):
+            storage.add(row['file_path'], row['updated_at'])
+
+def manifest_listing(config, manifest, since):
+    """Body of the /_manifest response: files changed after ``since`` and where to download them."""
+    files, seq = manifest.changes(since)
+    return {
+        "id": manifest.instance_id(),
+        "node": config['NODE_ID'],
+        "download_prefix_url": config['DOWNLOAD_PREFIX_URL'],
+        "seq": seq,
+        "full": since == 0,
+        "files": files,
+    }
+
+def restore_jobs(job_store, message_queue):
+    """Re-queue jobs that were queued or running when the fetcher stopped."""
+    jobs = job_store.unfinished()
+    for row in jobs:
+        message_queue.put({
+            'id': row['id'],
+            'payload': row['payload'],
+            'receive_time': row['receive_time'],
+            'gid': row['gid'],
+        })
+    if jobs:
+        logging.info(f"Restored {len(jobs)} unfinished jobs from {job_store.path}")
 
 def on_log(client, userdata, paho_log_level, messages):
     """Log MQTT client errors."""
@@ -207,6 +808,8 @@ def main():
     TOPIC_PUBLISH = config['TOPIC_PUBLISH']
     suffix = time.strftime(f"_{service_name}_%y%m%d%H%M%S", time.localtime())
     CLIENT_ID = config['CLIENT_ID'] + suffix
+    if not config['NODE_ID']:
+        config['NODE_ID'] = socket.gethostname()
     DOWNLOAD_DIR = config['DOWNLOAD_DIR']
     DOWNLOAD_PREFIX_URL = config['DOWNLOAD_PREFIX_URL']
     USERNAME = config.get('USERNAME', None)
@@ -217,23 +820,37 @@ def main():
         os.makedirs(DOWNLOAD_DIR)
 
     # Setup logging
-    setup_logging("fetcher")
+    setup_logging("fetcher", config)
+
+    if QOS == 0:
+        logging.warning("QOS = 0: messages cannot be held back, so QUEUE_HIGH_WATER backpressure has no effect; use QOS = 1")
 
     # Print configuration
     print("::Configuration loaded::")
     print(f"MQTT Broker: {BROKER}:{PORT}")
     print(f"QoS Level: {QOS}")
-    print(f"Subscribe Topic: {TOPIC_SUBSCRIBE}")
+    print(f"Subscribe Topic: {request_topic(config)}")
+    print(f"Node ID: {config['NODE_ID']}")
     print(f"Publish Topic: {TOPIC_PUBLISH}")
+    print(f"Cancel Topic: {config['TOPIC_CANCEL']}")
+    print(f"Progress Topic: {config['TOPIC_PROGRESS']} (every {config['PROGRESS_INTERVAL']}s)")
     print(f"Client ID: {CLIENT_ID}")
     print(f"Download Directory: {DOWNLOAD_DIR}")
     print(f"Download Prefix URL: {DOWNLOAD_PREFIX_URL}")
+    print(f"MQTT Version: {config['MQTT_VERSION']}, Receive Maximum: {config['RECEIVE_MAXIMUM']}")
+    print(f"Queue High Water: {config['QUEUE_HIGH_WATER']}")
+    print(f"Bandwidth (limit/reserve/per job): {config['BANDWIDTH_LIMIT']}/{config['BANDWIDTH_RESERVE']}/{config['JOB_BANDWIDTH_LIMIT']}")
+    print(f"Workers (m3u8/http/magnet): {config['M3U8_WORKERS']}/{config['HTTP_WORKERS']}/{config['MAGNET_WORKERS']}")
     print()
 
     # Create message queue and stop event
     message_queue = queue.Queue()
     stop_event = threading.Event()
 
+    # Durable job store, restore jobs left over from the last run
+    job_store = JobStore(os.path.join(config['JOB_STORE_DIR'], f"{service_name}.db"))
+    job_store.prune(config['JOB_RETENTION'])
+
     # Start aria2c server
     aria2c_server = Aria2cServer(
         host=config.get('ARIA2_RPC_HOST', '127.0.0.1'),
@@ -243,16 +860,158 @@ def main():
     )
     aria2c_server.start()
 
+    # Track aria2 downloads until they actually finish
+    tracker = Aria2Tracker(aria2c_server)
+    tracker.start()
+
+    # Deadlines, stall detection and cancel requests
+    supervisor = JobSupervisor(
+        aria2c_server,
+        deadline=config['JOB_TIMEOUT'],
+        min_speed=config['STALL_SPEED'],
+        stall_time=config['STALL_TIME'],
+    )
+    supervisor.start()
+
+    # Failed jobs wait for their next attempt here, not on a worker
+    retry_scheduler = RetryScheduler()
+    retry_scheduler.start()
+
+    # Per-type worker pools
+    worker_pool = WorkerPool({
+        'm3u8': config['M3U8_WORKERS'],
+        'http': config['HTTP_WORKERS'],
+        'magnet': config['MAGNET_WORKERS'],
+    }, name=service_name, weights=parse_weights(config['TENANT_WEIGHTS']))
+
+    # Post-processing and publishing stages after a download
+    pipeline = Pipeline(workers=config['POSTPROCESS_WORKERS'], name=service_name)
+
     # Prepare userdata
     userdata = {
         'config': config,
         'message_queue': message_queue,
         'aria2server': aria2c_server,
+        'tracker': tracker,
+        'supervisor': supervisor,
+        'retry_scheduler': retry_scheduler,
+        'worker_pool': worker_pool,
+        'job_store': job_store,
+        'cache': None,
+        'file_server': None,
+        'manifest': None,
+        'storage': None,
+        'progress': None,
+        'admission': None,
+        'bandwidth': None,
+        'tuner': None,
+        'segment_cache': None,
+        'pipeline': pipeline,
     }
 
+    # Index of finished artifacts, shared by identical requests
+    if config['CACHE_ENABLE']:
+        cache = ArtifactCache(
+            DOWNLOAD_DIR,
+            ttl=config['CACHE_TTL'],
+            max_entries=config['CACHE_MAX_ENTRIES'],
+            max_bytes=config['CACHE_MAX_BYTES'],
+            key_name=bool(config['CACHE_KEY_NAME']),
+        )
+        load_cache(cache, job_store)
+        userdata['cache'] = cache
+
+    # Manifest of finished files for pullers catching up with TOPIC_PUBLISH
+    if config['MANIFEST_ENABLE']:
+        if not config['FILE_SERVER_ENABLE']:
+            logging.warning("MANIFEST_ENABLE needs FILE_SERVER_ENABLE to serve the manifest")
+        manifest = Manifest(os.path.join(config['JOB_STORE_DIR'], "manifest.db"), DOWNLOAD_DIR)
+        load_manifest(manifest, job_store)
+        userdata['manifest'] = manifest
+
+    # HLS segments shared by retries and overlapping playlists
+    if config['HLS_CACHE_ENABLE']:
+        userdata['segment_cache'] = SegmentCache(config['HLS_CACHE_DIR'], config['HLS_CACHE_MAX_BYTES'])
+
+    # Connections and jobs per host, learned from past downloads
+    if config['TUNING_ENABLE'] or config['HOST_MAX_JOBS']:
+        userdata['tuner'] = HostTuner(
+            os.path.join(config['JOB_STORE_DIR'], "hosts.db"),
+            candidates=config['TUNING_CONNECTIONS'] if config['TUNING_ENABLE'] else (),
+            max_jobs=config['HOST_MAX_JOBS'],
+            explore=config['TUNING_EXPLORE'] / 100,
+        )
+
+    # Disk quota of DOWNLOAD_DIR with LRU eviction
+    if config['STORAGE_ENABLE']:
+        storage = StorageManager(
+            DOWNLOAD_DIR,
+            os.path.join(config['JOB_STORE_DIR'], "storage.db"),
+            quota=config['STORAGE_QUOTA'],
+            high=config['STORAGE_HIGH_WATERMARK'],
+            low=config['STORAGE_LOW_WATERMARK'],
+            aria2server=aria2c_server,
+        )
+        load_storage(storage, job_store)
+        userdata['storage'] = storage
+
+    # Built-in file server for finished artifacts
+    if config['FILE_SERVER_ENABLE']:
+        file_server = FileServer(
+            DOWNLOAD_DIR,
+            host=config['FILE_SERVER_HOST'],
+            port=config['FILE_SERVER_PORT'],
+            path_prefix=urlsplit(DOWNLOAD_PREFIX_URL).path or '/',
+            manifest=(lambda since: manifest_listing(config, userdata['manifest'], since)) if userdata['manifest'] else None,
+            pieces=userdata['manifest'].pieces if userdata['manifest'] else None,
+            on_access=userdata['storage'].touch if userdata['storage'] else None,
+        )
+        for row in job_store.done_since(0):
+            file_server.add(row['file_path'])
+        file_server.start()
+        userdata['file_server'] = file_server
+
+    if userdata['storage']:
+        # Evicted artifacts are no longer served or listed
+        if userdata['file_server']:
+            userdata['storage'].on_evict.append(userdata['file_server'].discard)
+        if userdata['manifest']:
+            userdata['storage'].on_evict.append(userdata['manifest'].remove)
+        userdata['storage'].start()
+
+    # Bandwidth budget across aria2 and the HLS engine
+    bandwidth = BandwidthManager(
+        aria2c_server,
+        limit=config['BANDWIDTH_LIMIT'],
+        reserve=config['BANDWIDTH_RESERVE'],
+        job_limit=config['JOB_BANDWIDTH_LIMIT'],
+        file_server=userdata['file_server'],
+    )
+    bandwidth.start()
+    userdata['bandwidth'] = bandwidth
+
+    # Prometheus metrics on /metrics
+    metrics_server = None
+    if config['METRICS_ENABLE']:
+        ACTIVE_WORKERS.set_function(lambda: {(ftype,): n for ftype, n in worker_pool.active().items()})
+        QUEUED_JOBS.set_function(lambda: {(ftype,): n for ftype, n in worker_pool.queued_per_type().items()})
+        ARIA2_DOWNLOADS.set_function(aria2_downloads(aria2c_server))
+        metrics_server = MetricsServer(host=config['METRICS_HOST'], port=config['METRICS_PORT'])
+        metrics_server.start()
+
+    restore_jobs(job_store, message_queue)
+
     # Create MQTT client
-    mqttc = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=CLIENT_ID, userdata=userdata)
+    protocol = mqtt.MQTTv5 if config['MQTT_VERSION'] == 5 else mqtt.MQTTv311
+    mqttc = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=CLIENT_ID, userdata=userdata, protocol=protocol)
     mqttc.reconnect_delay_set(min_delay=1, max_delay=120)
+    # Acknowledge requests only after they are stored
+    mqttc.manual_ack_set(True)
+    connect_properties = None
+    if protocol == mqtt.MQTTv5:
+        # Max unacknowledged messages the broker may send us
+        connect_properties = Properties(PacketTypes.CONNECT)
+        connect_properties.ReceiveMaximum = config['RECEIVE_MAXIMUM']
 
     # Set username and password if provided
     if USERNAME and PASSWORD:
@@ -262,7 +1021,29 @@ def main():
     # Set callbacks
     mqttc.on_log = on_log
     mqttc.on_connect = on_connect
-    mqttc.on_message = on_message
+    admission = AdmissionControl(
+        mqttc,
+        accept=lambda msg: accept_message(userdata, msg),
+        backlog=lambda: message_queue.qsize() + worker_pool.queued(),
+        high_water=config['QUEUE_HIGH_WATER'],
+    )
+    userdata['admission'] = admission
+    mqttc.on_message = admission.on_message
+    mqttc.on_disconnect = admission.on_disconnect
+    if config['TOPIC_CANCEL']:
+        mqttc.message_callback_add(config['TOPIC_CANCEL'], on_cancel)
+    if config['TOPIC_BANDWIDTH']:
+        mqttc.message_callback_add(config['TOPIC_BANDWIDTH'], on_bandwidth)
+
+    # Live progress of running jobs on TOPIC_PROGRESS
+    if config['PROGRESS_INTERVAL'] > 0:
+        progress = ProgressReporter(
+            mqttc, config, aria2c_server,
+            interval=config['PROGRESS_INTERVAL'],
+            batch_size=config['PROGRESS_BATCH'],
+        )
+        progress.start()
+        userdata['progress'] = progress
 
     # Start message processor thread
     processor_thread = threading.Thread(
@@ -274,7 +1055,7 @@ def main():
 
     try:
         # Connect to MQTT broker
-        mqttc.connect(BROKER, PORT, keepalive=KEEPALIVE)
+        mqttc.connect(BROKER, PORT, keepalive=KEEPALIVE, properties=connect_properties)
         logging.info(f"Connecting to MQTT broker: {BROKER}:{PORT}")
         mqttc.loop_start()  # Start MQTT loop in background thread
         while True:
@@ -286,11 +1067,30 @@ def main():
         logging.error(f"Failed to connect or run MQTT client: {e}")
         raise
     finally:
-        aria2c_server.stop()
+        if userdata['progress']:
+            userdata['progress'].stop()
+        retry_scheduler.stop()
+        bandwidth.stop()
+        supervisor.stop()
+        tracker.stop()
+        # aria2 keeps running, so downloads restored on the next start are still there
+        aria2c_server.close()
+        if userdata['file_server']:
+            userdata['file_server'].stop()
+        if userdata['storage']:
+            userdata['storage'].stop()
+        if userdata['manifest']:
+            userdata['manifest'].close()
+        if userdata['tuner']:
+            userdata['tuner'].close()
+        if metrics_server:
+            metrics_server.stop()
         stop_event.set()  # Ensure processor thread stops
         mqttc.loop_stop()  # Stop MQTT loop
         mqttc.disconnect()  # Disconnect MQTT client
         processor_thread.join()  # Wait for processor thread to finish
+        worker_pool.shutdown(wait=False)  # Drop jobs that have not started, they stay queued in the store
+        pipeline.shutdown()  # Jobs not post-processed yet stay running in the store and start over
         logging.info("MQTT client stopped.")
 
 if __name__ == "__main__":
@@ -0,0 +1,345 @@
+import asyncio
+import email.utils
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import secrets
+import threading
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+from manifest import PIECE_SIZE, ManifestBusy
+
+"""
+Built-in HTTP file server for DOWNLOAD_DIR.
+
+Serves finished artifacts only, with keep-alive, HTTP Range (including
+multiple ranges) and zero-copy transfers through loop.sendfile, which
+uses os.sendfile on plain sockets.
+"""
+
+MAX_HEADER_SIZE = 16384
+# Manifest of finished files, see FileServer
+MANIFEST_PATH = '/_manifest'
+# Piece hashes of a finished file, see FileServer
+PIECES_PATH = '/_pieces'
+
+
+class HTTPError(Exception):
+    def __init__(self, status, reason):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+
+
+def parse_range(header, size):
+    """
+    Parse a ``Range: bytes=...`` header into [(start, end), ...] (inclusive).
+
+    Returns None when the header should be ignored and raises HTTPError(416)
+    when no range can be satisfied.
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec:
+        return None
+    ranges = []
+    for part in spec.split(','):
+        first, sep, last = part.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else size - 1
+            else:
+                # Suffix range: the last N bytes
+                length = int(last)
+                if length == 0:
+                    continue
+                start, end = max(size - length, 0), size - 1
+        except ValueError:
+            return None
+        if start > end and first and last:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+    if not ranges:
+        raise HTTPError(416, 'Range Not Satisfiable')
+    return ranges
+
+
+class FileServer:
+    """
+    Serve finished artifacts from ``root`` over HTTP on an asyncio loop.
+
+    Only paths registered with add() are served (a registered directory,
+    e.g. a torrent, exposes the files below it), so files that are still
+    being written are never handed out. With ``manifest``, a function of
+    a sequence number returning a dict, GET /_manifest?since=N answers
+    with its result as JSON. With ``pieces``, a function of a relative path
+    returning the manifest's piece hashes of the file (see
+    Manifest.pieces), GET /_pieces?path=<file> answers with them, so a
+    client whose copy fails its checksum re-fetches only the bad ranges.
+    ``on_access`` is called with the relative path of every file that is
+    requested.
+    """
+
+    def __init__(self, root, host='0.0.0.0', port=8080, path_prefix='/', manifest=None, pieces=None, on_access=None):
+        self.root = os.path.abspath(root)
+        self.host = host
+        self.port = port
+        self.path_prefix = '/' + path_prefix.strip('/') + '/' if path_prefix.strip('/') else '/'
+        self.manifest = manifest
+        self.pieces = pieces
+        self.on_access = on_access
+        self._finished = set()
+        self._transfers = 0
+        self._lock = threading.Lock()
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    def add(self, file_path):
+        """Mark a path (relative to root) as finished and servable."""
+        with self._lock:
+            self._finished.add(posixpath.normpath(file_path.replace(os.sep, '/')))
+
+    def discard(self, file_path):
+        """Stop serving a path, e.g. before it is deleted."""
+        with self._lock:
+            self._finished.discard(posixpath.normpath(file_path.replace(os.sep, '/')))
+
+    def is_finished(self, rel_path):
+        with self._lock:
+            if rel_path in self._finished:
+                return True
+            # Files inside a finished directory
+            parts = rel_path.split('/')
+            return any('/'.join(parts[:i]) in self._finished for i in range(1, len(parts)))
+
+    def transfers(self):
+        """Number of file bodies being sent right now."""
+        return self._transfers
+
+    def start(self):
+        """Start serving in a background thread."""
+        self._thread = threading.Thread(target=self._run, name="file-server", daemon=True)
+        self._thread.start()
+        self._ready.wait(timeout=10)
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port, backlog=1024)
+            )
+            self.port = self._server.sockets[0].getsockname()[1]
+            logging.info(f"File server listening on http://{self.host}:{self.port}{self.path_prefix}")
+        except OSError as e:
+            logging.error(f"Failed to start file server: {str(e)}")
+            self._ready.set()
+            return
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            # Drop open keep-alive connections
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.close()
+
+    def _resolve(self, target):
+        """Map a request target to (relative path, absolute path)."""
+        path = unquote(urlsplit(target).path)
+        if not path.startswith(self.path_prefix):
+            raise HTTPError(404, 'Not Found')
+        rel_path = posixpath.normpath(path[len(self.path_prefix):])
+        if rel_path.startswith('..') or rel_path.startswith('/') or rel_path == '.':
+            raise HTTPError(404, 'Not Found')
+        if not self.is_finished(rel_path):
+            raise HTTPError(404, 'Not Found')
+        abs_path = os.path.join(self.root, *rel_path.split('/'))
+        if not os.path.isfile(abs_path):
+            raise HTTPError(404, 'Not Found')
+        if self.on_access:
+            self.on_access(rel_path)
+        return rel_path, abs_path
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                if len(head) > MAX_HEADER_SIZE:
+                    return
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ', 2)
+                except ValueError:
+                    return
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        key, value = line.split(':', 1)
+                        headers[key.strip().lower()] = value.strip()
+
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                await self._respond(writer, method, target, headers, keep_alive)
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logging.error(f"File server error: {str(e)}")
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, method, target, headers, keep_alive):
+        base_headers = [('Connection', 'keep-alive' if keep_alive else 'close')]
+        try:
+            if method not in ('GET', 'HEAD'):
+                raise HTTPError(405, 'Method Not Allowed')
+            if self.manifest is not None and urlsplit(target).path == MANIFEST_PATH:
+                await self._send_manifest(writer, method, target, base_headers)
+                return
+            if self.pieces is not None and urlsplit(target).path == PIECES_PATH:
+                await self._send_pieces(writer, method, target, base_headers)
+                return
+            rel_path, abs_path = self._resolve(target)
+            f = open(abs_path, 'rb')
+        except HTTPError as e:
+            body = f"{e.status} {e.reason}\n".encode()
+            await self._write_head(writer, e.status, e.reason, base_headers + [
+                ('Content-Type', 'text/plain'), ('Content-Length', str(len(body)))
+            ])
+            if method != 'HEAD':
+                writer.write(body)
+            return
+        except OSError:
+            await self._write_head(writer, 404, 'Not Found', base_headers + [('Content-Length', '0')])
+            return
+
+        with f:
+            stat = os.fstat(f.fileno())
+            size = stat.st_size
+            content_type = mimetypes.guess_type(rel_path)[0] or 'application/octet-stream'
+            base_headers += [
+                ('Accept-Ranges', 'bytes'),
+                ('Last-Modified', email.utils.formatdate(stat.st_mtime, usegmt=True)),
+            ]
+
+            ranges = None
+            if 'range' in headers:
+                try:
+                    ranges = parse_range(headers['range'], size)
+                except HTTPError as e:
+                    await self._write_head(writer, e.status, e.reason, base_headers + [
+                        ('Content-Range', f"bytes */{size}"), ('Content-Length', '0')
+                    ])
+                    return
+
+            if not ranges:
+                await self._write_head(writer, 200, 'OK', base_headers + [
+                    ('Content-Type', content_type), ('Content-Length', str(size))
+                ])
+                if method != 'HEAD' and size:
+                    await self._sendfile(writer, f, 0, size)
+                return
+
+            if len(ranges) == 1:
+                start, end = ranges[0]
+                await self._write_head(writer, 206, 'Partial Content', base_headers + [
+                    ('Content-Type', content_type),
+                    ('Content-Range', f"bytes {start}-{end}/{size}"),
+                    ('Content-Length', str(end - start + 1)),
+                ])
+                if method != 'HEAD':
+                    await self._sendfile(writer, f, start, end - start + 1)
+                return
+
+            # Multiple ranges: multipart/byteranges
+            boundary = secrets.token_hex(16)
+            parts = [
+                (f"\r\n--{boundary}\r\nContent-Type: {content_type}\r\n"
+                 f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode('latin-1')
+                for start, end in ranges
+            ]
+            closing = f"\r\n--{boundary}--\r\n".encode('latin-1')
+            length = sum(len(p) for p in parts) + sum(end - start + 1 for start, end in ranges) + len(closing)
+            await self._write_head(writer, 206, 'Partial Content', base_headers + [
+                ('Content-Type', f"multipart/byteranges; boundary={boundary}"),
+                ('Content-Length', str(length)),
+            ])
+            if method == 'HEAD':
+                return
+            for part, (start, end) in zip(parts, ranges):
+                writer.write(part)
+                await self._sendfile(writer, f, start, end - start + 1)
+            writer.write(closing)
+            await writer.drain()
+
+    async def _send_manifest(self, writer, method, target, headers):
+        try:
+            since = int(parse_qs(urlsplit(target).query).get('since', ['0'])[0])
+        except ValueError:
+            raise HTTPError(400, 'Bad Request')
+        # Large listings are built off the event loop
+        body = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: json.dumps(self.manifest(since), ensure_ascii=False).encode('utf-8')
+        )
+        await self._write_head(writer, 200, 'OK', headers + [
+            ('Content-Type', 'application/json'), ('Content-Length', str(len(body))), ('Cache-Control', 'no-store')
+        ])
+        if method != 'HEAD':
+            writer.write(body)
+            await writer.drain()
+
+    async def _send_pieces(self, writer, method, target, headers):
+        query = parse_qs(urlsplit(target).query)
+        # Only the piece size the manifest keeps hashes for
+        if not query.get('path') or query.get('size', [str(PIECE_SIZE)])[0] != str(PIECE_SIZE):
+            raise HTTPError(400, 'Bad Request')
+        rel_path, _ = self._resolve(self.path_prefix + quote(query['path'][0].lstrip('/')))
+        try:
+            # Reads the file if its hashes are not in the manifest yet, off the event loop
+            listing = await asyncio.get_running_loop().run_in_executor(None, self.pieces, rel_path)
+        except ManifestBusy:
+            raise HTTPError(503, 'Service Unavailable')
+        if listing is None:
+            raise HTTPError(404, 'Not Found')
+        body = json.dumps(dict(listing, path=rel_path)).encode('utf-8')
+        await self._write_head(writer, 200, 'OK', headers + [
+            ('Content-Type', 'application/json'), ('Content-Length', str(len(body))), ('Cache-Control', 'no-store')
+        ])
+        if method != 'HEAD':
+            writer.write(body)
+            await writer.drain()
+
+    @staticmethod
+    async def _write_head(writer, status, reason, headers):
+        head = f"HTTP/1.1 {status} {reason}\r\n" + ''.join(f"{k}: {v}\r\n" for k, v in headers) + "\r\n"
+        writer.write(head.encode('latin-1'))
+        await writer.drain()
+
+    async def _sendfile(self, writer, f, offset, count):
+        await writer.drain()
+        # Only touched from the loop thread
+        self._transfers += 1
+        try:
+            await asyncio.get_running_loop().sendfile(writer.transport, f, offset, count)
+        finally:
+            self._transfers -= 1
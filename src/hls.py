@@ -0,0 +1,397 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+from urllib.parse import urljoin
+
+from manifest import FileHasher
+from segcache import copy_into, segment_key
+
+try:
+    import aiohttp
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    from cryptography.hazmat.primitives import padding
+    HLS_AVAILABLE = True
+except ImportError:  # pragma: no cover - optional dependency
+    HLS_AVAILABLE = False
+
+"""
+In-process HLS downloader (asyncio).
+
+Needs the optional ``hls`` extra (aiohttp, cryptography); without it the
+fetcher keeps using the m3u8-downloader binary.
+"""
+
+
+class HLSError(Exception):
+    """Raised when a playlist cannot be downloaded."""
+
+
+def _parse_attributes(text):
+    """Parse an attribute list such as ``BANDWIDTH=1280000,URI="a.m3u8"``."""
+    attributes = {}
+    key, value, quoted, in_value = '', '', False, False
+    for char in text + ',':
+        if in_value:
+            if char == '"':
+                quoted = not quoted
+            elif char == ',' and not quoted:
+                attributes[key.strip().upper()] = value.strip().strip('"')
+                key, value, in_value = '', '', False
+            else:
+                value += char
+        elif char == '=':
+            in_value = True
+        else:
+            key += char
+    return attributes
+
+
+def _parse_byterange(text, last_end):
+    """Parse ``length[@offset]`` into (offset, length)."""
+    length, _, offset = text.partition('@')
+    return (int(offset) if offset else last_end), int(length)
+
+
+def parse_playlist(text, base_url):
+    """
+    Parse an m3u8 playlist.
+
+    Returns ``{'variants': [...]}`` for a master playlist, or
+    ``{'segments': [...], 'init': ...}`` for a media playlist.
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines or not lines[0].startswith('#EXTM3U'):
+        raise HLSError("Not an m3u8 playlist")
+
+    variants = []
+    segments = []
+    init = None
+    key = None
+    sequence = 0
+    byterange = None
+    last_end = 0
+    pending_variant = None
+
+    for line in lines[1:]:
+        if line.startswith('#EXT-X-STREAM-INF:'):
+            pending_variant = _parse_attributes(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            sequence = int(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-KEY:'):
+            attributes = _parse_attributes(line.split(':', 1)[1])
+            method = attributes.get('METHOD', 'NONE')
+            if method == 'NONE':
+                key = None
+            elif method == 'AES-128':
+                key = {
+                    'uri': urljoin(base_url, attributes['URI']),
+                    'iv': attributes.get('IV'),
+                }
+            else:
+                raise HLSError(f"Unsupported encryption method: {method}")
+        elif line.startswith('#EXT-X-MAP:'):
+            attributes = _parse_attributes(line.split(':', 1)[1])
+            init = {'uri': urljoin(base_url, attributes['URI']), 'range': None}
+            if 'BYTERANGE' in attributes:
+                init['range'] = _parse_byterange(attributes['BYTERANGE'], 0)
+        elif line.startswith('#EXT-X-BYTERANGE:'):
+            byterange = _parse_byterange(line.split(':', 1)[1], last_end)
+        elif line.startswith('#'):
+            continue
+        elif pending_variant is not None:
+            variants.append({
+                'uri': urljoin(base_url, line),
+                'bandwidth': int(pending_variant.get('BANDWIDTH', 0)),
+                'resolution': pending_variant.get('RESOLUTION', ''),
+            })
+            pending_variant = None
+        else:
+            segments.append({
+                'uri': urljoin(base_url, line),
+                'sequence': sequence,
+                'key': key,
+                'range': byterange,
+            })
+            if byterange:
+                last_end = byterange[0] + byterange[1]
+            sequence += 1
+            byterange = None
+
+    if variants:
+        return {'variants': variants}
+    return {'segments': segments, 'init': init}
+
+
+def select_variant(variants, max_bandwidth=0):
+    """Pick the best variant, optionally not above max_bandwidth."""
+    candidates = [v for v in variants if not max_bandwidth or v['bandwidth'] <= max_bandwidth]
+    if not candidates:
+        candidates = [min(variants, key=lambda v: v['bandwidth'])]
+    return max(candidates, key=lambda v: v['bandwidth'])
+
+
+def _decrypt(data, key, iv):
+    """Decrypt an AES-128-CBC segment and strip the PKCS#7 padding."""
+    decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+    unpadder = padding.PKCS7(128).unpadder()
+    plain = decryptor.update(data) + decryptor.finalize()
+    return unpadder.update(plain) + unpadder.finalize()
+
+
+class HLSDownloader:
+    """
+    Download an HLS stream into a single file.
+
+    Segments are fetched concurrently over one pooled keep-alive session
+    and written strictly in order; at most ``window`` segments are held in
+    memory. Progress is checkpointed next to the ``.part`` file so an
+    interrupted job resumes from the last written segment. With a
+    SegmentCache, fetched segments are kept on disk and segments already
+    there (from an earlier attempt, or another playlist or job name) are
+    copied into the output instead of downloaded. The SHA-256 of the
+    output and of its PIECE_SIZE pieces are computed as it is written and
+    left in ``sha256`` and ``pieces``. Writes, checkpoints and the cache's
+    file I/O run on worker threads, never on the event loop.
+    """
+
+    def __init__(self, concurrency=8, timeout=30, retries=3, max_bandwidth=0, on_progress=None, limiters=None, cache=None):
+        self.concurrency = concurrency
+        self.window = concurrency * 2
+        self.timeout = timeout
+        self.retries = retries
+        self.max_bandwidth = max_bandwidth
+        self.on_progress = on_progress
+        # Token buckets every byte read goes through (bandwidth shaping)
+        self.limiters = limiters or []
+        self.cache = cache
+        self.sha256 = None
+        self.pieces = None
+        self._digest = None
+        self._keys = {}
+        self._cancelled = False
+        self._loop = None
+        self._task = None
+
+    def download(self, url, output_path):
+        """Blocking wrapper around download_async."""
+        try:
+            return asyncio.run(self._run(url, output_path))
+        except asyncio.CancelledError:
+            raise HLSError(f"Download cancelled: {url}") from None
+
+    def cancel(self):
+        """Cancel a running download() from another thread."""
+        self._cancelled = True
+        if self._loop is not None and self._task is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._task.cancel)
+            except RuntimeError:
+                # The download already finished and its loop is closed
+                pass
+
+    async def _run(self, url, output_path):
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        if self._cancelled:
+            raise asyncio.CancelledError()
+        return await self.download_async(url, output_path)
+
+    async def download_async(self, url, output_path):
+        """Download the stream at url to output_path (extension is chosen here)."""
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            playlist_url, playlist = await self._load_media_playlist(session, url)
+            segments = playlist['segments']
+            if not segments:
+                raise HLSError(f"Playlist has no segments: {playlist_url}")
+
+            # fMP4 streams (EXT-X-MAP) concatenate to MP4, plain streams to MPEG-TS
+            output_path += '.mp4' if playlist['init'] else '.ts'
+            part_path = output_path + '.part'
+            state_path = part_path + '.json'
+
+            start, offset = self._load_state(state_path, playlist_url, len(segments))
+            mode = 'r+b' if start and os.path.exists(part_path) else 'wb'
+            if mode == 'wb':
+                start, offset = 0, 0
+            else:
+                logging.info(f"Resuming {playlist_url} at segment {start}/{len(segments)}")
+
+            with open(part_path, mode) as f:
+                self._digest = FileHasher()
+                # File I/O runs on worker threads, the loop keeps serving the segment fetches
+                await asyncio.to_thread(self._open_part, f, offset)
+                if playlist['init'] and start == 0:
+                    init = await self._fetch_segment(session, dict(playlist['init'], key=None))
+                    await asyncio.to_thread(self._write, f, init)
+                await self._download_segments(session, segments, start, f, playlist_url, state_path)
+
+            self.sha256 = self._digest.hexdigest()
+            self.pieces = self._digest.pieces()
+            os.replace(part_path, output_path)
+            if os.path.exists(state_path):
+                os.remove(state_path)
+            return output_path
+
+    async def _load_media_playlist(self, session, url):
+        """Fetch a playlist, following a master playlist to one variant."""
+        playlist = parse_playlist((await self._fetch(session, url)).decode('utf-8', 'ignore'), url)
+        if 'variants' in playlist:
+            variant = select_variant(playlist['variants'], self.max_bandwidth)
+            logging.info(f"Selected variant {variant['resolution']} @ {variant['bandwidth']}bps: {variant['uri']}")
+            url = variant['uri']
+            playlist = parse_playlist((await self._fetch(session, url)).decode('utf-8', 'ignore'), url)
+            if 'variants' in playlist:
+                raise HLSError(f"Nested master playlist: {url}")
+        return url, playlist
+
+    async def _download_segments(self, session, segments, start, f, playlist_url, state_path):
+        """Fetch segments with a bounded look-ahead window and write them in order."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending = {}
+        next_index = start
+
+        async def fetch_segment(segment):
+            async with semaphore:
+                return await self._fetch_segment(session, segment)
+
+        try:
+            for index in range(start, len(segments)):
+                while next_index < len(segments) and next_index - index < self.window:
+                    pending[next_index] = asyncio.create_task(fetch_segment(segments[next_index]))
+                    next_index += 1
+                data = await pending.pop(index)
+                size = await asyncio.to_thread(self._commit, f, data, state_path, playlist_url, len(segments), index + 1)
+                if self.on_progress:
+                    self.on_progress(index + 1, len(segments), size)
+        finally:
+            for task in pending.values():
+                task.cancel()
+                if task.done() and not task.cancelled() and task.exception() is None and not isinstance(task.result(), bytes):
+                    # A cached segment that will not be written
+                    task.result().close()
+
+    def _open_part(self, f, offset):
+        """Cut the .part file to the checkpoint and hash what the previous attempt wrote."""
+        f.truncate(offset)
+        if offset:
+            f.seek(0)
+            while chunk := f.read(min(1024 * 1024, offset - f.tell())):
+                self._digest.update(chunk)
+        f.seek(offset)
+
+    def _commit(self, f, data, state_path, playlist_url, total, done):
+        """Write the next segment and checkpoint it, returning the bytes written so far."""
+        self._write(f, data)
+        f.flush()
+        self._save_state(state_path, playlist_url, total, done, f.tell())
+        return f.tell()
+
+    def _write(self, f, data):
+        """Write segment bytes, or copy a cached segment file and close it."""
+        if isinstance(data, bytes):
+            f.write(data)
+            self._digest.update(data)
+            return
+        with data:
+            copy_into(data, f)
+            # The copy bypasses this process, hash the segment from the cache file
+            data.seek(0)
+            while chunk := data.read(1024 * 1024):
+                self._digest.update(chunk)
+
+    async def _fetch_segment(self, session, segment):
+        """
+        Fetch one segment and decrypt it if needed. A cached segment is
+        returned as an open file instead of bytes.
+        """
+        key = segment['key']
+        iv = None
+        if key:
+            if key['iv']:
+                iv = bytes.fromhex(key['iv'][2:] if key['iv'].lower().startswith('0x') else key['iv'])
+            else:
+                # Without an explicit IV the media sequence number is used
+                iv = segment['sequence'].to_bytes(16, 'big')
+        cache_key = None
+        if self.cache:
+            cache_key = segment_key(segment['uri'], segment['range'], key and key['uri'], iv and iv.hex())
+            cached = await asyncio.to_thread(self.cache.open, cache_key)
+            if cached:
+                return cached
+        data = await self._fetch(session, segment['uri'], segment['range'])
+        if key:
+            data = _decrypt(data, await self._get_key(session, key['uri']), iv)
+        if cache_key:
+            await asyncio.to_thread(self.cache.put, cache_key, data)
+        return data
+
+    async def _fetch(self, session, url, byterange=None):
+        """GET url (optionally a byte range) with retries."""
+        headers = {}
+        if byterange:
+            offset, length = byterange
+            headers['Range'] = f"bytes={offset}-{offset + length - 1}"
+        for attempt in range(self.retries + 1):
+            try:
+                async with session.get(url, headers=headers) as response:
+                    response.raise_for_status()
+                    if not self.limiters:
+                        return await response.read()
+                    return await self._read_limited(response)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.retries:
+                    raise HLSError(f"Failed to fetch {url}: {str(e)}") from e
+                # Exponential backoff with jitter
+                await asyncio.sleep(random.uniform(0.5, 1) * min(2 ** attempt, 10))
+
+    async def _read_limited(self, response):
+        """Read a response body in chunks, waiting on the token buckets; not reading holds back the sender."""
+        data = bytearray()
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            data += chunk
+            for limiter in self.limiters:
+                await limiter.consume(len(chunk))
+        return bytes(data)
+
+    async def _get_key(self, session, uri):
+        """Fetch each key once, shared by all segments that use it."""
+        if uri not in self._keys:
+            self._keys[uri] = asyncio.ensure_future(self._fetch(session, uri))
+        return await self._keys[uri]
+
+    @staticmethod
+    def _load_state(state_path, playlist_url, total):
+        """Return (segments written, bytes written) of a previous attempt."""
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state['url'] == playlist_url and state['total'] == total:
+                return state['done'], state['bytes']
+        except (OSError, ValueError, KeyError):
+            pass
+        return 0, 0
+
+    @staticmethod
+    def _save_state(state_path, playlist_url, total, done, size):
+        with open(state_path, 'w', encoding='utf-8') as f:
+            json.dump({'url': playlist_url, 'total': total, 'done': done, 'bytes': size}, f)
+
+
+def remux_to_mp4(ts_path):
+    """Remux an MPEG-TS file to MP4 with ffmpeg, if it is installed."""
+    if not shutil.which('ffmpeg'):
+        return ts_path
+    mp4_path = os.path.splitext(ts_path)[0] + '.mp4'
+    command = ['ffmpeg', '-y', '-loglevel', 'error', '-i', ts_path, '-c', 'copy', mp4_path]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        logging.error(f"Failed to remux {ts_path}: {result.stderr}")
+        return ts_path
+    os.remove(ts_path)
+    return mp4_path
@@ -0,0 +1,167 @@
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS host_stats (
+    host TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    connections INTEGER NOT NULL,
+    samples INTEGER NOT NULL,
+    speed REAL NOT NULL,
+    failure_rate REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (host, kind, connections)
+);
+"""
+
+# Weight of the newest sample in the moving averages
+ALPHA = 0.3
+# Samples of the best setting before its neighbours are tried
+MIN_SAMPLES = 3
+# Smaller downloads say more about latency than throughput
+MIN_SAMPLE_BYTES = 1024 * 1024
+
+
+def url_host(url):
+    """Host (and port) of a URL, or None for magnets and unparsable URLs."""
+    try:
+        return urlsplit(url).netloc.lower() or None
+    except ValueError:
+        return None
+
+
+def parse_candidates(value):
+    """Connection counts to choose from: a list or a string like '1,2,4,8,16'."""
+    if isinstance(value, str):
+        value = [part for part in value.split(',') if part.strip()]
+    candidates = sorted({int(n) for n in value if int(n) > 0})
+    if not candidates:
+        raise ValueError(f"No connection counts in {value!r}")
+    return candidates
+
+
+class HostTuner:
+    """
+    Per-host connection tuning from observed throughput.
+
+    For every host and kind of download ('aria2' connections per job, or
+    'hls' concurrent segments) the average speed and failure rate of each
+    connection count is kept, persisted in SQLite. choose() hill-climbs:
+    it starts at ``default``, uses the best setting seen so far, and tries
+    the neighbouring counts once the best one has MIN_SAMPLES samples and
+    then ``explore`` of the time, so a host that throttles parallel
+    connections settles low and a fast one high. ``max_jobs`` caps the
+    running jobs per host (0 for no cap) through acquire()/release().
+    With no ``candidates`` only the cap applies and nothing is learned.
+    """
+
+    def __init__(self, db_path, candidates=(1, 2, 4, 8, 16), max_jobs=0, explore=0.1):
+        self.candidates = parse_candidates(candidates) if candidates else []
+        self.max_jobs = max_jobs
+        self.explore = explore
+        self._stats = {}  # (host, kind) -> {connections: [samples, speed, failure_rate]}
+        self._running = {}
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        for host, kind, connections, samples, speed, failure_rate in self._conn.execute(
+            'SELECT host, kind, connections, samples, speed, failure_rate FROM host_stats'
+        ):
+            self._stats.setdefault((host, kind), {})[connections] = [samples, speed, failure_rate]
+
+    @staticmethod
+    def _score(entry):
+        _, speed, failure_rate = entry
+        return speed * (1 - failure_rate)
+
+    def _nearest(self, n):
+        return min(self.candidates, key=lambda c: (abs(c - n), c))
+
+    def choose(self, host, kind, default):
+        """Connection count for a new job of kind on host."""
+        if not host or not self.candidates:
+            return default
+        with self._lock:
+            stats = dict(self._stats.get((host, kind), {}))
+        tried = {n: entry for n, entry in stats.items() if n in self.candidates}
+        if not tried:
+            return self._nearest(default)
+        best = max(tried, key=lambda n: (self._score(tried[n]), -abs(n - default)))
+        if tried[best][0] < MIN_SAMPLES:
+            return best
+        index = self.candidates.index(best)
+        neighbours = self.candidates[max(0, index - 1):index] + self.candidates[index + 1:index + 2]
+        untried = [n for n in neighbours if n not in tried]
+        if untried:
+            return random.choice(untried)
+        if neighbours and random.random() < self.explore:
+            return random.choice(neighbours)
+        return best
+
+    def record(self, host, kind, connections, size=None, duration=None, ok=True):
+        """
+        Record a finished attempt: its size in bytes and duration in seconds
+        if it succeeded, or a failure.
+        """
+        if not host or not self.candidates:
+            return
+        if ok and (not size or size < MIN_SAMPLE_BYTES or not duration or duration <= 0):
+            # Too small to tell anything about throughput
+            return
+        with self._lock:
+            entry = self._stats.setdefault((host, kind), {}).get(connections)
+            if entry is None:
+                entry = [0, size / duration if ok else 0.0, 0.0 if ok else 1.0]
+                self._stats[(host, kind)][connections] = entry
+            else:
+                if ok:
+                    entry[1] = (1 - ALPHA) * entry[1] + ALPHA * size / duration
+                entry[2] = (1 - ALPHA) * entry[2] + ALPHA * (0.0 if ok else 1.0)
+            entry[0] += 1
+            self._conn.execute(
+                'INSERT OR REPLACE INTO host_stats (host, kind, connections, samples, speed, failure_rate, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (host, kind, connections, *entry, time.time())
+            )
+        logging.debug(f"Host {host} ({kind}, {connections} connections): {entry}")
+
+    def acquire(self, host):
+        """Take a job slot on host; False if max_jobs jobs are already running there."""
+        if not host:
+            return True
+        with self._lock:
+            running = self._running.get(host, 0)
+            if self.max_jobs and running >= self.max_jobs:
+                return False
+            self._running[host] = running + 1
+        return True
+
+    def release(self, host):
+        if not host:
+            return
+        with self._lock:
+            running = self._running.get(host, 0) - 1
+            if running > 0:
+                self._running[host] = running
+            else:
+                self._running.pop(host, None)
+
+    def summary(self, host, kind):
+        """{connections: (samples, speed, failure rate)} learned for host."""
+        with self._lock:
+            return {n: tuple(entry) for n, entry in self._stats.get((host, kind), {}).items()}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
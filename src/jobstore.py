@@ -0,0 +1,148 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    digest TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    gid TEXT,
+    file_path TEXT,
+    error TEXT,
+    receive_time REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+CREATE INDEX IF NOT EXISTS jobs_digest ON jobs (digest);
+"""
+
+
+def payload_digest(payload: str):
+    """Stable digest of a request payload."""
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class JobStore:
+    """
+    Durable job queue backed by SQLite.
+
+    The database runs in WAL mode with ``synchronous=NORMAL``: a commit is
+    an append to the WAL without an fsync, which survives a process crash
+    and keeps enqueueing cheap. The WAL is synced on checkpoints only.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        db_dir = os.path.dirname(path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+
+    def add(self, payload: str, receive_time: float, state=QUEUED):
+        """Record a new job and return its id."""
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO jobs (digest, payload, state, receive_time, updated_at) VALUES (?, ?, ?, ?, ?)',
+                (payload_digest(payload), payload, state, receive_time, time.time())
+            )
+            return cursor.lastrowid
+
+    def add_many(self, payloads, receive_time: float, state=QUEUED):
+        """Record several jobs in one transaction and return their ids."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                job_ids = [
+                    self._conn.execute(
+                        'INSERT INTO jobs (digest, payload, state, receive_time, updated_at) VALUES (?, ?, ?, ?, ?) RETURNING id',
+                        (payload_digest(payload), payload, state, receive_time, now)
+                    ).fetchone()[0]
+                    for payload in payloads
+                ]
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return job_ids
+
+    def update(self, job_id, state, **fields):
+        """Set a job's state and any of gid, file_path or error."""
+        columns = {key: fields[key] for key in ('gid', 'file_path', 'error') if key in fields}
+        assignments = ''.join(f', {key} = ?' for key in columns)
+        with self._lock:
+            self._conn.execute(
+                f'UPDATE jobs SET state = ?, updated_at = ?{assignments} WHERE id = ?',
+                (state, time.time(), *columns.values(), job_id)
+            )
+
+    def get(self, job_id):
+        """Return a job as a dict, or None."""
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def unfinished(self):
+        """Jobs that were queued or running, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT * FROM jobs WHERE state IN (?, ?) ORDER BY id', (QUEUED, RUNNING)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def done_since(self, timestamp):
+        """Finished jobs with a file path, updated after timestamp, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT * FROM jobs WHERE state = ? AND file_path IS NOT NULL AND updated_at >= ? ORDER BY updated_at',
+                (DONE, timestamp)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def seen(self, payload: str, unfinished=False):
+        """Whether a job with the same payload is queued, running or done (only queued or running with unfinished)."""
+        states = (QUEUED, RUNNING) if unfinished else (QUEUED, RUNNING, DONE)
+        with self._lock:
+            row = self._conn.execute(
+                f'SELECT 1 FROM jobs WHERE digest = ? AND state IN ({", ".join("?" * len(states))}) LIMIT 1',
+                (payload_digest(payload), *states)
+            ).fetchone()
+        return row is not None
+
+    def counts(self):
+        """Number of jobs per state."""
+        with self._lock:
+            rows = self._conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall()
+        return {state: count for state, count in rows}
+
+    def prune(self, max_age):
+        """Delete finished jobs older than max_age seconds."""
+        with self._lock:
+            cursor = self._conn.execute(
+                'DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?',
+                (DONE, FAILED, time.time() - max_age)
+            )
+        if cursor.rowcount:
+            logging.info(f"Pruned {cursor.rowcount} finished jobs from {self.path}")
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
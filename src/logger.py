@@ -1,22 +1,137 @@
-import os
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+# 日志中消息内容的最大长度，由 setup_logging 设置
+PAYLOAD_MAX = 200
+
+
+def clip(payload, limit=None):
+    """Shorten a message payload for logging."""
+    limit = PAYLOAD_MAX if limit is None else limit
+    text = str(payload)
+    if limit and len(text) > limit:
+        return f"{text[:limit]}... ({len(text)} chars)"
+    return text
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line; ``job_id`` passed in ``extra`` becomes a field."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        job_id = getattr(record, 'job_id', None)
+        if job_id is not None:
+            entry['job_id'] = job_id
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SampleFilter(logging.Filter):
+    """
+    Let at most ``rate`` records per second through among those logged
+    with ``extra={'sample': True}`` (per-message chatter); the number of
+    dropped records is reported once a second. Other records always pass.
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self._second = 0
+        self._count = 0
+        self._dropped = 0
+        self._lock = threading.Lock()
 
-def setup_logging(name: str):
-    """配置日志记录"""
+    def filter(self, record):
+        if not getattr(record, 'sample', False):
+            return True
+        now = int(time.time())
+        with self._lock:
+            if now != self._second:
+                dropped, self._dropped = self._dropped, 0
+                self._second, self._count = now, 0
+                if dropped:
+                    record.msg = f"{record.msg} ({dropped} similar messages suppressed)"
+            self._count += 1
+            if self._count > self.rate:
+                self._dropped += 1
+                return False
+        return True
 
-    # 确保下载目录存在
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(name: str, config=None):
+    """
+    配置日志记录
+
+    Callers only put records on a queue; a listener thread formats them
+    and writes the rotated log file and the console, so slow disks never
+    hold up the MQTT network thread. Returns the listener.
+    """
+    global PAYLOAD_MAX
+    config = config or {}
+
+    # 确保日志目录存在
     log_path = "logs"
     if not os.path.exists(log_path):
-        os.makedirs(log_path)   
+        os.makedirs(log_path)
 
     output_path = os.path.join(log_path, f'video_{name}.log')
 
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        # format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(output_path),
-            logging.StreamHandler()
-        ]
-    )
+    if config.get('LOG_ROTATE_WHEN'):
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            output_path, when=config['LOG_ROTATE_WHEN'], backupCount=config.get('LOG_BACKUP_COUNT', 5),
+            encoding='utf-8',
+        )
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            output_path, maxBytes=config.get('LOG_MAX_BYTES', 50 * 1024 * 1024),
+            backupCount=config.get('LOG_BACKUP_COUNT', 5), encoding='utf-8',
+        )
+    if config.get('LOG_FORMAT') == 'json':
+        file_handler.setFormatter(JSONFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+
+    PAYLOAD_MAX = config.get('LOG_PAYLOAD_MAX', PAYLOAD_MAX)
+    queue_handler = DroppingQueueHandler(queue.Queue(10000))
+    if config.get('LOG_SAMPLE_RATE'):
+        queue_handler.addFilter(SampleFilter(config['LOG_SAMPLE_RATE']))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.setLevel(logging.INFO)
+    root.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(queue_handler.queue, file_handler, console_handler)
+    listener.start()
+    # Flush what is still queued on exit
+    atexit.register(listener.stop)
+    return listener
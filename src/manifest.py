@@ -0,0 +1,302 @@
+import hashlib
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha256 TEXT,
+    seq INTEGER NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    piece_size INTEGER,
+    pieces TEXT
+);
+CREATE INDEX IF NOT EXISTS files_seq ON files (seq);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+HASH_CHUNK = 1024 * 1024
+# Piece hashes are kept for pieces of this size, see Manifest.pieces
+PIECE_SIZE = 4 * 1024 * 1024
+# Files hashed at a time for Manifest.pieces
+PIECE_WORKERS = 2
+
+
+class ManifestBusy(Exception):
+    pass
+
+
+class FileHasher:
+    """SHA-256 of a stream and of every PIECE_SIZE bytes of it, in one pass."""
+
+    def __init__(self, piece_size=PIECE_SIZE):
+        self.piece_size = piece_size
+        self._digest = hashlib.sha256()
+        self._piece = hashlib.sha256()
+        self._piece_bytes = 0
+        self._pieces = []
+
+    def update(self, data):
+        self._digest.update(data)
+        view = memoryview(data)
+        while view:
+            n = min(len(view), self.piece_size - self._piece_bytes)
+            self._piece.update(view[:n])
+            self._piece_bytes += n
+            view = view[n:]
+            if self._piece_bytes == self.piece_size:
+                self._pieces.append(self._piece.hexdigest())
+                self._piece = hashlib.sha256()
+                self._piece_bytes = 0
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def pieces(self):
+        """Piece hashes so far, the last piece may be shorter."""
+        return self._pieces + ([self._piece.hexdigest()] if self._piece_bytes else [])
+
+
+def file_sha256(path):
+    """SHA-256 of a file, read in 1 MB chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_hashes(path):
+    """SHA-256 and PIECE_SIZE piece hashes of a file, read once."""
+    hasher = FileHasher()
+    with open(path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK):
+            hasher.update(chunk)
+    return hasher.hexdigest(), hasher.pieces()
+
+
+def piece_sha256(path, piece_size):
+    """SHA-256 of every piece_size bytes of a file, the last piece may be shorter."""
+    pieces = []
+    with open(path, 'rb') as f:
+        while True:
+            digest = hashlib.sha256()
+            remaining = piece_size
+            while remaining and (chunk := f.read(min(HASH_CHUNK, remaining))):
+                digest.update(chunk)
+                remaining -= len(chunk)
+            if remaining == piece_size:
+                return pieces
+            pieces.append(digest.hexdigest())
+
+
+class Manifest:
+    """
+    Index of finished files below ``root``: path, size, mtime and SHA-256.
+
+    Every change (a new or rewritten file, or a removal, kept as a
+    tombstone) gets the next sequence number, so a reader that remembers
+    the last ``seq`` it saw fetches only what changed since. The fetcher
+    keeps one for DOWNLOAD_DIR and serves it; the puller keeps one for
+    ARIA2_DOWNLOAD_DIR to diff against it. Files are hashed on a single
+    background thread with update_later(), so completing a job never
+    waits for a large file to be read back. The SHA-256 of every
+    PIECE_SIZE bytes is kept with each file, for pieces().
+    """
+
+    def __init__(self, path, root):
+        self.path = path
+        self.root = root
+        db_dir = os.path.dirname(path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        columns = {row['name'] for row in self._conn.execute('PRAGMA table_info(files)')}
+        for column, kind in (('piece_size', 'INTEGER'), ('pieces', 'TEXT')):
+            if column not in columns:
+                # Databases created before piece hashes were kept
+                self._conn.execute(f'ALTER TABLE files ADD COLUMN {column} {kind}')
+        self._hashing = threading.BoundedSemaphore(PIECE_WORKERS)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="manifest")
+
+    def _files(self, file_path):
+        """Relative paths of the files at file_path (a directory, e.g. a torrent, is expanded)."""
+        full_path = os.path.join(self.root, file_path)
+        if not os.path.isdir(full_path):
+            return [file_path]
+        files = []
+        for dirpath, _, filenames in os.walk(full_path):
+            for filename in filenames:
+                rel_path = os.path.relpath(os.path.join(dirpath, filename), self.root)
+                files.append(rel_path.replace(os.sep, '/'))
+        return sorted(files)
+
+    def update(self, file_path, sha256=None, pieces=None):
+        """
+        Index the file (or the files below the directory) at file_path.
+
+        The file is hashed unless ``sha256`` is given or size and mtime are
+        unchanged since it was last indexed. ``pieces`` are its PIECE_SIZE
+        piece hashes, computed along with ``sha256``. Returns the number of
+        entries that changed.
+        """
+        changed = 0
+        for rel_path in self._files(file_path):
+            try:
+                stat = os.stat(os.path.join(self.root, rel_path))
+            except OSError:
+                changed += self.remove(rel_path)
+                continue
+            entry = self.get(rel_path)
+            if entry and not entry['deleted'] and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                if sha256 is None or sha256 == entry['sha256']:
+                    continue
+            digest, piece_hashes = sha256, pieces
+            try:
+                if digest is None:
+                    digest, piece_hashes = file_hashes(os.path.join(self.root, rel_path))
+            except OSError as e:
+                logging.error(f"Failed to hash {rel_path}: {str(e)}")
+                continue
+            with self._lock:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO files (path, size, mtime, sha256, seq, deleted, piece_size, pieces) '
+                    'VALUES (?, ?, ?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM files), 0, ?, ?)',
+                    (rel_path, stat.st_size, stat.st_mtime, digest,
+                     PIECE_SIZE if piece_hashes is not None else None,
+                     json.dumps(piece_hashes) if piece_hashes is not None else None)
+                )
+            changed += 1
+        return changed
+
+    def update_later(self, file_path, sha256=None, pieces=None):
+        """Index file_path on the background thread."""
+        return self._executor.submit(self._run, self.update, file_path, sha256, pieces)
+
+    def rescan_later(self):
+        """Run rescan() on the background thread."""
+        return self._executor.submit(self._run, self.rescan)
+
+    def _run(self, fn, *args):
+        try:
+            return fn(*args)
+        except Exception as e:
+            logging.error(f"Failed to update manifest {self.path}: {str(e)}")
+
+    def remove(self, file_path):
+        """Record that file_path (or every file below it) is gone. Returns the number of entries removed."""
+        with self._lock:
+            cursor = self._conn.execute(
+                'UPDATE files SET deleted = 1, seq = (SELECT MAX(seq) + 1 FROM files) '
+                'WHERE deleted = 0 AND (path = ? OR path LIKE ? ESCAPE ?)',
+                (file_path, file_path.replace('!', '!!').replace('%', '!%').replace('_', '!_') + '/%', '!')
+            )
+        return cursor.rowcount
+
+    def rescan(self):
+        """Re-check indexed files against the disk: drop missing ones and rehash changed ones."""
+        with self._lock:
+            rows = self._conn.execute('SELECT path FROM files WHERE deleted = 0').fetchall()
+        changed = sum(self.update(row['path']) for row in rows)
+        if changed:
+            logging.info(f"Manifest {self.path}: {changed} entries changed on disk")
+        return changed
+
+    def get(self, file_path):
+        """Return an entry as a dict, or None."""
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM files WHERE path = ?', (file_path,)).fetchone()
+        return dict(row) if row else None
+
+    def pieces(self, file_path):
+        """
+        The PIECE_SIZE piece hashes of an indexed file as {'size',
+        'piece_size', 'pieces'}, or None if it is not indexed or changed on
+        disk since. Files indexed without them are hashed now and the
+        result is kept; at most PIECE_WORKERS callers hash at a time, the
+        others get ManifestBusy.
+        """
+        entry = self.get(file_path)
+        if entry is None or entry['deleted']:
+            return None
+        full_path = os.path.join(self.root, file_path)
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            return None
+        if stat.st_size != entry['size'] or stat.st_mtime != entry['mtime']:
+            return None
+        if entry['pieces'] is not None and entry['piece_size'] == PIECE_SIZE:
+            return {'size': entry['size'], 'piece_size': PIECE_SIZE, 'pieces': json.loads(entry['pieces'])}
+
+        if not self._hashing.acquire(blocking=False):
+            raise ManifestBusy(f"Too many files being hashed, try {file_path} again later")
+        try:
+            pieces = piece_sha256(full_path, PIECE_SIZE)
+        finally:
+            self._hashing.release()
+        with self._lock:
+            # Not a new version of the file, the sequence number stays
+            self._conn.execute(
+                'UPDATE files SET piece_size = ?, pieces = ? WHERE path = ? AND size = ? AND mtime = ?',
+                (PIECE_SIZE, json.dumps(pieces), file_path, entry['size'], entry['mtime'])
+            )
+        return {'size': entry['size'], 'piece_size': PIECE_SIZE, 'pieces': pieces}
+
+    def seq(self):
+        """Sequence number of the latest change."""
+        with self._lock:
+            return self._conn.execute('SELECT COALESCE(MAX(seq), 0) FROM files').fetchone()[0]
+
+    def changes(self, since=0):
+        """
+        Entries changed after sequence number ``since``, oldest first, and
+        the current sequence number. Tombstones are left out of a full
+        listing (since=0).
+        """
+        with self._lock:
+            current = self._conn.execute('SELECT COALESCE(MAX(seq), 0) FROM files').fetchone()[0]
+            rows = self._conn.execute(
+                'SELECT path, size, mtime, sha256, seq, deleted FROM files '
+                'WHERE seq > ? AND (? > 0 OR deleted = 0) ORDER BY seq',
+                (since, since)
+            ).fetchall()
+        return [dict(row) for row in rows], current
+
+    def instance_id(self):
+        """Random id of this manifest; a reader starts over when it changes (e.g. the database was reset)."""
+        value = self.get_value('id')
+        if value is None:
+            value = secrets.token_hex(8)
+            self.set_value('id', value)
+        return value
+
+    def get_value(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else default
+
+    def set_value(self, key, value):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            self._conn.close()
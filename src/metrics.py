@@ -0,0 +1,228 @@
+import bisect
+import logging
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+Prometheus metrics in the text exposition format, without extra dependencies.
+
+Updating a metric takes one uncontended lock and, for histograms, a
+bisect over a dozen buckets, so the instrumentation stays on under load.
+Gauges that mirror existing state (worker pools, aria2) are read through
+callbacks only when /metrics is scraped.
+"""
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                logging.error(f"Failed to collect metric {metric.name}: {str(e)}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [(self.name, _labels(self.labels, key), value) for key, value in values]
+
+
+class Gauge:
+    """A gauge read from fn() at scrape time: a number, or {label values: number}."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.fn = None
+        registry.register(self)
+
+    def set_function(self, fn):
+        self.fn = fn
+
+    def samples(self):
+        if self.fn is None:
+            return []
+        values = self.fn()
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name, _labels(self.labels, key), value) for key, value in values.items()]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+        samples = []
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", _labels(self.labels, key, [('le', _format_value(bound))]), cumulative))
+            samples.append((f"{self.name}_sum", _labels(self.labels, key), counts[-1]))
+            samples.append((f"{self.name}_count", _labels(self.labels, key), cumulative))
+        return samples
+
+
+class MetricsServer:
+    """Serve a registry on http://host:port/metrics from a background thread."""
+
+    def __init__(self, registry=REGISTRY, host='0.0.0.0', port=9464):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            logging.error(f"Failed to start metrics server: {str(e)}")
+            return False
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+        logging.info(f"Metrics available on http://{self.host}:{self.port}/metrics")
+        return True
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+# Metrics shared by fetcher and puller
+JOBS = Counter('downloader_jobs_total', 'Finished jobs by type and outcome', ('type', 'outcome'))
+QUEUE_WAIT = Histogram(
+    'downloader_queue_wait_seconds', 'Time from receive_time until a worker starts the job',
+    ('type', 'priority'), buckets=(0.01, 0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600),
+)
+DOWNLOAD_DURATION = Histogram(
+    'downloader_download_duration_seconds', 'Duration of successful download attempts',
+    ('type',), buckets=(1, 5, 15, 60, 300, 900, 1800, 3600, 7200),
+)
+DOWNLOAD_SPEED = Histogram(
+    'downloader_download_bytes_per_second', 'Average speed of successful download attempts',
+    ('type',), buckets=tuple(2 ** n for n in range(14, 31, 2)),
+)
+RPC_LATENCY = Histogram(
+    'downloader_aria2_rpc_seconds', 'aria2 JSON-RPC call latency, including batching',
+    ('method',), buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+ACTIVE_WORKERS = Gauge('downloader_active_workers', 'Running jobs per worker pool', ('type',))
+QUEUED_JOBS = Gauge('downloader_queued_jobs', 'Jobs waiting for a worker per worker pool', ('type',))
+ARIA2_DOWNLOADS = Gauge('downloader_aria2_downloads', 'aria2 downloads by state', ('state',))
+
+
+def observe_download(ftype, duration, size):
+    """Record a successful download attempt of size bytes (None if unknown)."""
+    DOWNLOAD_DURATION.observe(duration, ftype)
+    if size and duration > 0:
+        DOWNLOAD_SPEED.observe(size / duration, ftype)
+
+
+def aria2_downloads(aria2server):
+    """Gauge callback: active/waiting downloads from aria2.getGlobalStat, skipped while aria2 is down."""
+    def collect():
+        try:
+            stat = aria2server.rpc().submit('aria2.getGlobalStat').result(timeout=2)
+        except Exception:
+            return None
+        return {('active',): int(stat['numActive']), ('waiting',): int(stat['numWaiting'])}
+    return collect
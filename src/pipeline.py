@@ -0,0 +1,121 @@
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from hls import remux_to_mp4
+from manifest import file_hashes
+
+
+def postprocess(path, remux=False, sha256=None, pieces=None):
+    """
+    CPU-bound work on a finished download, run in a worker process: remux
+    an MPEG-TS file to MP4 and hash the result (whole and in pieces for
+    the manifest), unless ``sha256`` and ``pieces`` were computed while
+    the download was written and remuxing did not change the file.
+    Returns (path, size, sha256, pieces); all but path are None for a
+    directory.
+    """
+    if remux and path.endswith('.ts'):
+        remuxed = remux_to_mp4(path)
+        if remuxed != path:
+            path, sha256 = remuxed, None
+    if not os.path.isfile(path):
+        return path, None, None, None
+    if sha256 is None:
+        sha256, pieces = file_hashes(path)
+    return path, os.path.getsize(path), sha256, pieces
+
+
+class Pipeline:
+    """
+    The stages of a job after its download.
+
+    Post-processing runs on a process pool sized to the CPU cores and
+    publishing on a thread of its own, so a download worker is free for
+    the next download as soon as its file is written, and a slow remux
+    never holds a network slot. At most ``max_pending`` jobs are handed
+    to the process pool at a time; the rest wait in a queue fed by
+    submit(), which never blocks, since it is called from the aria2
+    notification thread. A submitter thread moves jobs from the queue to
+    the pool as slots free up.
+    """
+
+    def __init__(self, workers=0, max_pending=0, name="pipeline"):
+        self.workers = workers or os.cpu_count() or 1
+        # Not forked: the parent runs MQTT, aria2 and HLS threads
+        self._processes = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        self._publisher = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-publish")
+        self._slots = threading.BoundedSemaphore(max_pending or self.workers * 4)
+        self._queue = queue.Queue()
+        self._stop_event = threading.Event()
+        self._submitter = threading.Thread(target=self._submit_loop, name=f"{name}-submit", daemon=True)
+        self._submitter.start()
+
+    def submit(self, fn, args, on_done, on_error):
+        """
+        Run fn(*args) on the process pool, then on_done(result) or
+        on_error(exception) on the publish thread. Returns at once.
+        """
+        self._queue.put((fn, args, on_done, on_error))
+
+    def pending(self):
+        """Number of jobs waiting for a post-processing slot."""
+        return self._queue.qsize()
+
+    def _submit_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                item = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            if item is None:
+                return
+            # Wait for a slot here, not in the caller
+            while not self._slots.acquire(timeout=1.0):
+                if self._stop_event.is_set():
+                    return
+            fn, args, on_done, on_error = item
+            try:
+                future = self._processes.submit(fn, *args)
+            except Exception as e:
+                self._slots.release()
+                self._publisher.submit(self._run, on_error, (e,))
+                continue
+            future.add_done_callback(lambda f, on_done=on_done, on_error=on_error: self._finish(f, on_done, on_error))
+
+    def publish(self, fn, *args):
+        """Run fn(*args) on the publish thread, for jobs with nothing to post-process."""
+        self._publisher.submit(self._run, fn, args)
+
+    def _finish(self, future, on_done, on_error):
+        self._slots.release()
+        try:
+            error = future.exception()
+        except Exception as e:
+            # Cancelled on shutdown
+            error = e
+        try:
+            if error is None:
+                self._publisher.submit(self._run, on_done, (future.result(),))
+            else:
+                self._publisher.submit(self._run, on_error, (error,))
+        except RuntimeError:
+            logging.warning("Pipeline is shut down, dropping a finished job")
+
+    @staticmethod
+    def _run(fn, args):
+        try:
+            fn(*args)
+        except Exception as e:
+            logging.error(f"Error in publish stage: {str(e)}")
+
+    def shutdown(self):
+        """Drop jobs that are not post-processed yet and wait for publishing to finish."""
+        self._stop_event.set()
+        self._queue.put(None)
+        self._submitter.join()
+        self._processes.shutdown(wait=False, cancel_futures=True)
+        self._publisher.shutdown(wait=True)
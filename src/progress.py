@@ -0,0 +1,156 @@
+import json
+import logging
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+# aria2 status keys needed for a progress report
+PROGRESS_KEYS = ['gid', 'following', 'completedLength', 'totalLength', 'downloadSpeed', 'connections']
+
+# Waiting downloads reported per tick
+MAX_WAITING = 1000
+
+
+class ProgressReporter:
+    """
+    Publish live progress of running jobs to TOPIC_PROGRESS.
+
+    aria2 jobs are polled with one ``system.multicall`` of ``tellActive``
+    and ``tellWaiting`` per tick, whatever the number of jobs. HLS jobs
+    report segments as they are written. Updates are coalesced: only the
+    latest state of each job is kept, jobs that did not change since the
+    last tick are skipped, and each tick publishes at most one message per
+    ``batch_size`` jobs, so the publish rate stays bounded.
+    """
+
+    def __init__(self, client, config, aria2server=None, interval=2, batch_size=100):
+        self.client = client
+        self.config = config
+        self.aria2server = aria2server
+        self.interval = interval
+        self.batch_size = batch_size
+        # job id -> {'job': ..., 'request': ..., 'gid': ..., 'progress': {...}}
+        self._jobs = {}
+        self._published = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the reporting thread."""
+        self._thread = threading.Thread(target=self._run, name="progress", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def watch_aria2(self, job, request, gid):
+        """Report an aria2 download until finish() is called."""
+        with self._lock:
+            self._jobs[job['id']] = {'job': job, 'request': request, 'gid': gid, 'progress': None}
+
+    def update_hls(self, job, request, done, total, size, connections=0):
+        """Record that done of total segments (size bytes) of an HLS job are written."""
+        with self._lock:
+            entry = self._jobs.setdefault(job['id'], {'job': job, 'request': request, 'gid': None, 'progress': None})
+            entry['hls'] = (done, total, size, connections)
+
+    def finish(self, job_id):
+        """Stop reporting a job; no progress is published for it afterwards."""
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            self._published.pop(job_id, None)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self._poll_aria2()
+                self._measure_hls()
+                self._publish()
+            except Exception as e:
+                logging.error(f"Error reporting progress: {str(e)}")
+
+    def _poll_aria2(self):
+        """Refresh all aria2 jobs from one multicall."""
+        with self._lock:
+            gids = {entry['gid']: job_id for job_id, entry in self._jobs.items() if entry['gid']}
+        if not gids or self.aria2server is None:
+            return
+
+        active, waiting = self.aria2server.rpc().multicall([
+            ('aria2.tellActive', [PROGRESS_KEYS]),
+            ('aria2.tellWaiting', [0, MAX_WAITING, PROGRESS_KEYS]),
+        ])
+        with self._lock:
+            for status in active + waiting:
+                # A magnet's real download follows its metadata download
+                gid = status['gid'] if status['gid'] in gids else status.get('following')
+                entry = self._jobs.get(gids.get(gid))
+                if entry is None:
+                    continue
+                entry['progress'] = {
+                    'completed': int(status['completedLength']),
+                    'total': int(status['totalLength']),
+                    'speed': int(status['downloadSpeed']),
+                    'connections': int(status['connections']),
+                }
+
+    def _measure_hls(self):
+        """Turn the latest HLS segment counts into progress, speed measured per tick."""
+        now = time.time()
+        with self._lock:
+            for entry in self._jobs.values():
+                if 'hls' not in entry:
+                    continue
+                done, total, size, connections = entry['hls']
+                last_time, last_size = entry.get('sample', (now, size))
+                speed = int((size - last_size) / (now - last_time)) if now > last_time else 0
+                entry['sample'] = (now, size)
+                entry['progress'] = {
+                    'completed': size,
+                    # The final size is estimated from the average segment size
+                    'total': int(size / done * total) if done else 0,
+                    'speed': speed,
+                    'connections': connections,
+                    'segments': done,
+                    'segments_total': total,
+                }
+
+    def _publish(self):
+        """Publish the jobs that changed since the last tick."""
+        now = int(time.time())
+        with self._lock:
+            reports = []
+            for job_id, entry in self._jobs.items():
+                progress = entry['progress']
+                if progress is None or self._published.get(job_id) == progress:
+                    continue
+                self._published[job_id] = progress
+                remaining = progress['total'] - progress['completed']
+                reports.append({
+                    'id': job_id,
+                    'url': entry['request']['url'],
+                    'name': entry['request']['name'] or '',
+                    **progress,
+                    'eta': -(-remaining // progress['speed']) if progress['speed'] and remaining > 0 else None,
+                })
+
+            # Published under the lock so nothing goes out after finish()
+            for start in range(0, len(reports), self.batch_size):
+                message = {
+                    'status': 'progress',
+                    'node': self.config.get('NODE_ID', ''),
+                    'jobs': reports[start:start + self.batch_size],
+                    'timestamp': now,
+                }
+                result = self.client.publish(
+                    self.config['TOPIC_PROGRESS'], json.dumps(message, ensure_ascii=False), qos=0
+                )
+                if result.rc != mqtt.MQTT_ERR_SUCCESS:
+                    logging.error(f"Failed to publish progress message: {result.rc}")
+        if reports:
+            logging.debug(f"Published progress of {len(reports)} jobs")
@@ -1,20 +1,38 @@
-import aria2p
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 import json
-import subprocess
+import os
+import secrets
 import time
 import logging
 import queue
 import threading
+import urllib.request
+from urllib.parse import quote, urlencode, urljoin
+from admission import AdmissionControl
 from aria2s import Aria2cServer
-from logger import setup_logging
+from fileserver import PIECES_PATH
+from hoststats import HostTuner, url_host
+from jobstore import JobStore, QUEUED, RUNNING, DONE, FAILED
+from logger import clip, setup_logging
+from manifest import Manifest, file_sha256, piece_sha256
+from metrics import ACTIVE_WORKERS, ARIA2_DOWNLOADS, JOBS, QUEUED_JOBS, MetricsServer, aria2_downloads, observe_download
+from retry import RetryScheduler, backoff_delay
+from tracker import Aria2Tracker, status_error_message, status_file_path
 from config import load_config
 from utils import extract_url_from_text, is_valid_magnet_url
+from workers import WorkerPool
 
 """
 下载到本地客户端
 """
 
+# 与原先的 aria2c -x 16 一致，也是没有调优记录的主机的初始连接数
+ARIA2_CONNECTIONS = 16
+# aria2 校验和不一致的错误码
+CHECKSUM_ERROR = '32'
+
 def on_connect(client, userdata, flags, rc, *args, **kwargs):
     """MQTT 连接回调函数，兼容 MQTT 3.1/3.1.1 和 5.0"""
     logging.info(f"Connected to MQTT broker with result code {rc}")
@@ -23,129 +41,448 @@ def on_connect(client, userdata, flags, rc, *args, **kwargs):
         config = userdata['config']
         client.subscribe(config['TOPIC_PUBLISH'], qos=config['QOS'])
         logging.info(f"Subscribed to topic: {config['TOPIC_PUBLISH']} with QoS {config['QOS']}")
+        # 重连后补齐断线期间错过的文件
+        if userdata.get('sync_event'):
+            userdata['sync_event'].set()
     else:
         logging.error(f"Failed to connect to MQTT broker: {rc}")
 
-def on_message(client, userdata, msg):
-    """MQTT 消息回调函数"""
-    logging.info(f"Received message on topic {msg.topic}: {msg.payload.decode()}")
+def accept_message(userdata, msg):
+    """持久化消息后加入队列；返回后才确认（ack）该消息，写入失败时抛出异常"""
     try:
-        # Add message to the queue
-        userdata['message_queue'].put((msg, time.time()))
-        logging.info(f"Message queued for processing: {msg.payload.decode()}")
-    except Exception as e:
-        logging.error(f"Error queuing message: {str(e)}")
+        payload = msg.payload.decode('utf-8')
+    except UnicodeDecodeError as e:
+        logging.error(f"Dropping undecodable message on topic {msg.topic}: {str(e)}")
+        return
+    job_store = userdata['job_store']
+    # 保留消息在每次重连时都会重新投递
+    if msg.retain and job_store.seen(payload):
+        logging.info(f"Skipping retained message already handled: {clip(payload)}")
+        return
+    receive_time = time.time()
+    job_id = job_store.add(payload, receive_time)
+    # Add message to the queue
+    userdata['message_queue'].put({'id': job_id, 'payload': payload, 'receive_time': receive_time, 'gid': None})
+    logging.info(
+        f"Received message on topic {msg.topic} as job {job_id}: {clip(payload)}",
+        extra={'job_id': job_id, 'sample': True},
+    )
 
-def download_file(download_url, config):
-    """
-    下载文件
+def create_aria2_server(config):
     """
-    if config['ARIA2_RPC_ENABLE']:
-        download_file_aria2_rpc(download_url, config)
-    else:
-        download_file_aria2c_cmd(download_url, config)
+    创建共享的 aria2 连接
 
-def download_file_aria2_rpc(download_url, config):
-    """
-    使用 aria2 RPC 下载文件
-    依赖 aria2c --enable-rpc
+    RPC 模式连接外部的 aria2c；命令行模式启动一个常驻的本地 aria2c 子进程，
+    所有文件都交给它下载，不再为每个文件启动一次 aria2c。
     """
-    logging.info(f"Downloading file using aria2 RPC: {download_url}")
-    try:
-        save_dir = config.get('ARIA2_DOWNLOAD_DIR', 'aria_downloads')
-        Aria2cServer(
+    save_dir = config.get('ARIA2_DOWNLOAD_DIR', 'aria_downloads')
+    if config['ARIA2_RPC_ENABLE']:
+        return Aria2cServer(
             host=config.get('ARIA2_RPC_HOST', '127.0.0.1'),
             port=config.get('ARIA2_RPC_PORT', 6800),
             secret=config.get('ARIA2_RPC_TOKEN', ''),
             save_dir=save_dir,
-        ).download(download_url, save_dir)  
-    except Exception as e:
-        logging.error(f"Error downloading file: {str(e)}")
+        )
+
+    aria2server = Aria2cServer(
+        host='http://localhost',
+        port=config['ARIA2_CLI_PORT'],
+        secret=secrets.token_hex(16),
+        save_dir=save_dir,
+    )
+    aria2server.spawn([f"--max-concurrent-downloads={config['PULL_WORKERS']}"])
+    return aria2server
 
-def download_file_aria2c_cmd(download_url, config):
+def download_file(download_url, config, aria2server, resume=False, out="", connections=None, sha256=None):
     """
-    使用命令行工具下载文件
-    依赖 aria2c
+    下载文件，返回 aria2 GID
+    resume 为 True 时（重试、重启后恢复的任务）续传已下载的部分；out 为相对于下载目录的保存路径；
+    connections 为调优选出的连接数；sha256 由 aria2 在下载完成后校验
     """
-    logging.info(f"Downloading file using aria2c: {download_url}")
+    logging.info(f"Downloading file using aria2 RPC: {download_url}")
     try:
-        # 你可以根据需要修改命令
-        command = [
-            'aria2c',
-            '-x', '16',
-            '-d', config['ARIA2_DOWNLOAD_DIR'],
-            download_url,
-        ]
-        
-        logging.info(f"Executing command: {' '.join(command)}")
-        
-        # 执行下载命令
-        result = subprocess.run(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            encoding="utf-8",          # 添加 encoding 时
-            # errors="ignore",           # 忽略非法字符            
-            text=True
+        options = {}
+        if connections:
+            options = {'max-connection-per-server': str(connections), 'split': str(connections), 'min-split-size': '1M'}
+        elif not config['ARIA2_RPC_ENABLE']:
+            options = {'max-connection-per-server': str(ARIA2_CONNECTIONS), 'split': str(ARIA2_CONNECTIONS)}
+        if resume:
+            options['continue'] = 'true'
+        if sha256:
+            options['checksum'] = f"sha-256={sha256}"
+        return aria2server.add_download(
+            download_url, config.get('ARIA2_DOWNLOAD_DIR', 'aria_downloads'), filename=out, options=options
         )
-        
-        if result.returncode == 0:
-            logging.info("File downloaded successfully")
-            return True
-        else:
-            logging.error(f"Failed to download file. Error: {result.stderr}")
-            return None
-            
     except Exception as e:
         logging.error(f"Error downloading file: {str(e)}")
         return None
-    
-def process_message(client, config, msg, receive_time):
-    """Process a single MQTT message."""
+
+def parse_download_url(payload):
+    """Extract the download URL from a completion message."""
+    # 尝试解析为JSON
     try:
-        payload = msg.payload.decode('utf-8')
-        logging.info(f"Processing message: {payload}")
+        data = json.loads(payload)
+        download_url = data.get('download_url')
+        # 集群模式下文件在发布消息的节点上
+        if not download_url and data.get('download_prefix_url') and data.get('file_path'):
+            download_url = f"{data['download_prefix_url']}{data['file_path']}"
+        if data.get('node'):
+            logging.info(f"File is on node {data['node']}")
+    except json.JSONDecodeError:
+        # 如果不是JSON，尝试直接提取URL
+        download_url = extract_url_from_text(payload)
 
-        # 尝试解析为JSON
-        try:
-            data = json.loads(payload)
-            download_url = data.get('download_url')
-        except json.JSONDecodeError:
-            # 如果不是JSON，尝试直接提取URL
-            download_url = extract_url_from_text(payload)
-        
-        if not download_url:
-            logging.warning("No valid URL found in the message")
-            return
-        
-        if not is_valid_magnet_url(download_url) and not extract_url_from_text(download_url):
-            logging.warning(f"Invalid URL: {download_url}")
+    if not download_url:
+        logging.warning("No valid URL found in the message")
+        return None
+
+    if not is_valid_magnet_url(download_url) and not extract_url_from_text(download_url):
+        logging.warning(f"Invalid URL: {download_url}")
+        return None
+
+    return download_url
+
+def parse_integrity(payload):
+    """完成消息或同步任务中的 {'file_path', 'size', 'sha256'}，没有哈希时返回 None"""
+    try:
+        data = json.loads(payload)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict) or not data.get('sha256') or data.get('size') is None or not data.get('file_path'):
+        return None
+    return {'file_path': data['file_path'], 'size': int(data['size']), 'sha256': data['sha256']}
+
+def fetch_pieces(download_url, file_path):
+    """从 fetcher 的文件服务器获取文件的分块 SHA-256，分块大小由服务器决定"""
+    query = urlencode({'path': file_path})
+    with urllib.request.urlopen(f"{urljoin(download_url, PIECES_PATH)}?{query}", timeout=300) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+def fetch_range(download_url, f, start, end):
+    """用 HTTP Range 重新下载 [start, end) 并写入 f 的相同位置"""
+    request = urllib.request.Request(download_url, headers={'Range': f"bytes={start}-{end - 1}"})
+    with urllib.request.urlopen(request, timeout=60) as response:
+        if response.status != 206:
+            raise ValueError(f"Server ignored the range request: HTTP {response.status}")
+        f.seek(start)
+        while chunk := response.read(1024 * 1024):
+            f.write(chunk)
+        if f.tell() != end:
+            raise ValueError(f"Short range response: {f.tell() - start} of {end - start} bytes")
+
+def repair_file(full_path, download_url, integrity):
+    """
+    校验失败的文件只重新下载哈希不一致的分块：向 fetcher 获取分块哈希，
+    与本地文件逐块比较，用 Range 请求补回不一致的部分。修复后与 sha256 一致时返回 True
+    """
+    size = integrity['size']
+    remote = fetch_pieces(download_url, integrity['file_path'])
+    piece_size = remote['piece_size']
+    if remote['size'] != size:
+        logging.warning(f"{integrity['file_path']} changed on the server, it has to be downloaded again")
+        return False
+    local = piece_sha256(full_path, piece_size) if os.path.isfile(full_path) else []
+    bad = [i for i, digest in enumerate(remote['pieces']) if i >= len(local) or local[i] != digest]
+    logging.info(f"Re-fetching {len(bad)} of {len(remote['pieces'])} pieces of {integrity['file_path']}")
+
+    # 相邻的坏块合并为一个 Range 请求
+    ranges = []
+    for i in bad:
+        start, end = i * piece_size, min((i + 1) * piece_size, size)
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    with open(full_path, 'r+b' if os.path.isfile(full_path) else 'wb') as f:
+        for start, end in ranges:
+            fetch_range(download_url, f, start, end)
+        f.truncate(size)
+    return file_sha256(full_path) == integrity['sha256']
+
+def repair_download(client, userdata, job, download_url, integrity, full_path, file_path):
+    """在工作线程中修复校验失败的下载，修复不了时删除文件后重新下载"""
+    try:
+        repaired = repair_file(full_path, download_url, integrity)
+    except Exception as e:
+        logging.error(f"Failed to repair {full_path}: {str(e)}")
+        repaired = False
+    if os.path.isfile(f"{full_path}.aria2"):
+        os.remove(f"{full_path}.aria2")
+    if repaired:
+        complete_pull(userdata, job, download_url, file_path, integrity['size'], integrity['sha256'])
+        return
+    if os.path.isfile(full_path):
+        # 不在损坏的文件上续传
+        os.remove(full_path)
+    retry_or_fail_job(client, userdata, job, download_url, "Checksum mismatch")
+
+def complete_pull(userdata, job, download_url, file_path, size, sha256=None):
+    """标记任务完成；sha256 为已校验的哈希，记入本地清单时不必再计算"""
+    logging.info(f"File downloaded successfully: {download_url}")
+    JOBS.inc('pull', 'success')
+    observe_download('pull', time.time() - job['started'], size)
+    finish_tuning(userdata, job, ok=True, size=size)
+    userdata['job_store'].update(job['id'], DONE, file_path=file_path)
+    # 记入本地清单，同步时据此判断文件是否已是最新
+    if userdata['local_index'] and file_path:
+        userdata['local_index'].update_later(file_path, sha256)
+
+def parse_sync_job(payload):
+    """The manifest entry of a job queued by sync, or None for a TOPIC_PUBLISH message."""
+    try:
+        data = json.loads(payload)
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) and data.get('sync') else None
+
+def finish_tuning(userdata, job, ok=None, size=None):
+    """释放任务占用的主机名额，并记录本次下载的结果（ok 为 None 时不记录）"""
+    tuning = job.pop('tuning', None)
+    if not tuning:
+        return
+    tuner = userdata['tuner']
+    tuner.release(tuning['host'])
+    if ok is not None and tuning['connections']:
+        tuner.record(tuning['host'], 'aria2', tuning['connections'], size, time.time() - job['started'], ok)
+
+def retry_or_fail_job(client, userdata, job, download_url, message="Failed to download file"):
+    """失败的任务按指数退避（带随机抖动）稍后重试，等待期间不占用工作线程"""
+    config = userdata['config']
+    finish_tuning(userdata, job, ok=False)
+    attempts = job.get('attempts', 0)
+    if attempts >= config['RETRY_MAX']:
+        JOBS.inc('pull', 'failed')
+        userdata['job_store'].update(job['id'], FAILED, error=message)
+        return
+    JOBS.inc('pull', 'retried')
+    job['attempts'] = attempts + 1
+    job['gid'] = None
+    delay = backoff_delay(attempts, config['RETRY_DELAY'], config['RETRY_MAX_DELAY'])
+    logging.info(
+        f"Retrying job {job['id']} in {delay:.1f}s (attempt {job['attempts']}): {message}", extra={'job_id': job['id']}
+    )
+    userdata['job_store'].update(job['id'], QUEUED, error=message)
+    userdata['retry_scheduler'].schedule(
+        delay, userdata['worker_pool'].submit, 'pull', process_message, client, userdata, job, download_url
+    )
+
+def process_message(client, userdata, job, download_url):
+    """
+    Start a single download.
+
+    The worker only hands the URL to aria2; the tracker marks the job done
+    or failed when aria2 reports the GID as finished.
+    """
+    config = userdata['config']
+    job_store = userdata['job_store']
+    aria2server = userdata['aria2server']
+    job_id = job['id']
+    tuner = userdata['tuner']
+    if tuner:
+        host = url_host(download_url)
+        if not tuner.acquire(host):
+            # 同一主机上的任务已达 HOST_MAX_JOBS，稍后再试
+            logging.info(f"Deferring job {job_id}: too many jobs running on {host}", extra={'job_id': job_id, 'sample': True})
+            userdata['retry_scheduler'].schedule(
+                config['RETRY_DELAY'], userdata['worker_pool'].submit, 'pull', process_message, client, userdata, job, download_url
+            )
             return
-            
+        job['tuning'] = {'host': host, 'connections': None}
+    job['started'] = time.time()
+    entry = parse_sync_job(job['payload'])
+    integrity = parse_integrity(job['payload']) if config['PULL_VERIFY'] else None
+    try:
         logging.info(f"Download URL: {download_url}")
 
-        # 下载文件
-        download_file(download_url, config)
-            
+        gid = job.get('gid')
+        resumed = bool(gid) and aria2server.resumable(gid)
+        if resumed:
+            logging.info(f"Resuming job {job_id} with aria2 download {gid}", extra={'job_id': job_id})
+        else:
+            out = ""
+            if entry:
+                # 同步任务按清单中的路径保存，首次下载前删除内容不同的旧文件
+                out = entry['file_path']
+                if not job.get('attempts') and not gid:
+                    remove_stale_file(config, out)
+            connections = None
+            if tuner:
+                # 按该主机的历史吞吐量选择连接数
+                connections = job['tuning']['connections'] = tuner.choose(job['tuning']['host'], 'aria2', ARIA2_CONNECTIONS)
+            # 下载文件；重试或重启后 aria2 已不认识原 GID 时续传已下载的部分
+            gid = download_file(
+                download_url, config, aria2server, resume=bool(job.get('attempts') or gid), out=out, connections=connections,
+                sha256=integrity['sha256'] if integrity else None
+            )
+            if gid is None:
+                retry_or_fail_job(client, userdata, job, download_url)
+                return
+            job_store.update(job_id, RUNNING, gid=gid)
+
+        def on_complete(status):
+            file_path = entry['file_path'] if entry else status_file_path(status)
+            # aria2 已按 checksum 校验过
+            complete_pull(
+                userdata, job, download_url, file_path, int(status.get('completedLength') or 0),
+                integrity['sha256'] if integrity else None
+            )
+
+        def on_error(status):
+            message = status_error_message(status)
+            logging.error(f"Failed to download file {download_url}. Error: {message}")
+            files = status.get('files') or []
+            if integrity and status.get('errorCode') == CHECKSUM_ERROR and files and files[0].get('path'):
+                # 下载完成但内容不一致，只补回出错的部分
+                finish_tuning(userdata, job)
+                file_path = entry['file_path'] if entry else status_file_path(status)
+                userdata['worker_pool'].submit(
+                    'pull', repair_download, client, userdata, job, download_url, integrity, files[0]['path'], file_path
+                )
+                return
+            retry_or_fail_job(client, userdata, job, download_url, message)
+
+        userdata['tracker'].track(gid, on_complete, on_error, check=resumed)
+
     except Exception as e:
         logging.error(f"Error processing message: {str(e)}")        
+        finish_tuning(userdata, job)
+        JOBS.inc('pull', 'failed')
+        job_store.update(job_id, FAILED, error=str(e))
 
 def message_processor(client, userdata, stop_event):
-    """Worker thread to process messages from the queue sequentially."""
+    """Dispatcher thread: hand queued jobs to the pull worker pool."""
     message_queue = userdata['message_queue']
-    config = userdata['config']
-    
+    job_store = userdata['job_store']
+    worker_pool = userdata['worker_pool']
+    admission = userdata['admission']
+
     while not stop_event.is_set():
+        # 积压减少后继续接收暂缓的消息
+        admission.resume()
         try:
-            # Get message from queue (block until a message is available or timeout)
-            msg, receive_time = message_queue.get(timeout=1.0)
-            logging.info("Dequeued message for processing")
-            process_message(client, config, msg, receive_time)
-            message_queue.task_done()
+            # Get job from queue (block until a job is available or timeout)
+            job = message_queue.get(timeout=1.0)
         except queue.Empty:
             continue
+        try:
+            logging.info(f"Processing job {job['id']}", extra={'job_id': job['id'], 'sample': True})
+            download_url = parse_download_url(job['payload'])
+            if download_url:
+                worker_pool.submit('pull', process_message, client, userdata, job, download_url, since=job['receive_time'])
+            else:
+                JOBS.inc('pull', 'invalid')
+                job_store.update(job['id'], FAILED, error="Invalid message")
         except Exception as e:
             logging.error(f"Error in message processor: {str(e)}")
+        finally:
+            message_queue.task_done()
+
+def remove_stale_file(config, file_path):
+    """删除同步目标路径上的旧文件及其 aria2 控制文件，避免续传到内容不同的文件上"""
+    full_path = os.path.join(config['ARIA2_DOWNLOAD_DIR'], file_path)
+    for path in (full_path, f"{full_path}.aria2"):
+        if os.path.isfile(path):
+            os.remove(path)
+
+def fetch_manifest(sync_url, since):
+    """获取 fetcher 清单中 since 之后变化的文件"""
+    separator = '&' if '?' in sync_url else '?'
+    with urllib.request.urlopen(f"{sync_url}{separator}since={since}", timeout=60) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+def needs_download(config, local_index, entry):
+    """本地文件缺失或与清单中的版本不同时返回 True"""
+    full_path = os.path.join(config['ARIA2_DOWNLOAD_DIR'], entry['path'])
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        return True
+    if stat.st_size != entry['size']:
+        return True
+    local = local_index.get(entry['path'])
+    if local is None or local['deleted'] or local['size'] != stat.st_size or local['mtime'] != stat.st_mtime:
+        # 未记录或记录后被改动过的文件，计算一次哈希
+        local_index.update(entry['path'])
+        local = local_index.get(entry['path'])
+    return local is None or local['sha256'] != entry['sha256']
+
+def sync_once(userdata, sync_url, full=False):
+    """
+    对比一个 fetcher 的清单与本地清单，把缺失或有变化的文件加入下载队列
+
+    增量同步只获取上次同步之后变化的文件；full 为 True 时获取完整清单，
+    可发现本地被删除的文件。返回加入队列的任务数。
+    """
+    config = userdata['config']
+    local_index = userdata['local_index']
+    job_store = userdata['job_store']
+    since = 0 if full else int(local_index.get_value(f"seq:{sync_url}", 0))
+    listing = fetch_manifest(sync_url, since)
+    if since and listing['id'] != local_index.get_value(f"id:{sync_url}"):
+        # fetcher 的清单被重建过，序号不再可比
+        since = 0
+        listing = fetch_manifest(sync_url, 0)
+
+    prefix = listing.get('download_prefix_url') or urljoin(sync_url, '/')
+    queued = 0
+    for entry in listing['files']:
+        if entry['deleted'] or not needs_download(config, local_index, entry):
+            continue
+        payload = json.dumps({
+            "download_url": f"{prefix}{quote(entry['path'])}",
+            "file_path": entry['path'],
+            "size": entry['size'],
+            "sha256": entry['sha256'],
+            "node": listing.get('node', ''),
+            "sync": sync_url,
+        }, ensure_ascii=False)
+        # 已在队列中或下载中的同一版本不再重复加入
+        if job_store.seen(payload, unfinished=True):
+            continue
+        receive_time = time.time()
+        job_id = job_store.add(payload, receive_time)
+        userdata['message_queue'].put({'id': job_id, 'payload': payload, 'receive_time': receive_time, 'gid': None})
+        queued += 1
+
+    # 任务已持久化，下次从这里继续
+    local_index.set_value(f"id:{sync_url}", listing['id'])
+    local_index.set_value(f"seq:{sync_url}", listing['seq'])
+    if listing['files'] or since == 0:
+        logging.info(
+            f"Synced with {sync_url} ({'full' if since == 0 else f'since {since}'}): "
+            f"{len(listing['files'])} files listed, queued {queued} downloads"
+        )
+    return queued
+
+def sync_loop(userdata, stop_event):
+    """同步线程：启动时完整同步，之后每 SYNC_INTERVAL 秒及每次重连 MQTT 后增量同步"""
+    config = userdata['config']
+    sync_event = userdata['sync_event']
+    sync_urls = [url.strip() for url in config['SYNC_URL'].split(',') if url.strip()]
+    # 完整同步成功前，每次都做完整同步
+    pending_full = set(sync_urls)
+    while not stop_event.is_set():
+        sync_event.clear()
+        for sync_url in sync_urls:
+            try:
+                sync_once(userdata, sync_url, full=sync_url in pending_full)
+                pending_full.discard(sync_url)
+            except Exception as e:
+                logging.error(f"Failed to sync with {sync_url}: {str(e)}")
+        sync_event.wait(config['SYNC_INTERVAL'] or None)
+
+def restore_jobs(job_store, message_queue):
+    """重新加入上次退出时未完成的任务"""
+    jobs = job_store.unfinished()
+    for row in jobs:
+        message_queue.put({
+            'id': row['id'],
+            'payload': row['payload'],
+            'receive_time': row['receive_time'],
+            'gid': row['gid'],
+        })
+    if jobs:
+        logging.info(f"Restored {len(jobs)} unfinished jobs from {job_store.path}")
 
 def on_log(client, userdata, paho_log_level, messages):
     if paho_log_level == mqtt.LogLevel.MQTT_LOG_ERR:
@@ -186,7 +523,10 @@ def main():
     #     os.makedirs(DOWNLOAD_DIR)    
 
     # 设置日志    
-    setup_logging(service_name)
+    setup_logging(service_name, config)
+
+    if QOS == 0:
+        logging.warning("QOS = 0: messages cannot be held back, so QUEUE_HIGH_WATER backpressure has no effect; use QOS = 1")
 
     # 这里添加你的 MQTT 客户端逻辑
     print("::Configuration loaded::")
@@ -204,6 +544,8 @@ def main():
     print(f"ARIA2 RPC Port: {ARIA2_RPC_PORT}")
     print(f"ARIA2 RPC Token: {ARIA2_RPC_TOKEN}")
     print(f"ARIA2 Download Dir: {ARIA2_DOWNLOAD_DIR}")
+    print(f"Pull Workers: {config['PULL_WORKERS']}")
+    print(f"Sync URL: {config['SYNC_URL']} (every {config['SYNC_INTERVAL']}s)")
     print()
 
     config['CLIENT_ID'] = CLIENT_ID
@@ -214,15 +556,75 @@ def main():
     message_queue = queue.Queue()
     stop_event = threading.Event()
 
+    # 持久化任务队列，恢复上次未完成的任务
+    job_store = JobStore(os.path.join(config['JOB_STORE_DIR'], f"{service_name}.db"))
+    job_store.prune(config['JOB_RETENTION'])
+
+    # 共享的 aria2 连接与完成通知
+    aria2server = create_aria2_server(config)
+    tracker = Aria2Tracker(aria2server)
+    tracker.start()
+
+    # 并发下载的工作线程池
+    worker_pool = WorkerPool({'pull': config['PULL_WORKERS']}, name=service_name)
+
+    # 等待重试的任务
+    retry_scheduler = RetryScheduler()
+    retry_scheduler.start()
+
     # Prepare userdata
     userdata = {
         'config': config,
-        'message_queue': message_queue
+        'message_queue': message_queue,
+        'job_store': job_store,
+        'aria2server': aria2server,
+        'tracker': tracker,
+        'worker_pool': worker_pool,
+        'retry_scheduler': retry_scheduler,
+        'admission': None,
+        'local_index': None,
+        'sync_event': None,
+        'tuner': None,
     }    
+    # 按主机学习连接数，并限制每个主机同时运行的任务数
+    if config['TUNING_ENABLE'] or config['HOST_MAX_JOBS']:
+        userdata['tuner'] = HostTuner(
+            os.path.join(config['JOB_STORE_DIR'], "puller_hosts.db"),
+            candidates=config['TUNING_CONNECTIONS'] if config['TUNING_ENABLE'] else (),
+            max_jobs=config['HOST_MAX_JOBS'],
+            explore=config['TUNING_EXPLORE'] / 100,
+        )
+    # Prometheus 指标
+    metrics_server = None
+    if config['METRICS_ENABLE']:
+        ACTIVE_WORKERS.set_function(lambda: {(ftype,): n for ftype, n in worker_pool.active().items()})
+        QUEUED_JOBS.set_function(lambda: {(ftype,): n for ftype, n in worker_pool.queued_per_type().items()})
+        ARIA2_DOWNLOADS.set_function(aria2_downloads(aria2server))
+        metrics_server = MetricsServer(host=config['METRICS_HOST'], port=config['METRICS_PORT'])
+        metrics_server.start()
+
+    restore_jobs(job_store, message_queue)
+
+    # 同步模式：按 fetcher 的清单补齐缺失或有变化的文件
+    sync_thread = None
+    if config['SYNC_URL']:
+        userdata['local_index'] = Manifest(
+            os.path.join(config['JOB_STORE_DIR'], f"{service_name}_manifest.db"), ARIA2_DOWNLOAD_DIR
+        )
+        userdata['sync_event'] = threading.Event()
+        sync_thread = threading.Thread(target=sync_loop, args=(userdata, stop_event), name="sync", daemon=True)
+        sync_thread.start()
 
     # 创建MQTT客户端
-    mqttc = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=CLIENT_ID, userdata=userdata)
+    protocol = mqtt.MQTTv5 if config['MQTT_VERSION'] == 5 else mqtt.MQTTv311
+    mqttc = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=CLIENT_ID, userdata=userdata, protocol=protocol)
     mqttc.reconnect_delay_set(min_delay=1, max_delay=120)
+    # 消息写入任务队列后才确认
+    mqttc.manual_ack_set(True)
+    connect_properties = None
+    if protocol == mqtt.MQTTv5:
+        connect_properties = Properties(PacketTypes.CONNECT)
+        connect_properties.ReceiveMaximum = config['RECEIVE_MAXIMUM']
 
     # 设置用户名和密码
     if USERNAME and PASSWORD:
@@ -231,7 +633,16 @@ def main():
 
     mqttc.on_log = on_log
     mqttc.on_connect = on_connect
-    mqttc.on_message = on_message    
+    # 积压达到上限时暂缓确认，由 broker 缓存多余的消息
+    admission = AdmissionControl(
+        mqttc,
+        accept=lambda msg: accept_message(userdata, msg),
+        backlog=lambda: message_queue.qsize() + worker_pool.queued(),
+        high_water=config['QUEUE_HIGH_WATER'],
+    )
+    userdata['admission'] = admission
+    mqttc.on_message = admission.on_message
+    mqttc.on_disconnect = admission.on_disconnect
 
     # Start message processor thread
     processor_thread = threading.Thread(
@@ -242,7 +653,7 @@ def main():
     processor_thread.start()    
 
     try:
-        mqttc.connect(BROKER, PORT, keepalive=KEEPALIVE)  # 增加 keepalive
+        mqttc.connect(BROKER, PORT, keepalive=KEEPALIVE, properties=connect_properties)  # 增加 keepalive
         logging.info(f"Connecting to MQTT broker: {BROKER}:{PORT}")
         mqttc.loop_start()  # 在后台线程运行 MQTT 循环
         while True:
@@ -258,6 +669,21 @@ def main():
         mqttc.loop_stop()  # Stop MQTT loop
         mqttc.disconnect()  # Disconnect MQTT client
         processor_thread.join()  # Wait for processor thread to finish
+        if sync_thread:
+            userdata['sync_event'].set()
+            sync_thread.join(timeout=5)
+            userdata['local_index'].close()
+        retry_scheduler.stop()
+        worker_pool.shutdown(wait=False)
+        tracker.stop()
+        if userdata['tuner']:
+            userdata['tuner'].close()
+        if metrics_server:
+            metrics_server.stop()
+        if ARIA2_RPC_ENABLE:
+            aria2server.close()  # 外部 aria2c 继续运行
+        else:
+            aria2server.stop()  # 停止本地 aria2c 子进程
         logging.info("MQTT client stopped.")
 
 if __name__ == "__main__":
@@ -0,0 +1,75 @@
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+
+def backoff_delay(attempt, base=5, cap=300):
+    """Exponential backoff with jitter: a random delay in [d/2, d], d = base * 2^attempt."""
+    delay = min(cap, base * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
+
+
+class RetryScheduler:
+    """
+    Run callbacks after a delay from a single timer thread.
+
+    Due times are kept in a heap, so a job waiting for its next attempt
+    holds no worker; the callback (usually a worker pool submit) runs when
+    it is due.
+    """
+
+    def __init__(self, name="retry"):
+        self.name = name
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        """Start the timer thread."""
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the timer thread, dropping callbacks that are not due yet."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def schedule(self, delay, fn, *args):
+        """Call fn(*args) after delay seconds."""
+        with self._condition:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), fn, args))
+            # Wake the timer thread in case this is now the earliest entry
+            self._condition.notify()
+
+    def pending(self):
+        """Number of callbacks waiting to run."""
+        with self._condition:
+            return len(self._heap)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    timeout = self._heap[0][0] - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._condition.wait(timeout)
+                if self._stopped:
+                    return
+                _, _, fn, args = heapq.heappop(self._heap)
+            try:
+                fn(*args)
+            except Exception as e:
+                logging.error(f"Error in scheduled retry: {str(e)}")
@@ -0,0 +1,199 @@
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import RPC_LATENCY
+
+
+class RPCError(Exception):
+    """Raised for aria2 JSON-RPC faults and transport errors."""
+
+
+class RPCFault(RPCError):
+    """Raised when aria2 answers a call with an error."""
+
+
+class Aria2RPC:
+    """
+    aria2 JSON-RPC client with one persistent keep-alive connection.
+
+    Calls from any thread are queued and a single sender thread coalesces
+    whatever is waiting into one ``system.multicall`` request. Liveness is
+    checked by a timer instead of before every call.
+    """
+
+    def __init__(self, host="http://localhost", port=6800, secret="", timeout=10,
+                 max_batch=100, batch_window=0.002, check_interval=10):
+        self.url = f"{host}:{port}/jsonrpc"
+        self.secret = secret
+        self.timeout = timeout
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.check_interval = check_interval
+        self.alive = False
+
+        self._session = requests.Session()
+        # Only the sender thread uses the session, so one connection is enough
+        self._session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self._session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self._ids = itertools.count(1)
+        self._calls = queue.Queue()
+        self._stop_event = threading.Event()
+        self._sender = threading.Thread(target=self._send_loop, name="aria2-rpc", daemon=True)
+        self._checker = threading.Thread(target=self._check_loop, name="aria2-rpc-check", daemon=True)
+        self._sender.start()
+        self._checker.start()
+
+    def close(self):
+        """Stop the background threads and close the connection."""
+        self._stop_event.set()
+        self._calls.put(None)
+        self._sender.join()
+        self._checker.join()
+        self._session.close()
+
+    def submit(self, method, params=None):
+        """Queue a call and return a Future with its result."""
+        future = Future()
+        if self._stop_event.is_set():
+            future.set_exception(RPCError("aria2 RPC client closed"))
+        else:
+            self._calls.put((method, list(params or []), future, time.perf_counter()))
+        return future
+
+    def call(self, method, params=None):
+        """Call a method and wait for its result."""
+        return self.submit(method, params).result(timeout=self.timeout * 2)
+
+    def multicall(self, calls):
+        """Run [(method, params), ...] and return the results in order."""
+        futures = [self.submit(method, params) for method, params in calls]
+        return [future.result(timeout=self.timeout * 2) for future in futures]
+
+    def check(self):
+        """Check whether aria2 answers, updating the alive flag."""
+        try:
+            self.call('aria2.getVersion')
+            self.alive = True
+        except (RPCError, TimeoutError):
+            self.alive = False
+        return self.alive
+
+    # aria2 methods used by the downloader
+    def add_uri(self, uris, options=None):
+        return self.call('aria2.addUri', [uris, options or {}])
+
+    def tell_status(self, gid, keys=None):
+        return self.call('aria2.tellStatus', [gid, keys] if keys else [gid])
+
+    def tell_active(self, keys=None):
+        return self.call('aria2.tellActive', [keys] if keys else [])
+
+    def remove(self, gid):
+        return self.call('aria2.remove', [gid])
+
+    def change_option(self, gid, options):
+        return self.call('aria2.changeOption', [gid, options])
+
+    def change_global_option(self, options):
+        return self.call('aria2.changeGlobalOption', [options])
+
+    def get_global_stat(self):
+        return self.call('aria2.getGlobalStat')
+
+    def _params(self, method, params):
+        if self.secret and method.startswith('aria2.'):
+            return [f"token:{self.secret}", *params]
+        return params
+
+    def post(self, method, params):
+        """Send one JSON-RPC request on the shared connection."""
+        payload = {
+            'jsonrpc': '2.0',
+            'id': next(self._ids),
+            'method': method,
+            'params': self._params(method, params),
+        }
+        try:
+            response = self._session.post(self.url, data=json.dumps(payload), timeout=self.timeout)
+            body = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise RPCError(f"aria2 RPC {method} failed: {str(e)}") from e
+        if 'error' in body:
+            raise RPCFault(f"aria2 RPC {method} error: {body['error'].get('message')}")
+        return body['result']
+
+    def _send_loop(self):
+        while not self._stop_event.is_set():
+            item = self._calls.get()
+            if item is None:
+                break
+            batch = [item]
+            # Give concurrent callers a moment to join the batch
+            try:
+                while len(batch) < self.max_batch:
+                    item = self._calls.get(timeout=self.batch_window) if len(batch) == 1 else self._calls.get_nowait()
+                    if item is None:
+                        self._stop_event.set()
+                        break
+                    batch.append(item)
+            except queue.Empty:
+                pass
+            self._send(batch)
+
+        # Fail whatever is still queued
+        while True:
+            try:
+                item = self._calls.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[2].set_exception(RPCError("aria2 RPC client closed"))
+
+    def _send(self, batch):
+        try:
+            self._send_batch(batch)
+        finally:
+            # Latency as seen by the caller, from submit() to the answer
+            now = time.perf_counter()
+            for method, _, _, submitted in batch:
+                RPC_LATENCY.observe(now - submitted, method)
+
+    def _send_batch(self, batch):
+        if len(batch) == 1:
+            method, params, future, _ = batch[0]
+            try:
+                future.set_result(self.post(method, params))
+            except RPCError as e:
+                future.set_exception(e)
+            return
+
+        calls = [{'methodName': method, 'params': self._params(method, params)} for method, params, _, _ in batch]
+        try:
+            results = self.post('system.multicall', [calls])
+        except RPCError as e:
+            for _, _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        for (method, _, future, _), result in zip(batch, results):
+            # Each result is [value] on success or a fault struct on failure
+            if isinstance(result, list):
+                future.set_result(result[0])
+            else:
+                future.set_exception(RPCFault(f"aria2 RPC {method} error: {result.get('message')}"))
+        logging.debug(f"Sent {len(batch)} aria2 calls in one multicall")
+
+    def _check_loop(self):
+        while not self._stop_event.is_set():
+            was_alive = self.alive
+            if self.check() != was_alive:
+                logging.info(f"aria2 RPC {self.url} is {'up' if self.alive else 'down'}")
+            self._stop_event.wait(self.check_interval)
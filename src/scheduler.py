@@ -0,0 +1,161 @@
+import logging
+import threading
+from collections import deque
+
+# 优先级名称，数值越大越优先
+PRIORITIES = {'high': 1, 'normal': 0, 'low': -1}
+DEFAULT_TENANT = 'default'
+
+
+def parse_priority(value):
+    """Priority of a request: 'high' / 'normal' / 'low' or an integer, higher runs first."""
+    if value is None:
+        return 0
+    if isinstance(value, str) and value.strip().lower() in PRIORITIES:
+        return PRIORITIES[value.strip().lower()]
+    try:
+        return max(-9, min(9, int(value)))
+    except (TypeError, ValueError):
+        logging.warning(f"Invalid priority: {value}, using normal")
+        return 0
+
+
+def priority_name(priority):
+    for name, value in PRIORITIES.items():
+        if value == priority:
+            return name
+    return str(priority)
+
+
+def parse_weights(value):
+    """Tenant weights from a dict or a 'alice=2,bob=0.5' string."""
+    if not value:
+        return {}
+    if isinstance(value, str):
+        value = dict(item.split('=', 1) for item in value.split(',') if '=' in item)
+    weights = {}
+    for tenant, weight in value.items():
+        try:
+            weight = float(weight)
+        except (TypeError, ValueError):
+            weight = 0
+        if weight <= 0:
+            logging.warning(f"Invalid weight for tenant {tenant}: {weight}, using 1")
+            weight = 1
+        weights[str(tenant).strip()] = weight
+    return weights
+
+
+class _Band:
+    """Tenant queues of one priority band, served by deficit round-robin."""
+
+    def __init__(self):
+        self.queues = {}
+        self.active = deque()
+        self.deficit = {}
+
+
+class FairQueue:
+    """
+    Multi-queue with strict priority bands and per-tenant fairness.
+
+    A higher band is always served first. Within a band each tenant has
+    its own FIFO and tenants take turns by deficit round-robin: every turn
+    a tenant earns its weight in credit and each job costs one, so a
+    tenant with weight 2 starts two jobs for every one of a tenant with
+    weight 1, however many jobs either has queued. Not thread-safe; the
+    owner holds its own lock.
+    """
+
+    def __init__(self, weights=None):
+        self.weights = weights or {}
+        self._bands = {}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def put(self, item, priority=0, tenant=DEFAULT_TENANT):
+        band = self._bands.get(priority)
+        if band is None:
+            band = self._bands[priority] = _Band()
+        queue = band.queues.get(tenant)
+        if queue is None:
+            queue = band.queues[tenant] = deque()
+            band.active.append(tenant)
+            band.deficit[tenant] = 0
+        queue.append(item)
+        self._size += 1
+
+    def pop(self):
+        """Remove and return the next item; raises IndexError when empty."""
+        if not self._size:
+            raise IndexError("pop from an empty FairQueue")
+        priority = max(self._bands)
+        band = self._bands[priority]
+        while True:
+            tenant = band.active[0]
+            if band.deficit[tenant] < 1:
+                # New turn: earn the quantum, or wait for the next round if it is still short
+                band.deficit[tenant] += self.weights.get(tenant, 1)
+                if band.deficit[tenant] < 1:
+                    band.active.rotate(-1)
+                    continue
+            queue = band.queues[tenant]
+            item = queue.popleft()
+            band.deficit[tenant] -= 1
+            if not queue:
+                # An idle tenant keeps no credit
+                del band.queues[tenant]
+                del band.deficit[tenant]
+                band.active.popleft()
+            elif band.deficit[tenant] < 1:
+                band.active.rotate(-1)
+            break
+        if not band.active:
+            del self._bands[priority]
+        self._size -= 1
+        return item
+
+
+class WaitStats:
+    """Queue wait times per class, over the last ``window`` jobs of each class."""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._samples = {}
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def record(self, cls, seconds):
+        with self._lock:
+            samples = self._samples.get(cls)
+            if samples is None:
+                samples = self._samples[cls] = deque(maxlen=self.window)
+                self._totals[cls] = [0, 0.0]
+            samples.append(seconds)
+            self._totals[cls][0] += 1
+            self._totals[cls][1] += seconds
+
+    def snapshot(self):
+        """{class: {count, sum, p50, p95, max}}; percentiles and max cover the window."""
+        with self._lock:
+            stats = {}
+            for cls, samples in self._samples.items():
+                ordered = sorted(samples)
+                count, total = self._totals[cls]
+                stats[cls] = {
+                    'count': count,
+                    'sum': total,
+                    'p50': ordered[len(ordered) // 2],
+                    'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                    'max': ordered[-1],
+                }
+            return stats
+
+    def log(self):
+        for cls, s in sorted(self.snapshot().items()):
+            logging.info(
+                f"Queue wait {cls}: {s['count']} jobs, mean {s['sum'] / s['count']:.1f}s, "
+                f"p50 {s['p50']:.1f}s, p95 {s['p95']:.1f}s, max {s['max']:.1f}s"
+            )
@@ -0,0 +1,148 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+"""
+On-disk cache of HLS segments shared by all m3u8 jobs.
+"""
+
+
+def segment_key(uri, byterange=None, key=None, iv=None):
+    """
+    Cache key of a segment: its URL and byte range, plus the key URI and IV
+    for encrypted segments (the cache holds decrypted data).
+    """
+    parts = [uri, f"{byterange[0]}-{byterange[1]}" if byterange else '']
+    if key:
+        parts += [key, iv or '']
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def copy_into(src, dst):
+    """
+    Append the file src to dst (both open binary files). os.copy_file_range
+    copies inside the kernel (sharing extents on filesystems that support
+    reflinks); other systems fall back to a buffered copy.
+    """
+    dst.flush()
+    position = dst.tell()
+    size = os.fstat(src.fileno()).st_size
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < size:
+                n = os.copy_file_range(src.fileno(), dst.fileno(), size - copied, copied, position + copied)
+                if n == 0:
+                    break
+                copied += n
+        except OSError:
+            copied = 0
+    if copied < size:
+        src.seek(copied)
+        dst.seek(position + copied)
+        shutil.copyfileobj(src, dst)
+    else:
+        dst.seek(position + copied)
+    return size
+
+
+class SegmentCache:
+    """
+    Segments in ``root`` named by segment_key(), with least recently used
+    eviction once they take more than ``max_bytes``.
+
+    The directory is the index: files are listed by modification time on
+    startup and a hit updates the time, so the LRU order survives
+    restarts. open() returns an open file, which stays readable even if
+    the segment is evicted before the caller copies it.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> size, least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        if not os.path.exists(root):
+            os.makedirs(root)
+        self._load()
+
+    def _load(self):
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    if filename.endswith('.tmp'):
+                        # Left over from an interrupted write
+                        os.remove(path)
+                        continue
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, filename, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._bytes += size
+        if entries:
+            logging.info(f"Segment cache {self.root}: {len(entries)} segments, {self._bytes} bytes")
+        self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def open(self, key):
+        """Open a cached segment for reading, or return None."""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        path = self._path(key)
+        try:
+            f = open(path, 'rb')
+            os.utime(path)
+            return f
+        except OSError:
+            with self._lock:
+                self._bytes -= self._entries.pop(key, 0)
+            return None
+
+    def put(self, key, data):
+        """Store a segment, evicting the least recently used ones beyond max_bytes."""
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"Failed to cache segment {key}: {str(e)}")
+            return
+        with self._lock:
+            self._bytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+        self._evict()
+
+    def _evict(self):
+        victims = []
+        with self._lock:
+            while self._bytes > self.max_bytes and self._entries:
+                key, size = self._entries.popitem(last=False)
+                self._bytes -= size
+                victims.append(key)
+        for key in victims:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def usage(self):
+        """(segments, bytes) in the cache."""
+        with self._lock:
+            return len(self._entries), self._bytes
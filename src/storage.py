@@ -0,0 +1,356 @@
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+"""
+
+# aria2 status keys needed to follow the size of a download
+SIZE_KEYS = ['status', 'totalLength', 'completedLength', 'followedBy']
+
+
+def content_length(url, timeout=10):
+    """Size announced by a HEAD request, or None if the server does not tell."""
+    try:
+        response = requests.head(url, allow_redirects=True, timeout=timeout)
+        if response.ok and response.headers.get('Content-Length'):
+            return int(response.headers['Content-Length'])
+    except (requests.RequestException, ValueError) as e:
+        logging.debug(f"HEAD {url} failed: {str(e)}")
+    return None
+
+
+def path_size(path):
+    """Size of a file, or of all files below a directory."""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+class StorageManager:
+    """
+    Disk quota of DOWNLOAD_DIR with least recently used eviction.
+
+    Finished artifacts are indexed with their size and last access (a
+    download from the file server or a cache hit). Usage is the indexed
+    artifacts plus what running jobs have written and are still expected
+    to write, against ``quota`` bytes, or the whole filesystem when quota
+    is 0. Once usage passes ``high`` percent, the least recently used
+    artifacts are deleted until it is back below ``low`` percent.
+
+    admit() reserves the expected size of a job before it starts, so a job
+    that does not fit is deferred instead of failing with a full disk. A
+    running aria2 download whose size only becomes known later (magnets,
+    servers without Content-Length) is paused while it does not fit and
+    resumed once space is freed. Access times are kept in memory and
+    written to ``db_path`` every ``interval`` seconds.
+    """
+
+    def __init__(self, download_dir, db_path, quota=0, high=90, low=80, aria2server=None, interval=30):
+        self.download_dir = download_dir
+        self.quota = quota
+        self.high = high
+        self.low = low
+        self.aria2server = aria2server
+        self.interval = interval
+        # Called with the file path before an evicted artifact is deleted
+        self.on_evict = []
+        self._artifacts = OrderedDict()  # path -> [size, last_access], least recently used first
+        self._bytes = 0
+        self._jobs = {}  # job id -> {'expected', 'written', 'gid', 'paused'}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._load()
+
+    def _load(self):
+        rows = self._conn.execute('SELECT path, size, last_access FROM artifacts ORDER BY last_access').fetchall()
+        gone = []
+        for path, size, last_access in rows:
+            if os.path.exists(os.path.join(self.download_dir, path)):
+                self._artifacts[path] = [size, last_access]
+                self._bytes += size
+            else:
+                gone.append((path,))
+        if gone:
+            self._conn.executemany('DELETE FROM artifacts WHERE path = ?', gone)
+
+    def __contains__(self, file_path):
+        with self._lock:
+            return file_path in self._artifacts
+
+    def start(self):
+        """Start the background eviction thread."""
+        self._thread = threading.Thread(target=self._run, name="storage", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._flush()
+        with self._db_lock:
+            self._conn.close()
+
+    def add(self, file_path, last_access=None):
+        """Index a finished artifact (a file or a directory relative to download_dir)."""
+        try:
+            size = path_size(os.path.join(self.download_dir, file_path))
+        except OSError as e:
+            logging.warning(f"Failed to index {file_path}: {str(e)}")
+            return
+        with self._lock:
+            entry = self._artifacts.pop(file_path, None)
+            if entry:
+                self._bytes -= entry[0]
+            self._artifacts[file_path] = [size, last_access or time.time()]
+            self._bytes += size
+            self._dirty.add(file_path)
+
+    def touch(self, file_path):
+        """Mark an artifact as used; file_path may point inside an indexed directory."""
+        key = file_path.replace(os.sep, '/').split('/')[0]
+        with self._lock:
+            entry = self._artifacts.get(file_path) or self._artifacts.get(key)
+            if entry is None:
+                return
+            key = file_path if file_path in self._artifacts else key
+            entry[1] = time.time()
+            self._artifacts.move_to_end(key)
+            self._dirty.add(key)
+
+    def usage(self):
+        """(capacity, used) in bytes, counting what running jobs are still expected to write."""
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if not job['paused']]
+            pending = sum(max(0, job['expected'] - job['written']) for job in jobs)
+            written = sum(job['written'] for job in self._jobs.values())
+            indexed = self._bytes
+        if self.quota:
+            return self.quota, indexed + written + pending
+        disk = shutil.disk_usage(self.download_dir)
+        return disk.total, disk.used + pending
+
+    def too_large(self, size):
+        """Whether size bytes cannot fit below the high watermark even with every artifact evicted."""
+        if not size:
+            return False
+        if self.quota:
+            return size > self.quota * self.high / 100
+        with self._lock:
+            ours = self._bytes + sum(job['written'] for job in self._jobs.values())
+        disk = shutil.disk_usage(self.download_dir)
+        # Files on the disk that are not ours are never evicted
+        return size > disk.total * self.high / 100 - max(0, disk.used - ours)
+
+    def _fits(self, size):
+        capacity, used = self.usage()
+        return used + size <= capacity * self.high / 100
+
+    def admit(self, job_id, size):
+        """
+        Reserve size bytes (None if unknown) for a starting job, evicting
+        artifacts if needed. Returns False if the job has to wait.
+        """
+        size = size or 0
+        if not self._fits(size):
+            capacity, used = self.usage()
+            with self._lock:
+                evictable = self._bytes
+            if used - evictable + size > capacity * self.high / 100:
+                # Not even evicting everything makes room before running jobs finish
+                return False
+            self.evict(size)
+            if not self._fits(size):
+                return False
+        with self._lock:
+            self._jobs[job_id] = {'expected': size, 'written': 0, 'gid': None, 'paused': False}
+        return True
+
+    def attach_aria2(self, job_id, gid):
+        """Follow the size of a running aria2 download, pausing it while it does not fit."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job['gid'] = gid
+
+    def report(self, job_id, written, expected=None):
+        """Record what a running job has written so far and, if known by now, its final size."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job['written'] = written
+            if expected:
+                job['expected'] = expected
+
+    def release(self, job_id):
+        """Drop the reservation of a finished, failed or retried job."""
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def evict(self, extra=0):
+        """
+        Delete least recently used artifacts until usage plus ``extra``
+        bytes is below the low watermark. Returns the bytes freed.
+        """
+        capacity, used = self.usage()
+        with self._lock:
+            evictable = self._bytes
+        target = capacity * self.low / 100
+        if used - evictable + extra > target:
+            # Running jobs alone keep usage above the low watermark, only make room for extra
+            target = capacity * self.high / 100
+        excess = used + extra - target
+        if excess <= 0:
+            return 0
+        victims = []
+        with self._lock:
+            while excess > 0 and self._artifacts:
+                path, (size, _) = self._artifacts.popitem(last=False)
+                self._bytes -= size
+                self._dirty.add(path)
+                victims.append((path, size))
+                excess -= size
+        freed = 0
+        for path, size in victims:
+            for callback in self.on_evict:
+                try:
+                    callback(path)
+                except Exception as e:
+                    logging.error(f"Error in eviction callback for {path}: {str(e)}")
+            full_path = os.path.join(self.download_dir, path)
+            try:
+                if os.path.isdir(full_path):
+                    shutil.rmtree(full_path)
+                else:
+                    os.remove(full_path)
+                freed += size
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.error(f"Failed to evict {path}: {str(e)}")
+        if victims:
+            logging.info(f"Evicted {len(victims)} artifacts ({freed} bytes), {capacity} bytes allowed")
+        return freed
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self._poll_aria2()
+                capacity, used = self.usage()
+                if used > capacity * self.high / 100:
+                    self.evict()
+                self._resume_paused()
+                self._flush()
+            except Exception as e:
+                logging.error(f"Error in storage manager: {str(e)}")
+
+    def _poll_aria2(self):
+        """Refresh the size of aria2 downloads and pause those that turn out not to fit."""
+        if self.aria2server is None:
+            return
+        with self._lock:
+            gids = {job_id: job['gid'] for job_id, job in self._jobs.items() if job['gid'] and not job['paused']}
+        if not gids:
+            return
+        rpc = self.aria2server.rpc()
+        futures = {job_id: rpc.submit('aria2.tellStatus', [gid, SIZE_KEYS]) for job_id, gid in gids.items()}
+        for job_id, future in futures.items():
+            try:
+                status = future.result(timeout=rpc.timeout * 2)
+            except Exception:
+                continue
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue
+                if status.get('followedBy'):
+                    # Magnet metadata is done, follow the real download
+                    job['gid'] = status['followedBy'][0]
+                    continue
+                known = job['expected']
+                total = int(status.get('totalLength') or 0)
+                job['written'] = int(status.get('completedLength') or 0)
+                job['expected'] = max(known, total)
+            if total > known and status.get('status') == 'active' and not self._fits(0):
+                self.evict()
+                if not self._fits(0):
+                    self._pause(job_id, total)
+
+    def _pause(self, job_id, size):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job['paused'] = True
+            gid = job['gid']
+        logging.warning(f"Pausing job {job_id}: {size} bytes do not fit below {self.high}% of the disk quota")
+        try:
+            self.aria2server.rpc().call('aria2.pause', [gid])
+        except Exception as e:
+            logging.error(f"Failed to pause aria2 download {gid}: {str(e)}")
+
+    def _resume_paused(self):
+        """Resume paused downloads, oldest first, while their remaining bytes fit."""
+        with self._lock:
+            paused = [(job_id, job['gid'], max(0, job['expected'] - job['written']))
+                      for job_id, job in self._jobs.items() if job['paused']]
+        for job_id, gid, remaining in paused:
+            if not self._fits(remaining):
+                break
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue
+                job['paused'] = False
+            logging.info(f"Resuming job {job_id}: disk space is available again")
+            try:
+                # Start over rather than fail on servers without Range support
+                self.aria2server.rpc().change_option(gid, {'always-resume': 'false'})
+                self.aria2server.rpc().call('aria2.unpause', [gid])
+            except Exception as e:
+                logging.error(f"Failed to resume aria2 download {gid}: {str(e)}")
+
+    def _flush(self):
+        """Write changed index entries to the database."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            rows = [(path, *self._artifacts[path]) for path in dirty if path in self._artifacts]
+            removed = [(path,) for path in dirty if path not in self._artifacts]
+        if not rows and not removed:
+            return
+        with self._db_lock:
+            self._conn.execute('BEGIN')
+            self._conn.executemany('INSERT OR REPLACE INTO artifacts (path, size, last_access) VALUES (?, ?, ?)', rows)
+            self._conn.executemany('DELETE FROM artifacts WHERE path = ?', removed)
+            self._conn.execute('COMMIT')
@@ -0,0 +1,137 @@
+import argparse
+import json
+import sys
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from config import load_config
+
+"""
+Submit download requests in bulk from a JSONL file.
+
+Each line is one request ({"url": ..., "name": ...}). Lines are grouped
+into JSONL payloads of --batch jobs and published with QoS 1; up to
+--inflight messages are awaiting their PUBACK at any time.
+"""
+
+
+def read_batches(f, batch_size):
+    """Yield (payload, job count) from a JSONL file, batch_size lines per payload."""
+    batch = []
+    for line_no, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            json.loads(line)
+        except json.JSONDecodeError as e:
+            print(f"Skipping invalid line {line_no}: {e}")
+            continue
+        batch.append(line)
+        if len(batch) >= batch_size:
+            yield '\n'.join(batch), len(batch)
+            batch = []
+    if batch:
+        yield '\n'.join(batch), len(batch)
+
+
+class Submitter:
+    """Pipelined QoS 1 publisher with a bounded number of unacknowledged messages."""
+
+    def __init__(self, client, topic, inflight=1000):
+        self.client = client
+        self.topic = topic
+        self.sent = 0
+        self.acked = 0
+        self._slots = threading.Semaphore(inflight)
+        self._connected = threading.Event()
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        client.max_inflight_messages_set(inflight)
+        client.on_connect = self._on_connect
+        client.on_publish = self._on_publish
+
+    def _on_connect(self, client, userdata, flags, rc, *args, **kwargs):
+        if rc == 0:
+            self._connected.set()
+        else:
+            print(f"Failed to connect to MQTT broker: {rc}")
+
+    def _on_publish(self, client, userdata, mid, *args, **kwargs):
+        self._slots.release()
+        with self._done:
+            self.acked += 1
+            self._done.notify_all()
+
+    def wait_connected(self, timeout):
+        return self._connected.wait(timeout)
+
+    def publish(self, payload):
+        # Blocks while the in-flight window is full
+        self._slots.acquire()
+        result = self.client.publish(self.topic, payload, qos=1)
+        if result.rc != mqtt.MQTT_ERR_SUCCESS:
+            self._slots.release()
+            raise RuntimeError(f"Failed to publish message: {result.rc}")
+        self.sent += 1
+
+    def wait_acked(self, timeout):
+        """Wait until every published message is acknowledged."""
+        deadline = time.time() + timeout
+        with self._done:
+            while self.acked < self.sent and time.time() < deadline:
+                self._done.wait(deadline - time.time())
+            return self.acked >= self.sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Submit download requests from a JSONL file')
+    parser.add_argument('file', help="JSONL file with one request per line ('-' for stdin)")
+    parser.add_argument('--batch', type=int, default=100, help='Requests per MQTT message')
+    parser.add_argument('--inflight', type=int, default=1000, help='Max unacknowledged messages')
+    args, rest = parser.parse_known_args()
+    # The remaining options (--broker, --topic-subscribe, ...) are the usual config
+    sys.argv = [sys.argv[0], *rest]
+    config = load_config()
+
+    suffix = time.strftime("_submit_%y%m%d%H%M%S", time.localtime())
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=config['CLIENT_ID'] + suffix)
+    if config.get('USERNAME') and config.get('PASSWORD'):
+        client.username_pw_set(config['USERNAME'], config['PASSWORD'])
+    submitter = Submitter(client, config['TOPIC_SUBSCRIBE'], inflight=max(args.inflight, 1))
+
+    client.connect(config['BROKER'], config['PORT'], keepalive=config['KEEPALIVE'])
+    client.loop_start()
+    try:
+        if not submitter.wait_connected(30):
+            print(f"Could not connect to MQTT broker {config['BROKER']}:{config['PORT']}")
+            return 1
+
+        f = sys.stdin if args.file == '-' else open(args.file, 'r', encoding='utf-8')
+        jobs = 0
+        start = last_report = time.time()
+        with f:
+            for payload, count in read_batches(f, max(args.batch, 1)):
+                submitter.publish(payload)
+                jobs += count
+                if time.time() - last_report >= 5:
+                    last_report = time.time()
+                    print(f"Submitted {jobs} requests ({jobs / (last_report - start):.0f} requests/s)")
+        acked = submitter.wait_acked(60)
+        elapsed = max(time.time() - start, 1e-6)
+
+        print(f"Submitted {jobs} requests in {submitter.sent} messages to {config['TOPIC_SUBSCRIBE']} in {elapsed:.2f}s")
+        print(f"Rate: {jobs / elapsed:.0f} requests/s, {submitter.sent / elapsed:.0f} messages/s")
+        if not acked:
+            print(f"Only {submitter.acked} of {submitter.sent} messages were acknowledged")
+            return 1
+        return 0
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from cache import normalize_url
+
+# Why a job was stopped
+TIMEOUT = 'timeout'
+STALLED = 'stalled'
+CANCELLED = 'cancelled'
+
+REASON_MESSAGES = {
+    TIMEOUT: "Job deadline exceeded",
+    STALLED: "Download stalled",
+    CANCELLED: "Cancelled",
+}
+
+
+class JobSupervisor:
+    """
+    Enforce per-job deadlines and a throughput floor, and cancel jobs on request.
+
+    A job is registered with begin() when it starts and given a way to be
+    stopped with attach(): a cancel callable (kill a subprocess, cancel an
+    HLS download) or an aria2 GID, which is removed through RPC. A job
+    stops once it runs longer than ``deadline`` seconds, or when it
+    transfers less than ``min_speed`` bytes/s for ``stall_time`` seconds.
+    Cancel requests for jobs that have not started yet are kept until
+    they do.
+    """
+
+    MAX_PENDING_CANCELS = 10000
+
+    def __init__(self, aria2server=None, deadline=0, min_speed=0, stall_time=300, interval=5):
+        self.aria2server = aria2server
+        self.deadline = deadline
+        self.min_speed = min_speed
+        self.stall_time = stall_time
+        self.interval = interval
+        self._jobs = {}
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the watchdog thread."""
+        self._thread = threading.Thread(target=self._run, name="supervisor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def begin(self, job, request):
+        """Register a starting job. Returns False if it was cancelled before it started."""
+        url = normalize_url(request['url'])
+        with self._lock:
+            if self._pending.pop(('id', job['id']), None) or self._pending.pop(('url', url), None):
+                return False
+            self._jobs[job['id']] = {
+                'url': url,
+                'started': time.time(),
+                'cancel': None,
+                'gid': None,
+                'size': None,
+                'sample': None,
+                'slow_since': None,
+                'reason': None,
+            }
+        return True
+
+    def attach(self, job_id, cancel=None, gid=None):
+        """Set how a running job is stopped: a cancel callable or its aria2 GID."""
+        with self._lock:
+            entry = self._jobs.get(job_id)
+            if entry is None:
+                return
+            entry['cancel'] = cancel or entry['cancel']
+            entry['gid'] = gid or entry['gid']
+            reason = entry['reason']
+        if reason:
+            # Stopped while it was still starting up
+            self._stop(job_id, entry)
+
+    def report(self, job_id, size):
+        """Record the bytes a job has transferred so far."""
+        with self._lock:
+            entry = self._jobs.get(job_id)
+            if entry is not None:
+                entry['size'] = size
+
+    def finish(self, job_id):
+        """Unregister a job, returning why it was stopped (or None)."""
+        with self._lock:
+            entry = self._jobs.pop(job_id, None)
+        return entry['reason'] if entry else None
+
+    def cancel(self, job_id=None, url=None):
+        """
+        Cancel running jobs by id or URL and return how many were stopped.
+        Jobs that are not running yet are cancelled when they start.
+        """
+        url = normalize_url(url) if url else None
+        with self._lock:
+            matched = [
+                (key, entry) for key, entry in self._jobs.items()
+                if (job_id is not None and key == job_id) or (url and entry['url'] == url)
+            ]
+            if not matched:
+                self._pending[('id', job_id) if job_id is not None else ('url', url)] = True
+                while len(self._pending) > self.MAX_PENDING_CANCELS:
+                    self._pending.popitem(last=False)
+        for key, entry in matched:
+            self._kill(key, entry, CANCELLED)
+        return len(matched)
+
+    def _kill(self, job_id, entry, reason):
+        with self._lock:
+            if entry['reason']:
+                return
+            entry['reason'] = reason
+        logging.warning(f"Stopping job {job_id}: {REASON_MESSAGES[reason]}")
+        self._stop(job_id, entry)
+
+    def _stop(self, job_id, entry):
+        try:
+            if entry['cancel']:
+                entry['cancel']()
+            elif entry['gid'] and self.aria2server is not None:
+                self.aria2server.rpc().remove(entry['gid'])
+        except Exception as e:
+            logging.error(f"Failed to stop job {job_id}: {str(e)}")
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self._poll_aria2()
+                self._check()
+            except Exception as e:
+                logging.error(f"Error in job supervisor: {str(e)}")
+
+    def _poll_aria2(self):
+        """
+        Follow magnet jobs to their torrent download and, with a speed
+        floor, refresh the transferred bytes of aria2 jobs, all in one
+        multicall.
+        """
+        if self.aria2server is None:
+            return
+        with self._lock:
+            gids = {job_id: entry['gid'] for job_id, entry in self._jobs.items() if entry['gid']}
+        if not gids:
+            return
+        rpc = self.aria2server.rpc()
+        futures = {
+            job_id: rpc.submit('aria2.tellStatus', [gid, ['status', 'completedLength', 'followedBy']])
+            for job_id, gid in gids.items()
+        }
+        for job_id, future in futures.items():
+            try:
+                status = future.result(timeout=rpc.timeout * 2)
+            except Exception:
+                continue
+            with self._lock:
+                entry = self._jobs.get(job_id)
+                if entry is None:
+                    continue
+                if status.get('followedBy'):
+                    # Magnet metadata is done, follow the real download
+                    entry['gid'] = status['followedBy'][0]
+                    entry['sample'] = None
+                elif status.get('status') in ('waiting', 'paused'):
+                    # Queued in aria2, not stalled
+                    entry['sample'] = None
+                    entry['slow_since'] = None
+                elif self.min_speed:
+                    entry['size'] = int(status.get('completedLength', 0))
+
+    def _check(self):
+        now = time.time()
+        expired = []
+        with self._lock:
+            for job_id, entry in self._jobs.items():
+                if entry['reason']:
+                    continue
+                if self.deadline and now - entry['started'] > self.deadline:
+                    expired.append((job_id, entry, TIMEOUT))
+                    continue
+                if not self.min_speed or entry['size'] is None:
+                    continue
+                sample, entry['sample'] = entry['sample'], (now, entry['size'])
+                if sample is None or now <= sample[0]:
+                    continue
+                if (entry['size'] - sample[1]) / (now - sample[0]) >= self.min_speed:
+                    entry['slow_since'] = None
+                    continue
+                entry['slow_since'] = entry['slow_since'] or sample[0]
+                if now - entry['slow_since'] >= self.stall_time:
+                    expired.append((job_id, entry, STALLED))
+        for job_id, entry, reason in expired:
+            self._kill(job_id, entry, reason)
@@ -0,0 +1,191 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from rpc import RPCFault
+
+# aria2 status keys needed to resolve a finished download
+STATUS_KEYS = ['gid', 'status', 'dir', 'files', 'completedLength', 'followedBy', 'errorCode', 'errorMessage']
+
+
+class Aria2Tracker:
+    """
+    Track aria2 downloads by GID through WebSocket notifications.
+
+    A single listener thread receives ``onDownloadComplete``,
+    ``onBtDownloadComplete``, ``onDownloadError`` and ``onDownloadStop``
+    events for every download, so in-flight jobs cost neither a worker
+    thread nor polling. Callbacks run on the listener thread and receive
+    the aria2 status dict of the finished download.
+    """
+
+    # Notifications that arrive before track() is called are kept briefly
+    MAX_EARLY_EVENTS = 10000
+
+    def __init__(self, aria2server, reconnect_delay=5):
+        self.aria2server = aria2server
+        self.reconnect_delay = reconnect_delay
+        self._callbacks = {}
+        self._early = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the notification listener thread."""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._listen, name="aria2-tracker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the notification listener thread."""
+        self._stop_event.set()
+        self.aria2server.client().stop_listening()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def track(self, gid, on_complete, on_error, check=False):
+        """
+        Call on_complete(status) or on_error(status) when gid finishes.
+
+        With ``check``, for a download added before a restart, its status
+        is asked right away: it may have finished while nobody listened.
+        """
+        with self._lock:
+            early = self._early.pop(gid, None)
+            self._callbacks[gid] = (on_complete, on_error)
+        if early is not None:
+            # The download already finished before it was tracked
+            self._dispatch(gid, early)
+        elif check:
+            self._check(gid)
+
+    def _check(self, gid):
+        try:
+            status = self.aria2server.rpc().tell_status(gid, ['status']).get('status')
+        except RPCFault:
+            # Unknown GID, e.g. aria2 was restarted
+            status = 'error'
+        except Exception as e:
+            # The listener reconciles once aria2 is reachable again
+            logging.error(f"Failed to get status of aria2 download {gid}: {str(e)}")
+            return
+        if status == 'complete':
+            self._dispatch(gid, 'complete')
+        elif status in ('error', 'removed'):
+            self._dispatch(gid, 'error')
+
+    def pending(self):
+        """Number of tracked downloads that have not finished yet."""
+        with self._lock:
+            return len(self._callbacks)
+
+    def _listen(self):
+        """Listen for notifications, reconnecting until stopped."""
+        client = self.aria2server.client()
+        while not self._stop_event.is_set():
+            try:
+                client.listen_to_notifications(
+                    on_download_complete=self._on_complete,
+                    on_bt_download_complete=self._on_complete,
+                    on_download_error=self._on_error,
+                    on_download_stop=self._on_error,
+                    timeout=1,
+                    handle_signals=False,
+                )
+            except Exception as e:
+                logging.error(f"aria2 notification listener error: {str(e)}")
+            if self._stop_event.is_set():
+                break
+            # Connection lost: events may have been missed meanwhile
+            self._stop_event.wait(self.reconnect_delay)
+            self._reconcile()
+
+    def _on_complete(self, gid):
+        self._handle(gid, 'complete')
+
+    def _on_error(self, gid):
+        self._handle(gid, 'error')
+
+    def _handle(self, gid, event):
+        with self._lock:
+            if gid not in self._callbacks:
+                self._early[gid] = event
+                while len(self._early) > self.MAX_EARLY_EVENTS:
+                    self._early.popitem(last=False)
+                return
+        self._dispatch(gid, event)
+
+    def _dispatch(self, gid, event):
+        """Resolve a finished gid and invoke its callbacks."""
+        with self._lock:
+            callbacks = self._callbacks.pop(gid, None)
+        if callbacks is None:
+            return
+        on_complete, on_error = callbacks
+
+        try:
+            status = self.aria2server.rpc().tell_status(gid, STATUS_KEYS)
+        except Exception as e:
+            logging.error(f"Failed to get status of aria2 download {gid}: {str(e)}")
+            status = {'gid': gid, 'status': event, 'errorMessage': str(e)}
+
+        if event == 'complete' and status.get('followedBy'):
+            # Magnet metadata finished; the real download continues under new GIDs
+            for next_gid in status['followedBy']:
+                logging.info(f"aria2 download {gid} followed by {next_gid}")
+                self.track(next_gid, on_complete, on_error)
+            return
+
+        try:
+            if event == 'complete':
+                on_complete(status)
+            else:
+                on_error(status)
+        except Exception as e:
+            logging.error(f"Error in aria2 {event} callback for {gid}: {str(e)}")
+
+    def _reconcile(self):
+        """Re-check tracked downloads after the WebSocket reconnects."""
+        with self._lock:
+            gids = list(self._callbacks)
+        if not gids:
+            return
+        rpc = self.aria2server.rpc()
+        # Submitted together, these go out as one multicall
+        futures = [rpc.submit('aria2.tellStatus', [gid, ['status']]) for gid in gids]
+        for gid, future in zip(gids, futures):
+            try:
+                status = future.result(timeout=rpc.timeout * 2).get('status')
+            except RPCFault:
+                # Unknown GID, e.g. aria2 was restarted
+                status = 'error'
+            except Exception:
+                # aria2 unreachable, try again on the next reconnect
+                continue
+            if status == 'complete':
+                self._dispatch(gid, 'complete')
+            elif status in ('error', 'removed'):
+                self._dispatch(gid, 'error')
+
+def status_file_path(status):
+    """Path of a finished aria2 download, relative to its download dir."""
+    files = status.get('files') or []
+    if not files or not files[0].get('path'):
+        return None
+    path = files[0]['path']
+    rel_path = os.path.relpath(path, status['dir']) if status.get('dir') else os.path.basename(path)
+    # Multi-file torrents: report the top-level directory
+    return rel_path.split(os.sep)[0]
+
+
+def status_error_message(status):
+    """Human readable error for a failed aria2 download."""
+    message = status.get('errorMessage') or f"aria2 download {status.get('status', 'failed')}"
+    if status.get('errorCode'):
+        message = f"{message} (code {status['errorCode']})"
+    return message
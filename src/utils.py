@@ -33,3 +33,13 @@ def is_valid_magnet_url(url):
 def get_file_suffix(url):
     """Get file suffix from URL."""
     return os.path.splitext(url)[-1]
+
+def get_file_type(url):
+    """Classify URL as m3u8, magnet or http, or None if unsupported."""
+    if is_valid_m3u8_url(url):
+        return "m3u8"
+    if is_valid_magnet_url(url):
+        return "magnet"
+    if extract_url_from_text(url):
+        return "http"
+    return None
@@ -0,0 +1,86 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import QUEUE_WAIT
+from scheduler import DEFAULT_TENANT, FairQueue, WaitStats, priority_name
+
+
+class WorkerPool:
+    """
+    Per-type bounded worker pools.
+
+    Each job type (m3u8 / http / magnet) gets its own executor, so a slow
+    HLS job never holds up the aria2 jobs queued behind it. Jobs wait in a
+    FairQueue per type and are handed to the executor only when a worker
+    is free, so the next job to start is picked by priority and tenant,
+    not by arrival order.
+    """
+
+    def __init__(self, limits: dict, name="worker", weights=None):
+        self.limits = dict(limits)
+        self._executors = {
+            ftype: ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"{name}-{ftype}")
+            for ftype, size in self.limits.items()
+        }
+        self._queues = {ftype: FairQueue(weights) for ftype in self.limits}
+        self._active = {ftype: 0 for ftype in self.limits}
+        self._closed = False
+        self._lock = threading.Lock()
+        self.wait_stats = WaitStats()
+
+    def submit(self, ftype, fn, *args, priority=0, tenant=DEFAULT_TENANT, since=None):
+        """
+        Queue fn(*args) on the pool for ftype. ``since`` is when the job
+        was received; its queue wait is recorded when it starts.
+        """
+        if ftype not in self._executors:
+            raise ValueError(f"No worker pool for type: {ftype}")
+        with self._lock:
+            self._queues[ftype].put((fn, args, priority, since), priority, tenant)
+            self._fill(ftype)
+
+    def _fill(self, ftype):
+        # 有空闲线程时按优先级和租户取出下一个任务，需持有锁
+        queue = self._queues[ftype]
+        while queue and not self._closed and self._active[ftype] < self.limits[ftype]:
+            fn, args, priority, since = queue.pop()
+            self._active[ftype] += 1
+            self._executors[ftype].submit(self._run, ftype, fn, args, priority, since)
+
+    def _run(self, ftype, fn, args, priority, since):
+        if since is not None:
+            wait = max(0.0, time.time() - since)
+            self.wait_stats.record(f"{ftype}/{priority_name(priority)}", wait)
+            QUEUE_WAIT.observe(wait, ftype, priority_name(priority))
+        try:
+            return fn(*args)
+        except Exception as e:
+            logging.error(f"Error in {ftype} worker: {str(e)}")
+        finally:
+            with self._lock:
+                self._active[ftype] -= 1
+                self._fill(ftype)
+
+    def active(self):
+        """Number of running jobs per type."""
+        with self._lock:
+            return dict(self._active)
+
+    def queued(self):
+        """Number of submitted jobs that have not started yet, over all types."""
+        with self._lock:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def queued_per_type(self):
+        """Number of jobs waiting for a worker per type."""
+        with self._lock:
+            return {ftype: len(queue) for ftype, queue in self._queues.items()}
+
+    def shutdown(self, wait=True):
+        """Stop all pools, dropping jobs that have not started yet."""
+        with self._lock:
+            self._closed = True
+        for executor in self._executors.values():
+            executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+from admission import AdmissionControl
+
+
+class FakeClient:
+    def __init__(self):
+        self.acked = []
+
+    def ack(self, mid, qos):
+        self.acked.append(mid)
+
+
+def message(mid):
+    return SimpleNamespace(mid=mid, qos=1, payload=str(mid).encode())
+
+
+def test_held_messages_are_dropped_on_disconnect_and_redelivered_once():
+    client = FakeClient()
+    accepted = []
+    backlog = [1]
+    admission = AdmissionControl(client, lambda msg: accepted.append(msg.mid), lambda: backlog[0], high_water=1)
+
+    # Backlog is full: both are held without an ack
+    admission.on_message(client, None, message(1))
+    admission.on_message(client, None, message(2))
+    assert admission.held() == 2 and accepted == []
+
+    # The connection drops and the broker redelivers them on the new one
+    admission.on_disconnect()
+    assert admission.held() == 0
+    backlog[0] = 0
+    admission.on_message(client, None, message(1))
+    admission.on_message(client, None, message(2))
+    admission.resume()
+
+    assert accepted == [1, 2]
+    assert client.acked == [1, 2]
+
+
+def test_held_messages_are_admitted_as_the_backlog_drains():
+    client = FakeClient()
+    accepted = []
+    backlog = [1]
+    admission = AdmissionControl(client, lambda msg: accepted.append(msg.mid), lambda: backlog[0], high_water=1)
+
+    admission.on_message(client, None, message(1))
+    backlog[0] = 0
+    admission.resume()
+
+    assert accepted == [1]
+    assert client.acked == [1]
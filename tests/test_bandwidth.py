@@ -0,0 +1,113 @@
+from concurrent.futures import Future
+
+import pytest
+
+from bandwidth import IDLE_BUDGET, BandwidthManager
+
+
+class FakeRPC:
+    timeout = 1
+
+    def __init__(self):
+        self.manager = None
+        self.calls = []
+        self.followed_by = {}
+
+    def submit(self, method, params=None):
+        # The manager's lock is never held across an RPC
+        assert not self.manager._lock.locked()
+        future = Future()
+        if method == 'aria2.tellStatus':
+            gid = params[0]
+            future.set_result({'followedBy': self.followed_by[gid]} if gid in self.followed_by else {})
+            return future
+        self.calls.append((method, params))
+        future.set_result('OK')
+        return future
+
+    def change_global_option(self, options):
+        return self.submit('aria2.changeGlobalOption', [options]).result()
+
+
+class FakeAria2:
+    def __init__(self):
+        self._rpc = FakeRPC()
+
+    def rpc(self):
+        return self._rpc
+
+
+@pytest.fixture
+def aria2server():
+    return FakeAria2()
+
+
+def make_manager(aria2server, **kwargs):
+    manager = BandwidthManager(aria2server, **kwargs)
+    aria2server._rpc.manager = manager
+    return manager
+
+
+def global_limits(aria2server):
+    return [
+        int(params[0]['max-overall-download-limit'])
+        for method, params in aria2server._rpc.calls if method == 'aria2.changeGlobalOption'
+    ]
+
+
+def test_global_limit_untouched_without_budget(aria2server):
+    manager = make_manager(aria2server)
+    manager._apply()
+    manager.attach_aria2(1, 'gid1')
+    assert aria2server._rpc.calls == []
+
+    manager.set_budget(limit=1000000)
+    manager.set_budget(limit=0)
+    assert global_limits(aria2server) == [1000000 - IDLE_BUDGET, 0]
+
+
+def test_budget_is_never_exceeded(aria2server):
+    manager = make_manager(aria2server, limit=1000000)
+    # Nothing running: aria2 keeps the budget, HLS only the floor
+    assert sum(manager.budgets()) == 1000000
+    manager._apply()
+
+    # The first HLS job takes the budget over right away, not on the next tick
+    manager.attach_hls(1)
+    assert manager.hls_bucket.rate == 1000000 - IDLE_BUDGET
+    assert global_limits(aria2server)[-1] == IDLE_BUDGET
+
+    manager.attach_aria2(2, 'gid2')
+    assert global_limits(aria2server)[-1] + manager.hls_bucket.rate == 1000000
+
+    manager.finish(1)
+    assert manager.hls_bucket.rate == IDLE_BUDGET
+    assert global_limits(aria2server)[-1] == 1000000 - IDLE_BUDGET
+
+
+def test_job_limits_are_sent_outside_the_lock(aria2server):
+    manager = make_manager(aria2server)
+    manager.attach_aria2(1, 'gid1')
+    manager.attach_aria2(2, 'gid2')
+    manager.attach_hls(3)
+
+    assert manager.set_job_limit(1, 5000)
+    manager.set_budget(job_limit=2000)
+    assert aria2server._rpc.calls == [
+        ('aria2.changeOption', ['gid1', {'max-download-limit': '5000'}]),
+        # The job with a limit of its own keeps it
+        ('aria2.changeOption', ['gid2', {'max-download-limit': '2000'}]),
+    ]
+
+
+def test_job_limit_of_magnet_applies_to_the_torrent(aria2server):
+    manager = make_manager(aria2server)
+    manager.attach_aria2(1, 'metadata')
+    aria2server._rpc.followed_by['metadata'] = ['torrent']
+
+    manager.set_job_limit(1, 5000)
+    manager.set_job_limit(1, 6000)
+    assert aria2server._rpc.calls == [
+        ('aria2.changeOption', ['torrent', {'max-download-limit': '5000'}]),
+        ('aria2.changeOption', ['torrent', {'max-download-limit': '6000'}]),
+    ]
@@ -0,0 +1,79 @@
+import json
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+import pytest
+
+import fetcher
+import puller
+from mqtt_broker import Broker
+
+
+def node_config(node_id, group='workers'):
+    return {
+        'NODE_ID': node_id, 'CLUSTER_GROUP': group, 'TOPIC_SUBSCRIBE': 'requests', 'QOS': 1,
+        'TOPIC_CANCEL': 'cancel', 'TOPIC_BANDWIDTH': '',
+    }
+
+
+@pytest.fixture
+def broker():
+    broker = Broker(port=0).start()
+    yield broker
+    broker.stop()
+
+
+def test_request_topic():
+    assert fetcher.request_topic(node_config('a')) == '$share/workers/requests'
+    assert fetcher.request_topic(node_config('a', group='')) == 'requests'
+
+
+def test_each_request_goes_to_one_node(broker):
+    received = {'a': [], 'b': []}
+    cancels = {'a': [], 'b': []}
+    nodes = []
+    for node_id in received:
+        def on_message(client, userdata, msg, node_id=node_id):
+            (cancels if msg.topic == 'cancel' else received)[node_id].append(msg.payload)
+
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, protocol=mqtt.MQTTv5,
+                             userdata={'config': node_config(node_id)})
+        client.on_connect = fetcher.on_connect
+        client.on_message = on_message
+        client.connect('127.0.0.1', broker.port)
+        client.loop_start()
+        nodes.append(client)
+
+    publisher = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, protocol=mqtt.MQTTv5)
+    publisher.connect('127.0.0.1', broker.port)
+    publisher.loop_start()
+    try:
+        deadline = time.time() + 10
+        while sum(len(m) for m in broker.shared.values()) < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        for i in range(10):
+            publisher.publish('requests', json.dumps({'url': f"http://example.com/{i}"}), qos=1)
+        publisher.publish('cancel', json.dumps({'id': 1, 'node': 'a'}), qos=1)
+
+        deadline = time.time() + 10
+        while (sum(map(len, received.values())) < 10 or sum(map(len, cancels.values())) < 2) and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        for client in nodes + [publisher]:
+            client.loop_stop()
+            client.disconnect()
+
+    # Requests are split across the group, cancel requests reach every node
+    assert sorted(received['a'] + received['b']) == sorted(
+        json.dumps({'url': f"http://example.com/{i}"}).encode() for i in range(10)
+    )
+    assert received['a'] and received['b']
+    assert len(cancels['a']) == len(cancels['b']) == 1
+
+
+def test_puller_downloads_from_the_publishing_node():
+    payload = json.dumps({'node': 'b', 'download_prefix_url': 'http://node-b:8080/', 'file_path': 'v/a.ts'})
+    assert puller.parse_download_url(payload) == 'http://node-b:8080/v/a.ts'
+    payload = json.dumps({'download_url': 'http://cdn/a.ts', 'download_prefix_url': 'http://node-b:8080/', 'file_path': 'a.ts'})
+    assert puller.parse_download_url(payload) == 'http://cdn/a.ts'
@@ -0,0 +1,30 @@
+import sys
+
+import pytest
+
+from config import load_config
+
+
+@pytest.fixture(autouse=True)
+def no_config(tmp_path, monkeypatch):
+    # No config.toml, no command line, no MQTT settings from the environment
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, 'argv', ['fetcher'])
+    for key in ('MQTT_VERSION', 'QOS'):
+        monkeypatch.delenv(key, raising=False)
+
+
+def test_mqtt_311_by_default():
+    config = load_config()
+    assert config['MQTT_VERSION'] == 3
+    assert config['QOS'] == 0
+
+
+def test_mqtt_5_is_opt_in(monkeypatch):
+    monkeypatch.setenv('MQTT_VERSION', '5')
+    assert load_config()['MQTT_VERSION'] == 5
+
+
+def test_invalid_mqtt_version_falls_back_to_311(tmp_path):
+    (tmp_path / 'config.toml').write_text('[mqtt]\nMQTT_VERSION = 4\n')
+    assert load_config()['MQTT_VERSION'] == 3
@@ -0,0 +1,201 @@
+import json
+import queue
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import fetcher
+from aria2s import Aria2cServer
+from cache import ArtifactCache
+from fake_aria2 import make_server
+from jobstore import JobStore, FAILED, QUEUED
+from supervisor import CANCELLED, JobSupervisor
+
+
+class FakeClient:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload, qos=0):
+        self.published.append(json.loads(payload))
+        return SimpleNamespace(rc=0)
+
+
+class FakeWorkerPool:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, file_type, fn, client, userdata, job, request, **kwargs):
+        self.submitted.append(job['id'])
+
+
+class InlinePipeline:
+    """Runs post-processing in the calling thread."""
+
+    def __init__(self):
+        self.postprocessed = []
+
+    def submit(self, fn, args, on_done, on_error):
+        self.postprocessed.append(args)
+        try:
+            result = fn(*args)
+        except Exception as e:
+            on_error(e)
+            return
+        on_done(result)
+
+    def publish(self, fn, *args):
+        fn(*args)
+
+
+class FakeTracker:
+    def __init__(self):
+        self.tracked = []
+
+    def track(self, gid, on_complete, on_error, check=False):
+        self.tracked.append(gid)
+
+
+@pytest.fixture
+def userdata(tmp_path):
+    return {
+        'config': {
+            'NODE_ID': 'test', 'TOPIC_PUBLISH': 'status', 'QOS': 1, 'DOWNLOAD_DIR': str(tmp_path),
+            'DOWNLOAD_PREFIX_URL': 'http://files/', 'HLS_BACKEND': 'native',
+        },
+        'job_store': JobStore(str(tmp_path / 'jobs.db')),
+        'cache': ArtifactCache(str(tmp_path)),
+        'supervisor': JobSupervisor(),
+        'worker_pool': FakeWorkerPool(),
+        'progress': None,
+        'bandwidth': None,
+        'storage': None,
+        'file_server': None,
+        'manifest': None,
+        'pipeline': InlinePipeline(),
+        'tracker': FakeTracker(),
+        'tuner': None,
+    }
+
+
+def dispatch(client, userdata, url):
+    payload = json.dumps({'url': url})
+    job = {'id': userdata['job_store'].add(payload, time.time()), 'payload': payload, 'receive_time': time.time()}
+    request = fetcher.parse_message(payload)
+    fetcher.dispatch_job(client, userdata, job, request)
+    return job, request
+
+
+def test_cancelled_leader_hands_download_to_waiter(userdata):
+    client = FakeClient()
+    leader = dispatch(client, userdata, 'http://example.com/a.bin')
+    first = dispatch(client, userdata, 'http://example.com/a.bin')
+    second = dispatch(client, userdata, 'http://example.com/a.bin')
+    assert userdata['worker_pool'].submitted == [leader[0]['id']]
+
+    fetcher.fail_job(client, userdata, *leader, "Cancelled", CANCELLED)
+    # Only the cancelled job fails, the first waiter runs the download
+    assert len(client.published) == 1
+    assert userdata['job_store'].get(leader[0]['id'])['state'] == FAILED
+    assert userdata['job_store'].get(first[0]['id'])['state'] == QUEUED
+    assert userdata['worker_pool'].submitted == [leader[0]['id'], first[0]['id']]
+
+    # A real failure of the new leader fails the request still waiting on it
+    fetcher.fail_job(client, userdata, *first)
+    assert len(client.published) == 3
+    assert userdata['job_store'].get(second[0]['id'])['state'] == FAILED
+    assert userdata['cache'].stats()['inflight'] == 0
+
+
+def test_http_ts_download_is_not_remuxed(userdata, tmp_path):
+    client = FakeClient()
+    (tmp_path / 'app.ts').write_bytes(b'export const x = 1;\n')
+    job, request = dispatch(client, userdata, 'http://example.com/app.ts')
+
+    fetcher.finish_download(client, userdata, job, request, 'app.ts')
+    assert userdata['pipeline'].postprocessed == [(str(tmp_path / 'app.ts'), False, None, None)]
+    assert (tmp_path / 'app.ts').read_bytes() == b'export const x = 1;\n'
+    assert client.published[-1]['file_path'] == 'app.ts'
+
+
+def test_restored_job_continues_partial_download(userdata):
+    server, fake = make_server(secret='test')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    aria2server = Aria2cServer(host='http://127.0.0.1', port=server.server_address[1], secret='test')
+    userdata['aria2server'] = aria2server
+    try:
+        payload = json.dumps({'url': 'http://example.com/a.bin'})
+        # Running before a restart, with a GID the new aria2 does not know
+        job = {'id': 1, 'payload': payload, 'receive_time': time.time(), 'gid': '00000000000000ff'}
+        fetcher.process_message(FakeClient(), userdata, job, fetcher.parse_message(payload))
+
+        [gid] = userdata['tracker'].tracked
+        assert gid != '00000000000000ff'
+        assert fake.downloads[gid]['options']['continue'] == 'true'
+    finally:
+        aria2server.close()
+        server.shutdown()
+
+
+def test_parse_cancel():
+    assert fetcher.parse_cancel('{"id": "7", "node": "a"}') == (7, None, 'a')
+    assert fetcher.parse_cancel('{"url": "http://example.com/a.bin"}') == (None, 'http://example.com/a.bin', None)
+    assert fetcher.parse_cancel('stop http://example.com/a.bin') == (None, 'http://example.com/a.bin', None)
+    assert fetcher.parse_cancel('{"id": "x"}') == (None, None, None)
+    assert fetcher.parse_cancel('[1]') == (None, None, None)
+
+
+def test_cancel_for_another_node_is_ignored(userdata):
+    cancelled = []
+    supervisor = userdata['supervisor']
+    assert supervisor.begin({'id': 1}, {'url': 'http://example.com/a.bin'})
+    supervisor.attach(1, cancel=lambda: cancelled.append(1))
+
+    fetcher.on_cancel(FakeClient(), userdata, SimpleNamespace(payload=b'{"id": 1, "node": "other"}', qos=0))
+    assert cancelled == []
+    fetcher.on_cancel(FakeClient(), userdata, SimpleNamespace(payload=b'http://example.com/a.bin', qos=0))
+    assert cancelled == [1]
+    assert supervisor.finish(1) == CANCELLED
+
+
+def test_each_retry_leads_with_the_next_mirror():
+    request = {'url': 'http://a/x.m3u8', 'urls': ['http://a/x.m3u8', 'http://b/x.m3u8', 'http://c/x.m3u8']}
+    leaders = [fetcher.job_sources({'attempts': attempts}, request)[0] for attempts in range(4)]
+    assert leaders == ['http://a/x.m3u8', 'http://b/x.m3u8', 'http://c/x.m3u8', 'http://a/x.m3u8']
+    assert fetcher.job_sources({}, {'url': 'http://a/y.bin'}) == ['http://a/y.bin']
+
+
+def test_split_payload():
+    assert fetcher.split_payload('{"url": "a"}') == ['{"url": "a"}']
+    assert fetcher.split_payload('[{"url": "a"}, "http://b"]') == ['{"url": "a"}', 'http://b']
+    assert fetcher.split_payload('{"url": "a"}\n\n{"url": "b"}\n') == ['{"url": "a"}', '{"url": "b"}']
+    assert fetcher.split_payload('download http://a') == ['download http://a']
+
+
+def test_bulk_message_is_queued_as_many_jobs(userdata):
+    userdata['message_queue'] = queue.Queue()
+    payload = b'{"url": "http://example.com/a"}\n{"url": "http://example.com/b"}'
+    fetcher.accept_message(userdata, SimpleNamespace(topic='requests', payload=payload, retain=False))
+    jobs = [userdata['message_queue'].get_nowait() for _ in range(2)]
+    assert [fetcher.parse_message(job['payload'])['url'] for job in jobs] == ['http://example.com/a', 'http://example.com/b']
+    assert [userdata['job_store'].get(job['id'])['state'] for job in jobs] == [QUEUED, QUEUED]
+
+    # A retained copy only adds the jobs not seen yet
+    payload = b'[{"url": "http://example.com/a"}, {"url": "http://example.com/c"}]'
+    fetcher.accept_message(userdata, SimpleNamespace(topic='requests', payload=payload, retain=True))
+    job = userdata['message_queue'].get_nowait()
+    assert fetcher.parse_message(job['payload'])['url'] == 'http://example.com/c'
+    assert userdata['message_queue'].empty()
+
+
+def test_completion_names_the_node(userdata, tmp_path):
+    client = FakeClient()
+    (tmp_path / 'a.bin').write_bytes(b'data')
+    job, request = dispatch(client, userdata, 'http://example.com/a.bin')
+
+    fetcher.finish_download(client, userdata, job, request, 'a.bin')
+    message = client.published[-1]
+    # In cluster mode the puller fetches the file from this node
+    assert (message['node'], message['download_prefix_url'], message['file_path']) == ('test', 'http://files/', 'a.bin')
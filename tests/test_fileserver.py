@@ -0,0 +1,128 @@
+import email
+import http.client
+import os
+
+import pytest
+
+from fileserver import FileServer, HTTPError, parse_range
+
+
+@pytest.fixture
+def data():
+    return os.urandom(10000)
+
+
+@pytest.fixture
+def server(tmp_path, data):
+    root = tmp_path / 'files'
+    (root / 'video').mkdir(parents=True)
+    (root / 'a.bin').write_bytes(data)
+    (root / 'partial.bin').write_bytes(b'still being written')
+    (root / 'video' / 'seg.ts').write_bytes(b'segment')
+    server = FileServer(str(root), host='127.0.0.1', port=0)
+    server.add('a.bin')
+    server.add('video')
+    server.start()
+    yield server
+    server.stop()
+
+
+def test_parse_range():
+    assert parse_range('bytes=0-99', 1000) == [(0, 99)]
+    assert parse_range('bytes=900-', 1000) == [(900, 999)]
+    # Suffix range and an end past the file
+    assert parse_range('bytes=-100', 1000) == [(900, 999)]
+    assert parse_range('bytes=990-2000', 1000) == [(990, 999)]
+    assert parse_range('bytes=0-0, 10-19', 1000) == [(0, 0), (10, 19)]
+    # Ignored, the whole file is sent
+    assert parse_range('items=0-1', 1000) is None
+    assert parse_range('bytes=5-1', 1000) is None
+    assert parse_range('bytes=a-b', 1000) is None
+    with pytest.raises(HTTPError) as e:
+        parse_range('bytes=1000-', 1000)
+    assert e.value.status == 416
+
+
+def test_keep_alive_and_single_range(server, data):
+    conn = http.client.HTTPConnection('127.0.0.1', server.port)
+    try:
+        conn.request('GET', '/a.bin')
+        response = conn.getresponse()
+        assert response.status == 200
+        assert response.getheader('Accept-Ranges') == 'bytes'
+        assert response.read() == data
+
+        # Same connection
+        conn.request('GET', '/a.bin', headers={'Range': 'bytes=100-199'})
+        response = conn.getresponse()
+        assert response.status == 206
+        assert response.getheader('Content-Range') == f"bytes 100-199/{len(data)}"
+        assert response.read() == data[100:200]
+
+        conn.request('HEAD', '/a.bin')
+        response = conn.getresponse()
+        assert response.getheader('Content-Length') == str(len(data))
+        assert response.read() == b''
+    finally:
+        conn.close()
+
+
+def test_multipart_byteranges(server, data):
+    conn = http.client.HTTPConnection('127.0.0.1', server.port)
+    try:
+        conn.request('GET', '/a.bin', headers={'Range': 'bytes=0-9, 5000-5099, -10'})
+        response = conn.getresponse()
+        assert response.status == 206
+        content_type = response.getheader('Content-Type')
+        assert content_type.startswith('multipart/byteranges; boundary=')
+        body = response.read()
+        assert len(body) == int(response.getheader('Content-Length'))
+    finally:
+        conn.close()
+
+    message = email.message_from_bytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+    parts = [(part['Content-Range'], part.get_payload(decode=True)) for part in message.get_payload()]
+    assert parts == [
+        (f"bytes 0-9/{len(data)}", data[:10]),
+        (f"bytes 5000-5099/{len(data)}", data[5000:5100]),
+        (f"bytes {len(data) - 10}-{len(data) - 1}/{len(data)}", data[-10:]),
+    ]
+
+
+def test_unsatisfiable_range(server, data):
+    conn = http.client.HTTPConnection('127.0.0.1', server.port)
+    try:
+        conn.request('GET', '/a.bin', headers={'Range': f"bytes={len(data)}-"})
+        response = conn.getresponse()
+        assert response.status == 416
+        assert response.getheader('Content-Range') == f"bytes */{len(data)}"
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize('path, status', [
+    ('/video/seg.ts', 200),
+    # Not finished yet
+    ('/partial.bin', 404),
+    ('/../files/a.bin', 404),
+    ('/missing.bin', 404),
+])
+def test_only_finished_paths_are_served(server, path, status):
+    conn = http.client.HTTPConnection('127.0.0.1', server.port)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        response.read()
+        assert response.status == status
+    finally:
+        conn.close()
+
+
+def test_discarded_path_is_not_served(server):
+    server.discard('video')
+    conn = http.client.HTTPConnection('127.0.0.1', server.port)
+    try:
+        conn.request('GET', '/video/seg.ts')
+        assert conn.getresponse().status == 404
+    finally:
+        conn.close()
@@ -0,0 +1,104 @@
+import functools
+import hashlib
+import os
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip('aiohttp')
+pytest.importorskip('cryptography')
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from hls import HLSDownloader
+from segcache import SegmentCache
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def encrypt(data, key, iv):
+    padder = padding.PKCS7(128).padder()
+    encryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).encryptor()
+    return encryptor.update(padder.update(data) + padder.finalize()) + encryptor.finalize()
+
+
+@pytest.fixture
+def origin(tmp_path):
+    root = tmp_path / 'origin'
+    root.mkdir()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(QuietHandler, directory=str(root)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield root, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def write_stream(root):
+    """An encrypted stream below root; returns its decrypted bytes."""
+    key = os.urandom(16)
+    iv = os.urandom(16)
+    plain = [os.urandom(1000), os.urandom(2048), os.urandom(333)]
+    (root / 'low').mkdir()
+    (root / 'key.bin').write_bytes(key)
+    (root / 'low' / 'seg0.ts').write_bytes(plain[0])
+    (root / 'low' / 'seg1.ts').write_bytes(encrypt(plain[1], key, iv))
+    # Without an IV attribute the media sequence number is the IV
+    (root / 'low' / 'seg2.ts').write_bytes(encrypt(plain[2], key, (7 + 2).to_bytes(16, 'big')))
+    (root / 'master.m3u8').write_text(
+        "#EXTM3U\n"
+        "#EXT-X-STREAM-INF:BANDWIDTH=500000,RESOLUTION=640x360\n"
+        "low/index.m3u8\n"
+    )
+    (root / 'low' / 'index.m3u8').write_text(
+        "#EXTM3U\n"
+        "#EXT-X-TARGETDURATION:10\n"
+        "#EXT-X-MEDIA-SEQUENCE:7\n"
+        "#EXTINF:10,\n"
+        "seg0.ts\n"
+        f'#EXT-X-KEY:METHOD=AES-128,URI="/key.bin",IV=0x{iv.hex()}\n'
+        "#EXTINF:10,\n"
+        "seg1.ts\n"
+        '#EXT-X-KEY:METHOD=AES-128,URI="/key.bin"\n'
+        "#EXTINF:10,\n"
+        "seg2.ts\n"
+        "#EXT-X-ENDLIST\n"
+    )
+    return b''.join(plain)
+
+
+def test_download_encrypted_stream(origin, tmp_path):
+    root, base_url = origin
+    expected = write_stream(root)
+
+    downloader = HLSDownloader(concurrency=2)
+    output_path = downloader.download(f"{base_url}/master.m3u8", str(tmp_path / 'video'))
+
+    assert output_path == str(tmp_path / 'video.ts')
+    with open(output_path, 'rb') as f:
+        assert f.read() == expected
+    assert downloader.sha256 == hashlib.sha256(expected).hexdigest()
+    assert not os.path.exists(output_path + '.part')
+
+
+def test_download_from_segment_cache(origin, tmp_path):
+    root, base_url = origin
+    expected = write_stream(root)
+    cache = SegmentCache(str(tmp_path / 'cache'), 1 << 20)
+
+    first = HLSDownloader(concurrency=2, cache=cache).download(f"{base_url}/master.m3u8", str(tmp_path / 'first'))
+    assert cache.usage()[0] == 3
+    # The origin is gone, every segment comes from the cache
+    for segment in (root / 'low').glob('*.ts'):
+        segment.unlink()
+    downloader = HLSDownloader(concurrency=2, cache=cache)
+    second = downloader.download(f"{base_url}/master.m3u8", str(tmp_path / 'second'))
+
+    for path in (first, second):
+        with open(path, 'rb') as f:
+            assert f.read() == expected
+    assert downloader.sha256 == hashlib.sha256(expected).hexdigest()
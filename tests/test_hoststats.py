@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+from hoststats import MIN_SAMPLE_BYTES, MIN_SAMPLES, HostTuner, parse_candidates, url_host
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def tuner(tmp_path):
+    tuner = HostTuner(str(tmp_path / 'hosts.db'), explore=0)
+    yield tuner
+    tuner.close()
+
+
+def test_url_host():
+    assert url_host('http://CDN.example.com:8080/a.bin') == 'cdn.example.com:8080'
+    assert url_host('magnet:?xt=urn:btih:abc') is None
+    assert parse_candidates('8, 2,2') == [2, 8]
+    with pytest.raises(ValueError):
+        parse_candidates('0')
+
+
+def test_settles_on_the_fastest_count(tuner):
+    # A host that throttles parallel connections: 4 is the sweet spot
+    speeds = {1: 10, 2: 20, 4: 40, 8: 15, 16: 5}
+    random.seed(1)
+    for _ in range(40):
+        n = tuner.choose('cdn', 'aria2', 16)
+        tuner.record('cdn', 'aria2', n, size=speeds[n] * MB, duration=1)
+    assert tuner.choose('cdn', 'aria2', 16) == 4
+    # Other hosts and kinds start from the default
+    assert tuner.choose('other', 'aria2', 16) == 16
+    assert tuner.choose('cdn', 'hls', 3) == 2
+
+
+def test_failures_count_against_a_setting(tuner):
+    for _ in range(MIN_SAMPLES):
+        tuner.record('cdn', 'aria2', 16, size=100 * MB, duration=1)
+        tuner.record('cdn', 'aria2', 8, size=60 * MB, duration=1)
+        tuner.record('cdn', 'aria2', 4, size=30 * MB, duration=1)
+    assert tuner.choose('cdn', 'aria2', 16) == 16
+    for _ in range(5):
+        tuner.record('cdn', 'aria2', 16, ok=False)
+    assert tuner.choose('cdn', 'aria2', 16) == 8
+
+
+def test_small_downloads_are_not_samples(tuner):
+    tuner.record('cdn', 'aria2', 16, size=MIN_SAMPLE_BYTES - 1, duration=0.01)
+    assert tuner.summary('cdn', 'aria2') == {}
+
+
+def test_stats_survive_restart(tmp_path):
+    tuner = HostTuner(str(tmp_path / 'hosts.db'))
+    tuner.record('cdn', 'aria2', 4, size=10 * MB, duration=2)
+    tuner.close()
+    tuner = HostTuner(str(tmp_path / 'hosts.db'))
+    assert tuner.summary('cdn', 'aria2') == {4: (1, 5 * MB, 0.0)}
+    tuner.close()
+
+
+def test_jobs_per_host_cap(tmp_path):
+    tuner = HostTuner(str(tmp_path / 'hosts.db'), candidates=(), max_jobs=2)
+    assert tuner.acquire('cdn') and tuner.acquire('cdn')
+    assert not tuner.acquire('cdn')
+    assert tuner.acquire('other')
+    # Magnets have no host and are never held back
+    assert tuner.acquire(None)
+    tuner.release('cdn')
+    assert tuner.acquire('cdn')
+    # Without candidates nothing is learned
+    assert tuner.choose('cdn', 'aria2', 16) == 16
+    tuner.close()
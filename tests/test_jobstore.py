@@ -0,0 +1,52 @@
+import time
+
+import pytest
+
+from jobstore import DONE, FAILED, QUEUED, RUNNING, JobStore
+
+
+@pytest.fixture
+def job_store(tmp_path):
+    job_store = JobStore(str(tmp_path / 'jobs' / 'jobs.db'))
+    yield job_store
+    job_store.close()
+
+
+def test_wal_mode(job_store):
+    assert job_store._conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+
+def test_add_many_in_one_transaction(job_store):
+    job_ids = job_store.add_many(['{"url": "a"}', '{"url": "b"}', '{"url": "c"}'], time.time())
+    assert len(job_ids) == 3
+    assert [job_store.get(job_id)['payload'] for job_id in job_ids] == ['{"url": "a"}', '{"url": "b"}', '{"url": "c"}']
+
+    # A bad payload rolls the whole batch back
+    with pytest.raises(AttributeError):
+        job_store.add_many(['{"url": "d"}', None], time.time())
+    assert not job_store.seen('{"url": "d"}')
+    assert job_store.counts() == {QUEUED: 3}
+
+
+def test_seen_and_unfinished(job_store):
+    queued = job_store.add('a', time.time())
+    running = job_store.add('b', time.time())
+    done = job_store.add('c', time.time())
+    job_store.update(running, RUNNING, gid='gid1')
+    job_store.update(done, DONE, file_path='c.bin')
+
+    assert [job['id'] for job in job_store.unfinished()] == [queued, running]
+    assert job_store.get(running)['gid'] == 'gid1'
+    assert job_store.seen('c') and not job_store.seen('c', unfinished=True)
+    assert [job['file_path'] for job in job_store.done_since(0)] == ['c.bin']
+
+
+def test_prune_keeps_unfinished_jobs(job_store):
+    queued = job_store.add('a', time.time())
+    failed = job_store.add('b', time.time())
+    job_store.update(failed, FAILED, error='boom')
+    time.sleep(0.05)
+
+    assert job_store.prune(0.01) == 1
+    assert job_store.get(failed) is None
+    assert job_store.get(queued)['state'] == QUEUED
@@ -0,0 +1,76 @@
+import json
+import logging
+import queue
+
+import pytest
+
+import logger
+from logger import DroppingQueueHandler, JSONFormatter, SampleFilter, clip, setup_logging
+
+
+def record(msg, **extra):
+    record = logging.LogRecord('test', logging.INFO, __file__, 1, msg, None, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_clip():
+    assert clip('short', 10) == 'short'
+    assert clip('x' * 30, 10) == f"{'x' * 10}... (30 chars)"
+    assert clip('x' * 30, 0) == 'x' * 30
+
+
+def test_json_formatter():
+    entry = json.loads(JSONFormatter().format(record('Job done: 中文', job_id=7)))
+    assert (entry['level'], entry['message'], entry['job_id']) == ('INFO', 'Job done: 中文', 7)
+    assert 'job_id' not in json.loads(JSONFormatter().format(record('no job')))
+
+
+def test_sampling(monkeypatch):
+    now = [1000.5]
+    monkeypatch.setattr(logger.time, 'time', lambda: now[0])
+    sample = SampleFilter(rate=2)
+    passed = [sample.filter(record(f"received {i}", sample=True)) for i in range(5)]
+    assert passed == [True, True, False, False, False]
+    # Records that are not sampled always pass
+    assert sample.filter(record('error'))
+
+    now[0] += 1
+    first = record('received 5', sample=True)
+    assert sample.filter(first)
+    assert first.msg == 'received 5 (3 similar messages suppressed)'
+
+
+def test_full_queue_drops_records():
+    handler = DroppingQueueHandler(queue.Queue(1))
+    handler.enqueue(record('a'))
+    handler.enqueue(record('b'))
+    assert handler.dropped == 1
+
+
+@pytest.fixture
+def root_logger(monkeypatch):
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    monkeypatch.setattr(logger, 'PAYLOAD_MAX', logger.PAYLOAD_MAX)
+    yield root
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+def test_setup_logging_writes_json_lines(root_logger, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    listener = setup_logging('test', {'LOG_FORMAT': 'json', 'LOG_PAYLOAD_MAX': 5})
+    try:
+        logging.info(f"Received {clip('0123456789')}", extra={'job_id': 3})
+    finally:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+    [line] = (tmp_path / 'logs' / 'video_test.log').read_text(encoding='utf-8').splitlines()
+    entry = json.loads(line)
+    assert (entry['message'], entry['job_id']) == ('Received 01234... (10 chars)', 3)
@@ -0,0 +1,126 @@
+import json
+import os
+import urllib.error
+import urllib.request
+
+import pytest
+
+from fileserver import PIECES_PATH, FileServer
+import manifest as manifest_module
+from manifest import PIECE_SIZE, FileHasher, Manifest, ManifestBusy, file_hashes, file_sha256, piece_sha256
+
+
+@pytest.fixture
+def root(tmp_path):
+    root = tmp_path / 'files'
+    root.mkdir()
+    # Two full pieces and a short one
+    (root / 'a.bin').write_bytes(os.urandom(PIECE_SIZE * 2 + 1000))
+    return root
+
+
+@pytest.fixture
+def manifest(tmp_path, root):
+    manifest = Manifest(str(tmp_path / 'manifest.db'), str(root))
+    yield manifest
+    manifest.close()
+
+
+def test_file_hasher_matches_piece_sha256(root):
+    hasher = FileHasher()
+    with open(root / 'a.bin', 'rb') as f:
+        # Chunks that do not line up with the pieces
+        while chunk := f.read(1000003):
+            hasher.update(chunk)
+    assert hasher.pieces() == piece_sha256(root / 'a.bin', PIECE_SIZE)
+    assert (hasher.hexdigest(), hasher.pieces()) == file_hashes(root / 'a.bin')
+
+
+def test_pieces_are_kept_at_publish_time(manifest, root, monkeypatch):
+    manifest.update('a.bin')
+    monkeypatch.setattr(manifest_module, 'piece_sha256', lambda *args: pytest.fail("file was hashed again"))
+    listing = manifest.pieces('a.bin')
+    assert listing['piece_size'] == PIECE_SIZE
+    assert len(listing['pieces']) == 3
+
+    # A changed file is not described by the stored hashes
+    (root / 'a.bin').write_bytes(b'changed')
+    assert manifest.pieces('a.bin') is None
+
+
+def test_pieces_hashed_on_demand_are_limited(manifest, monkeypatch):
+    manifest.update('a.bin', sha256='0' * 64)
+    for _ in range(manifest_module.PIECE_WORKERS):
+        manifest._hashing.acquire()
+    with pytest.raises(ManifestBusy):
+        manifest.pieces('a.bin')
+    for _ in range(manifest_module.PIECE_WORKERS):
+        manifest._hashing.release()
+
+    assert len(manifest.pieces('a.bin')['pieces']) == 3
+    monkeypatch.setattr(manifest_module, 'piece_sha256', lambda *args: pytest.fail("file was hashed again"))
+    assert len(manifest.pieces('a.bin')['pieces']) == 3
+
+
+def test_pieces_endpoint(manifest, root):
+    manifest.update('a.bin')
+    server = FileServer(str(root), host='127.0.0.1', port=0, pieces=manifest.pieces)
+    server.add('a.bin')
+    server.start()
+    try:
+        url = f"http://127.0.0.1:{server.port}{PIECES_PATH}"
+        with urllib.request.urlopen(f"{url}?path=a.bin") as response:
+            listing = json.loads(response.read())
+        assert listing['path'] == 'a.bin'
+        assert listing['pieces'] == piece_sha256(root / 'a.bin', PIECE_SIZE)
+
+        # Only the piece size kept in the manifest
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(f"{url}?path=a.bin&size=65536")
+        assert e.value.code == 400
+    finally:
+        server.stop()
+
+
+def test_changes_since_seq(manifest, root):
+    (root / 'video').mkdir()
+    (root / 'video' / 'b.ts').write_bytes(b'segment')
+    assert manifest.update('a.bin') == 1
+    assert manifest.update('video') == 1
+    # Unchanged files keep their sequence number
+    assert manifest.update('a.bin') == 0
+    assert manifest.seq() == 2
+    assert manifest.get('video/b.ts')['sha256'] == file_sha256(root / 'video' / 'b.ts')
+
+    assert manifest.remove('video') == 1
+    files, seq = manifest.changes(1)
+    assert seq == 3
+    assert [(entry['path'], entry['deleted']) for entry in files] == [('video/b.ts', 1)]
+    # A full listing leaves tombstones out
+    files, seq = manifest.changes(0)
+    assert [entry['path'] for entry in files] == ['a.bin']
+
+
+def test_rescan(manifest, root):
+    (root / 'b.bin').write_bytes(b'old')
+    manifest.update('a.bin')
+    manifest.update('b.bin')
+    (root / 'a.bin').unlink()
+    (root / 'b.bin').write_bytes(b'new content')
+
+    assert manifest.rescan() == 2
+    assert manifest.get('a.bin')['deleted'] == 1
+    assert manifest.get('b.bin')['sha256'] == file_sha256(root / 'b.bin')
+    assert [entry['path'] for entry in manifest.changes(2)[0]] == ['a.bin', 'b.bin']
+
+
+def test_instance_id_is_kept(tmp_path, root):
+    first = Manifest(str(tmp_path / 'm.db'), str(root))
+    instance_id = first.instance_id()
+    first.close()
+    second = Manifest(str(tmp_path / 'm.db'), str(root))
+    assert second.instance_id() == instance_id
+    second.close()
+    other = Manifest(str(tmp_path / 'other.db'), str(root))
+    assert other.instance_id() != instance_id
+    other.close()
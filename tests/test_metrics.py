@@ -0,0 +1,59 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from metrics import Counter, Gauge, Histogram, MetricsServer, Registry
+
+
+def test_counter_and_gauge():
+    registry = Registry()
+    jobs = Counter('jobs_total', 'Jobs', ('type', 'outcome'), registry=registry)
+    jobs.inc('http', 'success')
+    jobs.inc('http', 'success', amount=2)
+    jobs.inc('m3u8', 'fail"ed')
+    Gauge('workers', 'Workers', ('type',), registry=registry).set_function(lambda: {('http',): 3})
+    # Unset and failing gauges are left out
+    Gauge('unset', 'Unset', registry=registry)
+    Gauge('broken', 'Broken', registry=registry).set_function(lambda: 1 / 0)
+
+    lines = registry.render().splitlines()
+    assert lines[:4] == [
+        '# HELP jobs_total Jobs',
+        '# TYPE jobs_total counter',
+        'jobs_total{type="http",outcome="success"} 3',
+        'jobs_total{type="m3u8",outcome="fail\\"ed"} 1',
+    ]
+    assert 'workers{type="http"} 3' in lines
+    assert not any(line.startswith('# HELP broken') for line in lines)
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    wait = Histogram('wait_seconds', 'Wait', ('type',), buckets=(1, 0.1), registry=registry)
+    for value in (0.05, 0.1, 0.5, 5):
+        wait.observe(value, 'http')
+
+    assert wait.samples() == [
+        ('wait_seconds_bucket', '{type="http",le="0.1"}', 2),
+        ('wait_seconds_bucket', '{type="http",le="1"}', 3),
+        ('wait_seconds_bucket', '{type="http",le="+Inf"}', 4),
+        ('wait_seconds_sum', '{type="http"}', 5.65),
+        ('wait_seconds_count', '{type="http"}', 4),
+    ]
+
+
+def test_metrics_server():
+    registry = Registry()
+    Counter('jobs_total', 'Jobs', registry=registry).inc()
+    server = MetricsServer(registry, host='127.0.0.1', port=0)
+    assert server.start()
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            assert 'jobs_total 1' in response.read().decode().splitlines()
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(f"http://127.0.0.1:{server.port}/other")
+        assert e.value.code == 404
+    finally:
+        server.stop()
@@ -0,0 +1,38 @@
+import threading
+import time
+
+from pipeline import Pipeline
+
+
+def test_submit_does_not_block_when_post_processing_is_saturated():
+    pipeline = Pipeline(workers=1, max_pending=1)
+    done = []
+    finished = threading.Event()
+
+    def on_done(result):
+        done.append(result)
+        if len(done) == 3:
+            finished.set()
+
+    try:
+        started = time.monotonic()
+        for _ in range(3):
+            pipeline.submit(time.sleep, (0.5,), on_done, lambda error: None)
+        # Called from the aria2 notification thread: must return at once
+        assert time.monotonic() - started < 0.1
+        assert finished.wait(30)
+        assert pipeline.pending() == 0
+    finally:
+        pipeline.shutdown()
+
+
+def test_errors_reach_on_error():
+    pipeline = Pipeline(workers=1, max_pending=1)
+    errors = []
+    failed = threading.Event()
+    try:
+        pipeline.submit(int, ('not a number',), lambda result: None, lambda error: (errors.append(error), failed.set()))
+        assert failed.wait(30)
+        assert isinstance(errors[0], ValueError)
+    finally:
+        pipeline.shutdown()
@@ -0,0 +1,103 @@
+import json
+from types import SimpleNamespace
+
+from progress import ProgressReporter
+
+
+class FakeClient:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload, qos=0):
+        self.published.append(json.loads(payload))
+        return SimpleNamespace(rc=0)
+
+
+class FakeRPC:
+    def __init__(self):
+        self.active = []
+        self.waiting = []
+        self.multicalls = 0
+
+    def multicall(self, calls):
+        self.multicalls += 1
+        return [self.active, self.waiting]
+
+
+class FakeAria2:
+    def __init__(self):
+        self._rpc = FakeRPC()
+
+    def rpc(self):
+        return self._rpc
+
+
+def status(gid, completed, total=1000, speed=100, following=None):
+    return {
+        'gid': gid, 'following': following, 'completedLength': str(completed), 'totalLength': str(total),
+        'downloadSpeed': str(speed), 'connections': '4',
+    }
+
+
+def tick(reporter):
+    reporter._poll_aria2()
+    reporter._measure_hls()
+    reporter._publish()
+
+
+def make_reporter(client, aria2server=None, batch_size=100):
+    config = {'NODE_ID': 'test', 'TOPIC_PROGRESS': 'progress'}
+    return ProgressReporter(client, config, aria2server, batch_size=batch_size)
+
+
+def request(i):
+    return {'url': f"http://example.com/{i}", 'name': None}
+
+
+def test_aria2_jobs_in_one_multicall():
+    client = FakeClient()
+    aria2server = FakeAria2()
+    reporter = make_reporter(client, aria2server)
+    reporter.watch_aria2({'id': 1}, request(1), 'gid1')
+    reporter.watch_aria2({'id': 2}, request(2), 'metadata')
+    aria2server._rpc.active = [status('gid1', 200), status('torrent', 500, following='metadata')]
+    aria2server._rpc.waiting = [status('other', 0)]
+
+    tick(reporter)
+    assert aria2server._rpc.multicalls == 1
+    [message] = client.published
+    assert message['status'] == 'progress'
+    # The magnet is reported through the torrent that follows it
+    assert [(job['id'], job['completed'], job['eta']) for job in message['jobs']] == [(1, 200, 8), (2, 500, 5)]
+
+
+def test_unchanged_and_finished_jobs_are_skipped():
+    client = FakeClient()
+    aria2server = FakeAria2()
+    reporter = make_reporter(client, aria2server)
+    reporter.watch_aria2({'id': 1}, request(1), 'gid1')
+    reporter.watch_aria2({'id': 2}, request(2), 'gid2')
+    aria2server._rpc.active = [status('gid1', 200), status('gid2', 300)]
+    tick(reporter)
+
+    aria2server._rpc.active = [status('gid1', 200), status('gid2', 400)]
+    tick(reporter)
+    assert [job['id'] for job in client.published[-1]['jobs']] == [2]
+
+    reporter.finish(2)
+    aria2server._rpc.active = [status('gid1', 200), status('gid2', 500)]
+    tick(reporter)
+    assert len(client.published) == 2
+
+
+def test_batches():
+    client = FakeClient()
+    reporter = make_reporter(client, batch_size=2)
+    for i in range(5):
+        reporter.update_hls({'id': i}, request(i), 1, 4, 100)
+
+    tick(reporter)
+    assert [len(message['jobs']) for message in client.published] == [2, 2, 1]
+    job = client.published[0]['jobs'][0]
+    # The total is estimated from the average segment size
+    assert (job['completed'], job['total'], job['segments'], job['segments_total']) == (100, 400, 1, 4)
@@ -0,0 +1,212 @@
+import json
+import queue
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+import puller
+from aria2s import Aria2cServer
+from fake_aria2 import make_server
+from fetcher import manifest_listing
+from fileserver import MANIFEST_PATH, FileServer
+from hoststats import HostTuner
+from jobstore import DONE, FAILED, QUEUED, JobStore
+from manifest import Manifest
+from retry import RetryScheduler
+from tracker import Aria2Tracker
+from workers import WorkerPool
+
+
+@pytest.fixture
+def aria2(tmp_path):
+    server, fake = make_server(secret='test', complete_after=0.2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    aria2server = Aria2cServer(host='http://127.0.0.1', port=server.server_address[1], secret='test')
+    yield aria2server, fake
+    aria2server.close()
+    server.shutdown()
+
+
+@pytest.fixture
+def userdata(tmp_path, aria2):
+    aria2server, fake = aria2
+    tracker = Aria2Tracker(aria2server)
+    tracker.start()
+    worker_pool = WorkerPool({'pull': 4}, name='puller')
+    retry_scheduler = RetryScheduler()
+    retry_scheduler.start()
+    yield {
+        'config': {
+            'ARIA2_RPC_ENABLE': True, 'ARIA2_DOWNLOAD_DIR': str(tmp_path), 'PULL_VERIFY': False,
+            'RETRY_MAX': 3, 'RETRY_DELAY': 0.1, 'RETRY_MAX_DELAY': 0.1,
+        },
+        'job_store': JobStore(str(tmp_path / 'jobs.db')),
+        'aria2server': aria2server,
+        'tracker': tracker,
+        'worker_pool': worker_pool,
+        'retry_scheduler': retry_scheduler,
+        'local_index': None,
+        'tuner': None,
+    }
+    retry_scheduler.stop()
+    worker_pool.shutdown()
+    tracker.stop()
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def submit(userdata, url):
+    payload = json.dumps({'download_url': url})
+    job = {'id': userdata['job_store'].add(payload, time.time()), 'payload': payload}
+    userdata['worker_pool'].submit('pull', puller.process_message, None, userdata, job, url)
+    return job
+
+
+def test_pulls_share_one_connection(userdata, aria2):
+    aria2server, fake = aria2
+    rpc = aria2server.rpc()
+    jobs = [submit(userdata, f"http://files/{i}.bin") for i in range(8)]
+
+    job_store = userdata['job_store']
+    assert wait_for(lambda: all(job_store.get(job['id'])['state'] == DONE for job in jobs))
+    # Every worker went through the same RPC connection, each job got its own download
+    assert aria2server.rpc() is rpc
+    assert len({job_store.get(job['id'])['gid'] for job in jobs}) == 8
+    assert len(fake.downloads) == 8
+    assert userdata['tracker'].pending() == 0
+
+
+def test_resumable(aria2):
+    aria2server, fake = aria2
+    gid = aria2server.add_download('http://files/a.bin', '/tmp', filename='a.bin')
+    assert aria2server.resumable(gid)
+    assert not aria2server.resumable('00000000000000ff')
+
+
+def test_retry_continues_partial_download(userdata, aria2):
+    aria2server, fake = aria2
+    url = 'http://files/a.bin'
+    payload = json.dumps({'download_url': url})
+    job = {'id': userdata['job_store'].add(payload, time.time()), 'payload': payload, 'attempts': 1}
+    puller.process_message(None, userdata, job, url)
+
+    assert wait_for(lambda: userdata['job_store'].get(job['id'])['state'] == DONE)
+    [download] = fake.downloads.values()
+    assert download['options']['continue'] == 'true'
+
+
+def test_failed_pull_is_retried_until_retry_max(userdata):
+    url = 'http://files/a.bin'
+    payload = json.dumps({'download_url': url})
+    job = {'id': userdata['job_store'].add(payload, time.time()), 'payload': payload, 'gid': 'gid1', 'attempts': 2}
+    puller.retry_or_fail_job(None, userdata, job, url, "boom")
+    assert job['attempts'] == 3
+    assert job['gid'] is None
+    assert userdata['job_store'].get(job['id'])['state'] == QUEUED
+    assert userdata['retry_scheduler'].pending() == 1
+
+    userdata['retry_scheduler'].stop()
+    puller.retry_or_fail_job(None, userdata, job, url, "boom")
+    assert userdata['job_store'].get(job['id'])['state'] == FAILED
+
+
+@pytest.fixture
+def fetcher_node(tmp_path):
+    root = tmp_path / 'fetcher'
+    root.mkdir()
+    manifest = Manifest(str(tmp_path / 'fetcher.db'), str(root))
+    config = {'NODE_ID': 'a', 'DOWNLOAD_PREFIX_URL': 'http://node-a/files/'}
+    server = FileServer(str(root), host='127.0.0.1', port=0, manifest=lambda since: manifest_listing(config, manifest, since))
+    server.start()
+    yield root, manifest, f"http://127.0.0.1:{server.port}{MANIFEST_PATH}"
+    server.stop()
+    manifest.close()
+
+
+@pytest.fixture
+def sync_userdata(tmp_path):
+    local = tmp_path / 'local'
+    local.mkdir()
+    local_index = Manifest(str(tmp_path / 'local.db'), str(local))
+    yield {
+        'config': {'ARIA2_DOWNLOAD_DIR': str(local)},
+        'job_store': JobStore(str(tmp_path / 'jobs.db')),
+        'local_index': local_index,
+        'message_queue': queue.Queue(),
+    }
+    local_index.close()
+
+
+def queued_paths(userdata):
+    paths = []
+    while not userdata['message_queue'].empty():
+        paths.append(json.loads(userdata['message_queue'].get_nowait()['payload'])['file_path'])
+    return paths
+
+
+def test_sync_queues_missing_and_changed_files(fetcher_node, sync_userdata):
+    root, manifest, sync_url = fetcher_node
+    local = Path(sync_userdata['config']['ARIA2_DOWNLOAD_DIR'])
+    for name, data in (('a.bin', b'a'), ('b.bin', b'b'), ('c.bin', b'c')):
+        (root / name).write_bytes(data)
+        manifest.update(name)
+    # a.bin is here already, b.bin has the same size but other content
+    (local / 'a.bin').write_bytes(b'a')
+    (local / 'b.bin').write_bytes(b'x')
+
+    assert puller.sync_once(sync_userdata, sync_url, full=True) == 2
+    assert queued_paths(sync_userdata) == ['b.bin', 'c.bin']
+    job = json.loads(sync_userdata['job_store'].get(1)['payload'])
+    assert (job['download_url'], job['sync']) == ('http://node-a/files/b.bin', sync_url)
+
+    # Queued jobs are not queued again, and an incremental sync only sees what changed
+    assert puller.sync_once(sync_userdata, sync_url) == 0
+    (root / 'd.bin').write_bytes(b'd')
+    manifest.update('d.bin')
+    assert puller.sync_once(sync_userdata, sync_url) == 1
+    assert queued_paths(sync_userdata) == ['d.bin']
+
+
+def test_sync_starts_over_when_the_manifest_is_reset(fetcher_node, sync_userdata):
+    root, manifest, sync_url = fetcher_node
+    (root / 'a.bin').write_bytes(b'a')
+    manifest.update('a.bin')
+    puller.sync_once(sync_userdata, sync_url, full=True)
+    queued_paths(sync_userdata)
+
+    # A new database restarts the sequence numbers below the one remembered
+    sync_userdata['local_index'].set_value(f"seq:{sync_url}", 100)
+    manifest.set_value('id', 'reset')
+    (root / 'b.bin').write_bytes(b'b')
+    manifest.update('b.bin')
+    assert puller.sync_once(sync_userdata, sync_url) == 1
+    assert queued_paths(sync_userdata) == ['b.bin']
+
+
+def test_job_over_the_host_cap_is_deferred(userdata, aria2, tmp_path):
+    aria2server, fake = aria2
+    userdata['tuner'] = HostTuner(str(tmp_path / 'hosts.db'), candidates=(), max_jobs=1)
+    assert userdata['tuner'].acquire('files')
+    url = 'http://files/a.bin'
+    payload = json.dumps({'download_url': url})
+    job = {'id': userdata['job_store'].add(payload, time.time()), 'payload': payload}
+
+    puller.process_message(None, userdata, job, url)
+    # Nothing was started and no worker waits, the job is tried again later
+    assert fake.downloads == {}
+    assert userdata['retry_scheduler'].pending() == 1
+
+    userdata['tuner'].release('files')
+    assert wait_for(lambda: userdata['job_store'].get(job['id'])['state'] == DONE)
+    # The slot is free again
+    assert userdata['tuner'].acquire('files')
+    userdata['tuner'].close()
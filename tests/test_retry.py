@@ -0,0 +1,42 @@
+import threading
+import time
+
+from retry import RetryScheduler, backoff_delay
+
+
+def test_backoff_delay():
+    for attempt, delay in enumerate([5, 10, 20, 40]):
+        for _ in range(20):
+            assert delay / 2 <= backoff_delay(attempt, 5, 300) <= delay
+    # Capped, with the jitter still applied
+    delays = {backoff_delay(10, 5, 300) for _ in range(20)}
+    assert all(150 <= delay <= 300 for delay in delays)
+    assert len(delays) > 1
+
+
+def test_callbacks_run_in_due_order():
+    scheduler = RetryScheduler()
+    scheduler.start()
+    calls = []
+    done = threading.Event()
+    try:
+        scheduler.schedule(0.3, lambda: (calls.append('late'), done.set()))
+        scheduler.schedule(0.1, calls.append, 'early')
+        # A failing callback does not stop the timer thread
+        scheduler.schedule(0.05, lambda: 1 / 0)
+        assert scheduler.pending() == 3
+        assert done.wait(5)
+        assert calls == ['early', 'late']
+        assert scheduler.pending() == 0
+    finally:
+        scheduler.stop()
+
+
+def test_stop_drops_callbacks_not_due():
+    scheduler = RetryScheduler()
+    scheduler.start()
+    calls = []
+    scheduler.schedule(0.2, calls.append, 1)
+    scheduler.stop()
+    time.sleep(0.3)
+    assert calls == []
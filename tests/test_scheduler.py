@@ -0,0 +1,80 @@
+import threading
+from collections import Counter
+
+from scheduler import FairQueue, WaitStats, parse_priority, parse_weights
+from workers import WorkerPool
+
+
+def drain(queue):
+    items = []
+    while queue:
+        items.append(queue.pop())
+    return items
+
+
+def test_higher_band_first():
+    queue = FairQueue()
+    queue.put('normal')
+    queue.put('low', priority=-1)
+    queue.put('high', priority=1)
+    queue.put('normal2')
+    assert drain(queue) == ['high', 'normal', 'normal2', 'low']
+
+
+def test_tenants_take_turns():
+    queue = FairQueue()
+    for i in range(4):
+        queue.put(f"a{i}", tenant='a')
+    queue.put('b0', tenant='b')
+    queue.put('b1', tenant='b')
+    # A tenant with many queued jobs does not hold up the others
+    assert drain(queue) == ['a0', 'b0', 'a1', 'b1', 'a2', 'a3']
+
+
+def test_weights():
+    queue = FairQueue({'a': 2, 'c': 0.5})
+    for tenant in 'abc':
+        for i in range(20):
+            queue.put(f"{tenant}{i}", tenant=tenant)
+    # Four rounds: a starts two jobs per round, c one every other round
+    started = Counter(item[0] for item in drain(queue)[:14])
+    assert started == {'a': 8, 'b': 4, 'c': 2}
+
+
+def test_parse_priority_and_weights():
+    assert [parse_priority(value) for value in (None, 'HIGH', 'low', '3', 42, 'urgent')] == [0, 1, -1, 3, 9, 0]
+    assert parse_weights('alice=2, bob=0.5,carol=x') == {'alice': 2.0, 'bob': 0.5, 'carol': 1}
+
+
+def test_worker_pool_starts_jobs_by_priority():
+    pool = WorkerPool({'http': 1})
+    started = []
+    release = threading.Event()
+    done = threading.Event()
+    try:
+        # The only worker is busy, the rest queue up
+        pool.submit('http', release.wait)
+        pool.submit('http', started.append, 'low', priority=-1, since=0)
+        pool.submit('http', started.append, 'normal', since=0)
+        pool.submit('http', started.append, 'high', priority=1, since=0)
+        pool.submit('http', lambda: done.set(), priority=-2)
+        assert pool.queued() == 4
+        assert pool.active() == {'http': 1}
+
+        release.set()
+        assert done.wait(5)
+        assert started == ['high', 'normal', 'low']
+        assert set(pool.wait_stats.snapshot()) == {'http/high', 'http/normal', 'http/low'}
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_wait_stats():
+    stats = WaitStats(window=10)
+    for seconds in range(20):
+        stats.record('http/normal', seconds)
+    s = stats.snapshot()['http/normal']
+    # Count and sum cover every job, percentiles the window
+    assert (s['count'], s['sum']) == (20, sum(range(20)))
+    assert (s['p50'], s['p95'], s['max']) == (15, 19, 19)
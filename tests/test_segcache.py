@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+import segcache
+from segcache import SegmentCache, copy_into, segment_key
+
+
+def test_segment_key():
+    plain = segment_key('http://a/seg0.ts')
+    assert segment_key('http://a/seg0.ts', byterange=(0, 99)) != plain
+    # The cache holds decrypted data, so the key and IV are part of the key
+    assert segment_key('http://a/seg0.ts', key='http://a/k1') != segment_key('http://a/seg0.ts', key='http://a/k2')
+    assert segment_key('http://a/seg0.ts', key='http://a/k1', iv='0x1') != segment_key('http://a/seg0.ts', key='http://a/k1')
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+    cache = SegmentCache(str(tmp_path), 300)
+    for key in ('aa1', 'bb2', 'cc3'):
+        cache.put(key, key.encode() * 33)
+    cache.open('aa1').close()
+    cache.put('dd4', b'x' * 99)
+
+    assert cache.usage() == (3, 3 * 99)
+    assert cache.open('bb2') is None
+    with cache.open('aa1') as f:
+        assert f.read() == b'aa1' * 33
+    # Larger than the whole cache
+    cache.put('ee5', b'x' * 301)
+    assert cache.open('ee5') is None
+
+
+def test_order_survives_restart(tmp_path):
+    cache = SegmentCache(str(tmp_path), 300)
+    for i, key in enumerate(('aa1', 'bb2', 'cc3')):
+        cache.put(key, b'x' * 100)
+        os.utime(cache._path(key), (1000 + i, 1000 + i))
+    os.utime(cache._path('aa1'), (2000, 2000))
+    # Left by a write that never finished
+    (tmp_path / 'bb' / 'bb9.1.tmp').write_bytes(b'x')
+
+    cache = SegmentCache(str(tmp_path), 200)
+    assert cache.usage() == (2, 200)
+    assert cache.open('bb2') is None
+    cache.open('aa1').close()
+    assert not (tmp_path / 'bb' / 'bb9.1.tmp').exists()
+
+
+@pytest.mark.parametrize('kernel_copy', [True, False])
+def test_copy_into_appends(tmp_path, monkeypatch, kernel_copy):
+    if not kernel_copy:
+        monkeypatch.delattr(segcache.os, 'copy_file_range', raising=False)
+    (tmp_path / 'seg').write_bytes(b'segment' * 1000)
+    with open(tmp_path / 'seg', 'rb') as src, open(tmp_path / 'out', 'wb') as dst:
+        dst.write(b'head')
+        assert copy_into(src, dst) == 7000
+        dst.write(b'tail')
+    assert (tmp_path / 'out').read_bytes() == b'head' + b'segment' * 1000 + b'tail'
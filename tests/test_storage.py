@@ -0,0 +1,126 @@
+from concurrent.futures import Future
+
+import pytest
+
+from storage import StorageManager
+
+
+class FakeRPC:
+    timeout = 1
+
+    def __init__(self):
+        self.statuses = {}
+        self.calls = []
+
+    def submit(self, method, params=None):
+        future = Future()
+        future.set_result(self.statuses[params[0]])
+        return future
+
+    def call(self, method, params=None):
+        self.calls.append((method, params[0]))
+
+    def change_option(self, gid, options):
+        self.calls.append(('aria2.changeOption', gid))
+
+
+class FakeAria2:
+    def __init__(self):
+        self._rpc = FakeRPC()
+
+    def rpc(self):
+        return self._rpc
+
+
+@pytest.fixture
+def download_dir(tmp_path):
+    download_dir = tmp_path / 'downloads'
+    download_dir.mkdir()
+    return download_dir
+
+
+def make_storage(download_dir, **kwargs):
+    # 90% / 80% of 1000 bytes
+    return StorageManager(str(download_dir), str(download_dir.parent / 'storage.db'), quota=1000, **kwargs)
+
+
+def add_file(storage, download_dir, name, size):
+    (download_dir / name).write_bytes(b'x' * size)
+    storage.add(name)
+
+
+def test_least_recently_used_are_evicted_to_low_watermark(download_dir):
+    storage = make_storage(download_dir)
+    evicted = []
+    storage.on_evict.append(evicted.append)
+    for name in ('a', 'b', 'c', 'd'):
+        add_file(storage, download_dir, name, 200)
+    storage.touch('a')
+
+    assert storage.usage() == (1000, 800)
+    assert storage.evict(extra=100) == 200
+    assert evicted == ['b']
+    assert storage.usage() == (1000, 600)
+    assert not (download_dir / 'b').exists()
+    assert 'a' in storage and 'b' not in storage
+    storage.stop()
+
+
+def test_admit_evicts_or_defers(download_dir):
+    storage = make_storage(download_dir)
+    (download_dir / 'video').mkdir()
+    (download_dir / 'video' / 'seg.ts').write_bytes(b'x' * 300)
+    storage.add('video')
+    add_file(storage, download_dir, 'a', 300)
+
+    assert storage.admit(1, 200)
+    # Needs the least recently used directory evicted
+    assert storage.admit(2, 300)
+    assert not (download_dir / 'video').exists()
+    # Running jobs are never evicted, this one waits
+    assert not storage.admit(3, 500)
+    storage.release(1)
+    assert storage.admit(3, 500)
+    assert 'a' not in storage
+    assert storage.too_large(901) and not storage.too_large(900)
+    storage.stop()
+
+
+def test_index_survives_restart(download_dir):
+    storage = make_storage(download_dir)
+    add_file(storage, download_dir, 'a', 100)
+    add_file(storage, download_dir, 'b', 100)
+    add_file(storage, download_dir, 'c', 100)
+    storage.touch('a')
+    storage.stop()
+    (download_dir / 'c').unlink()
+
+    storage = make_storage(download_dir)
+    assert storage.usage() == (1000, 200)
+    assert 'c' not in storage
+    # The access order is kept: b goes first
+    storage.evict(extra=650)
+    assert 'b' not in storage and 'a' in storage
+    storage.stop()
+
+
+def test_download_that_outgrows_the_quota_is_paused(download_dir):
+    aria2server = FakeAria2()
+    storage = make_storage(download_dir, aria2server=aria2server)
+    assert storage.admit(1, None)
+    assert storage.admit(2, 200)
+    storage.attach_aria2(1, 'metadata')
+    aria2server._rpc.statuses['metadata'] = {'status': 'complete', 'followedBy': ['torrent']}
+    storage._poll_aria2()
+
+    # The torrent turns out larger than what is left next to the other job
+    aria2server._rpc.statuses['torrent'] = {'status': 'active', 'totalLength': '850', 'completedLength': '10'}
+    storage._poll_aria2()
+    assert aria2server._rpc.calls == [('aria2.pause', 'torrent')]
+    storage._resume_paused()
+    assert len(aria2server._rpc.calls) == 1
+
+    storage.release(2)
+    storage._resume_paused()
+    assert aria2server._rpc.calls[1:] == [('aria2.changeOption', 'torrent'), ('aria2.unpause', 'torrent')]
+    storage.stop()
@@ -0,0 +1,44 @@
+import io
+import threading
+from types import SimpleNamespace
+
+from submit import Submitter, read_batches
+
+
+class FakeClient:
+    def __init__(self):
+        self.published = []
+
+    def max_inflight_messages_set(self, inflight):
+        self.inflight = inflight
+
+    def publish(self, topic, payload, qos=0):
+        self.published.append((topic, payload, qos))
+        return SimpleNamespace(rc=0)
+
+
+def test_read_batches():
+    f = io.StringIO('{"url": "a"}\n\n{"url": "b"}\nnot json\n{"url": "c"}\n')
+    assert list(read_batches(f, 2)) == [('{"url": "a"}\n{"url": "b"}', 2), ('{"url": "c"}', 1)]
+
+
+def test_inflight_window():
+    client = FakeClient()
+    submitter = Submitter(client, 'requests', inflight=2)
+    submitter.publish('a')
+    submitter.publish('b')
+
+    # The third message waits for an acknowledgement
+    thread = threading.Thread(target=submitter.publish, args=('c',))
+    thread.start()
+    thread.join(0.2)
+    assert thread.is_alive()
+    client.on_publish(client, None, 1)
+    thread.join(5)
+    assert [payload for topic, payload, qos in client.published] == ['a', 'b', 'c']
+    assert all(qos == 1 for topic, payload, qos in client.published)
+
+    assert not submitter.wait_acked(0.1)
+    client.on_publish(client, None, 2)
+    client.on_publish(client, None, 3)
+    assert submitter.wait_acked(1)
@@ -0,0 +1,101 @@
+import time
+from concurrent.futures import Future
+
+from supervisor import CANCELLED, STALLED, TIMEOUT, JobSupervisor
+
+
+class FakeRPC:
+    timeout = 1
+
+    def __init__(self):
+        self.statuses = {}
+        self.removed = []
+
+    def submit(self, method, params=None):
+        future = Future()
+        future.set_result(self.statuses[params[0]])
+        return future
+
+    def remove(self, gid):
+        self.removed.append(gid)
+
+
+class FakeAria2:
+    def __init__(self):
+        self._rpc = FakeRPC()
+
+    def rpc(self):
+        return self._rpc
+
+
+def start_job(supervisor, job_id, gid=None, cancel=None):
+    assert supervisor.begin({'id': job_id}, {'url': f"http://example.com/{job_id}"})
+    supervisor.attach(job_id, cancel=cancel, gid=gid)
+
+
+def test_magnet_is_followed_without_speed_floor():
+    aria2server = FakeAria2()
+    supervisor = JobSupervisor(aria2server)
+    start_job(supervisor, 1, gid='metadata')
+    aria2server._rpc.statuses['metadata'] = {'status': 'complete', 'completedLength': '100', 'followedBy': ['torrent']}
+
+    supervisor._poll_aria2()
+    assert supervisor.cancel(job_id=1) == 1
+    # The torrent is stopped, not the finished metadata download
+    assert aria2server._rpc.removed == ['torrent']
+    assert supervisor.finish(1) == CANCELLED
+
+
+def test_deadline():
+    supervisor = JobSupervisor(deadline=0.1)
+    cancelled = []
+    start_job(supervisor, 1, cancel=lambda: cancelled.append(1))
+    supervisor._check()
+    assert cancelled == []
+
+    time.sleep(0.15)
+    supervisor._check()
+    assert cancelled == [1]
+    assert supervisor.finish(1) == TIMEOUT
+
+
+def test_stalled_job_is_stopped():
+    supervisor = JobSupervisor(min_speed=1000, stall_time=0.2)
+    cancelled = []
+    start_job(supervisor, 1, cancel=lambda: cancelled.append(1))
+    supervisor.report(1, 0)
+    supervisor._check()
+    for size in (100, 200):
+        time.sleep(0.15)
+        supervisor.report(1, size)
+        supervisor._check()
+    assert cancelled == [1]
+    assert supervisor.finish(1) == STALLED
+
+
+def test_cancel_before_start():
+    supervisor = JobSupervisor()
+    assert supervisor.cancel(url='http://example.com/1') == 0
+    assert not supervisor.begin({'id': 1}, {'url': 'http://EXAMPLE.com/1'})
+
+
+def test_job_queued_in_aria2_is_not_stalled():
+    aria2server = FakeAria2()
+    supervisor = JobSupervisor(aria2server, min_speed=1000, stall_time=0.2)
+    cancelled = []
+    start_job(supervisor, 1, gid='gid1', cancel=lambda: cancelled.append(1))
+    aria2server._rpc.statuses['gid1'] = {'status': 'waiting', 'completedLength': '0'}
+    for _ in range(3):
+        supervisor._poll_aria2()
+        supervisor._check()
+        time.sleep(0.15)
+    assert cancelled == []
+
+    # Byte counts come from aria2 once the download runs
+    aria2server._rpc.statuses['gid1'] = {'status': 'active', 'completedLength': '100'}
+    for _ in range(3):
+        supervisor._poll_aria2()
+        supervisor._check()
+        time.sleep(0.15)
+    assert cancelled == [1]
+    assert supervisor.finish(1) == STALLED
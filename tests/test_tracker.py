@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+
+from aria2s import Aria2cServer
+from fake_aria2 import make_server
+from tracker import Aria2Tracker, status_error_message, status_file_path
+
+
+@pytest.fixture
+def aria2server():
+    server, fake = make_server(secret='test')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    aria2server = Aria2cServer(host='http://127.0.0.1', port=server.server_address[1], secret='test')
+    yield aria2server
+    aria2server.close()
+    server.shutdown()
+
+
+def test_restored_download_that_already_completed(aria2server):
+    # Added and finished while no tracker was listening, e.g. before a restart
+    gid = aria2server.add_download('http://example.com/a.bin', '/tmp', filename='a.bin')
+    time.sleep(0.2)
+    assert aria2server.resumable(gid)
+
+    tracker = Aria2Tracker(aria2server)
+    tracker.start()
+    done = threading.Event()
+    try:
+        tracker.track(gid, lambda status: done.set(), lambda status: None, check=True)
+        assert done.wait(5)
+        assert tracker.pending() == 0
+    finally:
+        tracker.stop()
+
+
+def test_check_does_not_dispatch_twice(aria2server):
+    tracker = Aria2Tracker(aria2server)
+    tracker.start()
+    calls = []
+    try:
+        gid = aria2server.add_download('http://example.com/b.bin', '/tmp', filename='b.bin')
+        tracker.track(gid, calls.append, calls.append, check=True)
+        time.sleep(1)
+        assert len(calls) == 1
+    finally:
+        tracker.stop()
+
+
+@pytest.fixture
+def slow_aria2server():
+    server, fake = make_server(secret='test', complete_after=0.3)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    aria2server = Aria2cServer(host='http://127.0.0.1', port=server.server_address[1], secret='test')
+    yield aria2server
+    aria2server.close()
+    server.shutdown()
+
+
+def test_completions_arrive_as_notifications(slow_aria2server):
+    tracker = Aria2Tracker(slow_aria2server)
+    tracker.start()
+    done = []
+    all_done = threading.Event()
+
+    def on_complete(status):
+        done.append(status_file_path(status))
+        if len(done) == 10:
+            all_done.set()
+
+    try:
+        # Give the listener time to connect before the downloads finish
+        time.sleep(0.1)
+        for i in range(10):
+            gid = slow_aria2server.add_download(f'http://example.com/{i}.bin', '/tmp', filename=f'{i}.bin')
+            tracker.track(gid, on_complete, lambda status: None)
+        assert tracker.pending() == 10
+        assert all_done.wait(5)
+        assert sorted(done) == sorted(f'{i}.bin' for i in range(10))
+        assert tracker.pending() == 0
+    finally:
+        tracker.stop()
+
+
+def test_notification_before_track(aria2server):
+    tracker = Aria2Tracker(aria2server)
+    tracker.start()
+    done = threading.Event()
+    try:
+        time.sleep(0.1)
+        gid = aria2server.add_download('http://example.com/a.bin', '/tmp', filename='a.bin')
+        # The notification is kept until the GID is tracked
+        time.sleep(0.3)
+        tracker.track(gid, lambda status: done.set(), lambda status: None)
+        assert done.wait(5)
+    finally:
+        tracker.stop()
+
+
+def test_reconcile_reports_removed_downloads(slow_aria2server):
+    tracker = Aria2Tracker(slow_aria2server)
+    errors = []
+    gid = slow_aria2server.add_download('http://example.com/a.bin', '/tmp', filename='a.bin')
+    tracker.track(gid, lambda status: None, errors.append)
+    slow_aria2server.rpc().remove(gid)
+
+    # As after a reconnect, when the stop notification may have been missed
+    tracker._reconcile()
+    assert [status['status'] for status in errors] == ['removed']
+    assert status_error_message(errors[0]) == "aria2 download removed"
+
+
+def test_status_file_path():
+    status = {'dir': '/downloads', 'files': [{'path': '/downloads/show/e01.mkv'}]}
+    # A multi-file torrent is reported by its top-level directory
+    assert status_file_path(status) == 'show'
+    assert status_file_path({'dir': '/downloads', 'files': [{'path': ''}]}) is None
+    assert status_error_message({'errorMessage': 'Not Found', 'errorCode': '3'}) == "Not Found (code 3)"